@@ -7,16 +7,38 @@ from datetime import timedelta
 from functools import wraps
 from datetime import datetime
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, g, make_response
 from werkzeug.utils import secure_filename
+from werkzeug.middleware.proxy_fix import ProxyFix
 import uuid
-from PIL import Image
+import base64
+import hashlib
+import click
+import schedule
 import mimetypes
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 from dotenv import load_dotenv
 
+from db_manager import DatabaseManager
+from migrations import run_migrations, PRIORITY_RANK_SQL, DUE_DATE_SORT_SQL
+from identity_cache import IdentityCache
+from user_stats import get_user_stats, get_data_version, check_user_stats, get_storage_usage, storage_usage_by_task
+from search import build_match_query, search_tasks, search_media, rebuild_search_index
+from retention import RetentionEngine, default_policies
+from session_store import SQLiteSessionInterface
+from registration_store import PendingRegistrationStore
+from rate_limit import RateLimiter
+from password_hasher import PasswordHasher, HashQueueFull
+from thumbnails import ThumbnailWorker, thumbnail_name, derived_files, load_variants, reuse_variants, IMAGE_EXTENSIONS
+from media_store import BlobStore, shard_path
+from chunked_upload import ChunkedUploadManager, UploadError, parse_checksum
+from media_serving import MediaServer
+from image_resizer import ResizeCache
+from upload_reconciler import UploadReconciler
+from file_deleter import FileDeletionWorker
+from media_metadata import extract_metadata, backfill_metadata, METADATA_FIELDS
+
 
 load_dotenv()
 # Import notification system after creating the app
@@ -37,10 +59,104 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 # Create upload directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-pending_users: dict[str, dict[str, str]] = {}
-
 DB_FILE = 'app.db'
-SESSION_FILE = 'session.json'
+DB_BUSY_TIMEOUT = int(os.getenv('DB_BUSY_TIMEOUT', 5000))  # milliseconds
+IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 1024))
+
+# Retention: how long rows of the append-only tables are kept
+RETENTION_LOG_DAYS = int(os.getenv('RETENTION_LOG_DAYS', 90))
+RETENTION_READ_NOTIFICATION_DAYS = int(os.getenv('RETENTION_READ_NOTIFICATION_DAYS', 30))
+RETENTION_UNREAD_NOTIFICATION_DAYS = int(os.getenv('RETENTION_UNREAD_NOTIFICATION_DAYS', 180))
+RETENTION_RESET_TOKEN_GRACE_DAYS = int(os.getenv('RETENTION_RESET_TOKEN_GRACE_DAYS', 1))
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR')  # unset: delete without archiving
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', 0))  # seconds; only for single-process deployments
+PENDING_REGISTRATION_TTL = int(os.getenv('PENDING_REGISTRATION_TTL', 600))  # seconds, matches the OTP email
+MAX_PENDING_REGISTRATIONS = int(os.getenv('MAX_PENDING_REGISTRATIONS', 10000))
+
+# Password hashing: werkzeug method string and the size of the dedicated hashing pool
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')  # e.g. 'scrypt:32768:8:1', 'pbkdf2:sha256:600000'
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_QUEUE = int(os.getenv('PASSWORD_HASH_QUEUE', 16))  # waiting hashes before requests get 503
+PASSWORD_HASH_RETRY_AFTER = int(os.getenv('PASSWORD_HASH_RETRY_AFTER', 2))  # seconds
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv('CHUNKED_UPLOAD_MAX_SIZE', MAX_CONTENT_LENGTH))  # bytes per resumable upload
+CHUNKED_UPLOAD_TTL = int(os.getenv('CHUNKED_UPLOAD_TTL', 86400))  # seconds an idle upload session is kept
+CHUNKED_UPLOAD_MAX_OPEN = int(os.getenv('CHUNKED_UPLOAD_MAX_OPEN', 5))  # unexpired sessions per user
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 2))  # processes rendering thumbnails
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '320,640,1280').split(','))  # WebP variant widths
+# Media serving: '' streams from Python, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd) hands off
+MEDIA_OFFLOAD = os.getenv('MEDIA_OFFLOAD', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/_media/')  # internal nginx location aliased to UPLOAD_FOLDER
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', 86400))  # seconds, for thumbnails; originals are immutable
+# Reverse proxies in front of the app (e.g. 1 for the nginx above). Their X-Forwarded-For/-Proto are trusted,
+# so rate limits key on the client's address rather than the proxy's. Leave 0 when clients connect directly.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 0))
+# On-demand resizing: allowed widths/heights and the disk budget of the LRU cache of rendered sizes.
+# The budget covers the whole directory, shared by all workers; each re-reads it every RESIZE_CACHE_RESCAN seconds.
+RESIZE_SIZES = tuple(int(s) for s in os.getenv('RESIZE_SIZES', '64,128,160,256,320,480,640,960,1280,1920').split(','))
+RESIZE_CACHE_DIR = os.getenv('RESIZE_CACHE_DIR', 'resize_cache')
+RESIZE_CACHE_MAX_BYTES = int(os.getenv('RESIZE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+RESIZE_CACHE_RESCAN = int(os.getenv('RESIZE_CACHE_RESCAN', 60))
+RESIZE_ACCEL_PREFIX = os.getenv('RESIZE_ACCEL_PREFIX', '/_resized/')  # internal nginx location aliased to RESIZE_CACHE_DIR
+# Per-user storage quotas; 0 means unlimited
+MEDIA_QUOTA_BYTES = int(os.getenv('MEDIA_QUOTA_BYTES', 0))
+MEDIA_QUOTA_FILES = int(os.getenv('MEDIA_QUOTA_FILES', 0))
+# Orphaned upload cleanup: files younger than the grace period are never touched
+UPLOAD_GC_GRACE_HOURS = float(os.getenv('UPLOAD_GC_GRACE_HOURS', 24))
+UPLOAD_GC_BATCH_SIZE = int(os.getenv('UPLOAD_GC_BATCH_SIZE', 200))  # files deleted per transaction
+
+# Rate limits ('<count>/<second|minute|hour|day>') per endpoint, per client IP and per account/email
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', '1') != '0'
+RATE_LIMITS = {
+    'login': {
+        'ip': os.getenv('RATE_LIMIT_LOGIN_IP', '20/minute'),
+        'account': os.getenv('RATE_LIMIT_LOGIN_ACCOUNT', '10/minute'),
+    },
+    'register': {
+        'ip': os.getenv('RATE_LIMIT_REGISTER_IP', '5/minute'),
+        'account': os.getenv('RATE_LIMIT_REGISTER_EMAIL', '5/hour'),
+    },
+    'otp_resend': {
+        'ip': os.getenv('RATE_LIMIT_OTP_RESEND_IP', '5/minute'),
+        'account': os.getenv('RATE_LIMIT_OTP_RESEND_ACCOUNT', '5/hour'),
+    },
+    'forgot_password': {
+        'ip': os.getenv('RATE_LIMIT_FORGOT_PASSWORD_IP', '5/minute'),
+        'account': os.getenv('RATE_LIMIT_FORGOT_PASSWORD_EMAIL', '3/hour'),
+    },
+}
+
+app.config['DB_BUSY_TIMEOUT'] = DB_BUSY_TIMEOUT
+app.config['IDENTITY_CACHE_SIZE'] = IDENTITY_CACHE_SIZE
+app.config['RETENTION_ARCHIVE_DIR'] = RETENTION_ARCHIVE_DIR
+app.config['SESSION_CACHE_TTL'] = SESSION_CACHE_TTL
+app.config['PENDING_REGISTRATION_TTL'] = PENDING_REGISTRATION_TTL
+app.config['MAX_PENDING_REGISTRATIONS'] = MAX_PENDING_REGISTRATIONS
+app.config['PASSWORD_HASH_METHOD'] = PASSWORD_HASH_METHOD
+app.config['PASSWORD_HASH_WORKERS'] = PASSWORD_HASH_WORKERS
+app.config['PASSWORD_HASH_QUEUE'] = PASSWORD_HASH_QUEUE
+app.config['CHUNKED_UPLOAD_MAX_SIZE'] = CHUNKED_UPLOAD_MAX_SIZE
+app.config['CHUNKED_UPLOAD_TTL'] = CHUNKED_UPLOAD_TTL
+app.config['CHUNKED_UPLOAD_MAX_OPEN'] = CHUNKED_UPLOAD_MAX_OPEN
+app.config['THUMBNAIL_WORKERS'] = THUMBNAIL_WORKERS
+app.config['THUMBNAIL_WIDTHS'] = THUMBNAIL_WIDTHS
+app.config['MEDIA_OFFLOAD'] = MEDIA_OFFLOAD
+app.config['MEDIA_ACCEL_PREFIX'] = MEDIA_ACCEL_PREFIX
+app.config['MEDIA_MAX_AGE'] = MEDIA_MAX_AGE
+app.config['TRUSTED_PROXY_HOPS'] = TRUSTED_PROXY_HOPS
+app.config['RESIZE_SIZES'] = RESIZE_SIZES
+app.config['RESIZE_CACHE_DIR'] = RESIZE_CACHE_DIR
+app.config['RESIZE_CACHE_MAX_BYTES'] = RESIZE_CACHE_MAX_BYTES
+app.config['RESIZE_CACHE_RESCAN'] = RESIZE_CACHE_RESCAN
+app.config['RESIZE_ACCEL_PREFIX'] = RESIZE_ACCEL_PREFIX
+app.config['UPLOAD_GC_GRACE_HOURS'] = UPLOAD_GC_GRACE_HOURS
+app.config['MEDIA_QUOTA_BYTES'] = MEDIA_QUOTA_BYTES
+app.config['MEDIA_QUOTA_FILES'] = MEDIA_QUOTA_FILES
+app.config['UPLOAD_GC_BATCH_SIZE'] = UPLOAD_GC_BATCH_SIZE
+app.config['RATE_LIMIT_ENABLED'] = RATE_LIMIT_ENABLED
+app.config['RATE_LIMITS'] = RATE_LIMITS
+
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
 
 # Brevo API Key - IMPORTANT: Move this to environment variables in production
 BREVO_API_KEY = os.getenv('BREVO_API_KEY')
@@ -49,10 +165,45 @@ BREVO_API_KEY = os.getenv('BREVO_API_KEY')
 notification_system = None
 
 # --- Database Setup ---
-def get_db():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+db = DatabaseManager(DB_FILE, busy_timeout=DB_BUSY_TIMEOUT)
+identity_cache = IdentityCache(db, max_size=IDENTITY_CACHE_SIZE)
+app.session_interface = SQLiteSessionInterface(db, cache_ttl=SESSION_CACHE_TTL)
+pending_registrations = PendingRegistrationStore(
+    db, ttl=PENDING_REGISTRATION_TTL, max_pending=MAX_PENDING_REGISTRATIONS)
+rate_limiter = RateLimiter(db, RATE_LIMITS, enabled=RATE_LIMIT_ENABLED)
+password_hasher = PasswordHasher(PASSWORD_HASH_METHOD, max_workers=PASSWORD_HASH_WORKERS,
+                                 max_queue=PASSWORD_HASH_QUEUE)
+blob_store = BlobStore(UPLOAD_FOLDER, lambda filenames: delete_media_files(filenames))
+chunked_uploads = ChunkedUploadManager(db, UPLOAD_FOLDER, CHUNKED_UPLOAD_MAX_SIZE, ttl=CHUNKED_UPLOAD_TTL,
+                                       max_open=CHUNKED_UPLOAD_MAX_OPEN)
+thumbnail_worker = ThumbnailWorker(db, UPLOAD_FOLDER, processes=THUMBNAIL_WORKERS, widths=THUMBNAIL_WIDTHS)
+media_server = MediaServer(UPLOAD_FOLDER, offload=MEDIA_OFFLOAD, accel_prefix=MEDIA_ACCEL_PREFIX,
+                           max_age=MEDIA_MAX_AGE)
+resize_cache = ResizeCache(RESIZE_CACHE_DIR, RESIZE_CACHE_MAX_BYTES, sizes=RESIZE_SIZES,
+                           rescan_interval=RESIZE_CACHE_RESCAN)
+resized_media_server = MediaServer(RESIZE_CACHE_DIR, offload=MEDIA_OFFLOAD, accel_prefix=RESIZE_ACCEL_PREFIX,
+                                   max_age=MEDIA_MAX_AGE)
+file_deleter = FileDeletionWorker(db, lambda filename: [media_path(filename)] + derived_files(UPLOAD_FOLDER, filename))
+upload_reconciler = UploadReconciler(db, UPLOAD_FOLDER, thumbnail_worker.enqueue,
+                                     grace_seconds=UPLOAD_GC_GRACE_HOURS * 3600, batch_size=UPLOAD_GC_BATCH_SIZE)
+retention_engine = RetentionEngine(
+    db,
+    default_policies(
+        log_days=RETENTION_LOG_DAYS,
+        read_notification_days=RETENTION_READ_NOTIFICATION_DAYS,
+        unread_notification_days=RETENTION_UNREAD_NOTIFICATION_DAYS,
+        reset_token_grace_days=RETENTION_RESET_TOKEN_GRACE_DAYS,
+    ),
+    archive_dir=RETENTION_ARCHIVE_DIR,
+)
+
+def get_db(readonly=False):
+    """Check out this thread's pooled connection; read-only ones never wait on writers"""
+    return db.connect(readonly=readonly)
+
+@app.teardown_appcontext
+def release_db(exception=None):
+    db.reset()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -61,68 +212,147 @@ def is_video_file(filename):
     video_extensions = {'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in video_extensions
 
-def create_thumbnail(filepath, thumbnail_path, size=(300, 300)):
-    """Create thumbnail for images"""
-    try:
-        with Image.open(filepath) as img:
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            img.save(thumbnail_path, optimize=True, quality=85)
-        return True
-    except Exception as e:
-        print(f"Error creating thumbnail: {e}")
-        return False
+def thumbnail_fields(row, variants=None):
+    """thumbnail_status, plus srcset-ready variants once the background worker has rendered them"""
+    variants = [{
+        'width': variant['width'],
+        'height': variant['height'],
+        'url': media_url(variant['filename']),
+    } for variant in variants or []]
+    if variants:
+        thumbnail_url = variants[0]['url']
+    elif row['thumbnail_status'] == 'ready':
+        thumbnail_url = media_url(thumbnail_name(row['filename']))
+    else:
+        thumbnail_url = None
+    return {
+        'thumbnail_status': row['thumbnail_status'],
+        'thumbnail_url': thumbnail_url,
+        'variants': variants,
+        'srcset': ', '.join(f"{variant['url']} {variant['width']}w" for variant in variants),
+    }
+
+def metadata_fields(row):
+    """Display dimensions, EXIF orientation, capture time and duration read at upload"""
+    return {field: row[field] for field in METADATA_FIELDS}
+
+def delete_media_files(filenames):
+    """Remove uploaded files and their thumbnails, logging failures"""
+    folder = app.config['UPLOAD_FOLDER']
+    for filename in filenames:
+        for filepath in [media_path(filename)] + derived_files(folder, filename):
+            try:
+                if os.path.exists(filepath):
+                    os.remove(filepath)
+            except Exception as file_error:
+                print(f"Error deleting media file: {file_error}")
+
+def media_path(filename):
+    """Filesystem path of a stored upload or derived file (filename is relative to the upload folder)"""
+    return blob_store.path(filename)
+
+def media_url(filename):
+    """Public URL of a stored upload or derived file"""
+    return url_for('serve_media', filename=filename)
+
+def insert_media(conn, user_id, task_id, temp_path, filename, original_filename, file_type, file_size,
+                 description, metadata):
+    """Record a received upload and move its file into place; returns the new media id.
+
+    `metadata` comes from extract_metadata(), read before the transaction.
+    The caller holds the write transaction (BEGIN IMMEDIATE) and commits.
+    """
+    # Images get a thumbnail from the background worker
+    thumbnail_status = 'pending' if file_type in IMAGE_EXTENSIONS else 'none'
+    c = conn.execute('''INSERT INTO media (user_id, task_id, filename, original_filename, 
+                       file_type, file_size, description, thumbnail_status,
+                       width, height, orientation, captured_at, duration, metadata_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (user_id, task_id if task_id else None, filename,
+                      original_filename, file_type, file_size, description, thumbnail_status,
+                      *(metadata[field] for field in METADATA_FIELDS), time.time()))
+    media_id = c.lastrowid
+    if thumbnail_status == 'pending':
+        if reuse_variants(conn, media_id, filename):
+            conn.execute("UPDATE media SET thumbnail_status = 'ready' WHERE id = ?", (media_id,))
+        else:
+            thumbnail_worker.enqueue(conn, media_id)
+    blob_store.place(temp_path, filename)
+    return media_id
+
+def serialize_media(row, variants=None):
+    return {
+        'id': row['id'],
+        'filename': row['filename'],
+        'original_filename': row['original_filename'],
+        'file_type': row['file_type'],
+        'file_size': row['file_size'],
+        'upload_date': row['upload_date'],
+        'description': row['description'],
+        'task_id': row['task_id'],
+        'url': media_url(row['filename']),
+        'is_video': is_video_file(row['filename']),
+        **metadata_fields(row),
+        **thumbnail_fields(row, variants)
+    }
+
+def load_media(conn, media_id):
+    """Serialized media row, for responses after an upload commits"""
+    row = conn.execute('SELECT * FROM media WHERE id = ?', (media_id,)).fetchone()
+    return serialize_media(row, load_variants(conn, [media_id]).get(media_id))
+
+def release_media_files(conn, filenames):
+    """Queue removal of stored files no media row references any more.
+
+    Call in the transaction that deleted the media rows, and
+    file_deleter.notify() once it has committed.
+    """
+    file_deleter.enqueue(conn, filenames)
+
+# Multipart framing around an uploaded file; Content-Length minus this bounds the file size
+MULTIPART_OVERHEAD = 16 * 1024
+
+def storage_usage(files, used):
+    return {'files': files, 'bytes': used,
+            'quota_files': MEDIA_QUOTA_FILES or None, 'quota_bytes': MEDIA_QUOTA_BYTES or None}
+
+def quota_exceeded(conn, user_id, size, reserved=(0, 0)):
+    """Return a 413 response when one more file of `size` bytes would exceed the user's quota, else None.
+
+    Reads the user_stats counters, so the check costs one primary-key lookup.
+    `reserved` is (files, bytes) already promised to uploads in progress.
+    """
+    files, used = get_storage_usage(conn, user_id)
+    if MEDIA_QUOTA_FILES and files + reserved[0] + 1 > MEDIA_QUOTA_FILES:
+        error = f'File limit reached ({MEDIA_QUOTA_FILES} files)'
+    elif MEDIA_QUOTA_BYTES and used + reserved[1] + size > MEDIA_QUOTA_BYTES:
+        error = f'Storage quota exceeded ({used} of {MEDIA_QUOTA_BYTES} bytes used)'
+    else:
+        return None
+    response = jsonify({'success': False, 'error': error, 'usage': storage_usage(files, used)})
+    response.status_code = 413
+    return response
+
+def rate_limited(endpoint, account=None):
+    """Return a 429 response when the caller is over the endpoint's limit, else None"""
+    allowed, retry_after = rate_limiter.hit(endpoint, ip=request.remote_addr, account=account)
+    if allowed:
+        return None
+    response = make_response(
+        f'<div data-rate-limited>Too many attempts. Please try again in {retry_after} seconds.</div>', 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def server_busy():
+    """503 for when the password hashing pool is saturated"""
+    response = make_response('<div data-server-busy>The server is busy. Please try again in a few seconds.</div>', 503)
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response
 
 def init_db():
+    """Bring the database schema up to date"""
     conn = get_db()
-    c = conn.cursor()
-
-    # Users table with email field
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        email TEXT UNIQUE NOT NULL
-    )''')
-
-    # Tasks table
-    c.execute('''CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        title TEXT NOT NULL,
-        due_date DATE,
-        priority TEXT DEFAULT 'medium',
-        completed INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )''')
-    
-    # Media table for file uploads
-    c.execute('''CREATE TABLE IF NOT EXISTS media (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        task_id INTEGER,
-        filename TEXT NOT NULL,
-        original_filename TEXT NOT NULL,
-        file_type TEXT NOT NULL,
-        file_size INTEGER NOT NULL,
-        upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        description TEXT,
-        FOREIGN KEY(user_id) REFERENCES users(id),
-        FOREIGN KEY(task_id) REFERENCES tasks(id)
-    )''')
-    
-    # Password reset tokens table
-    c.execute('''CREATE TABLE IF NOT EXISTS password_reset_tokens (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        token TEXT UNIQUE NOT NULL,
-        expires_at TIMESTAMP NOT NULL,
-        used INTEGER DEFAULT 0,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY(user_id) REFERENCES users(id)
-    )''')
-    
-    conn.commit()
+    run_migrations(conn)
     conn.close()
 
 def send_otp_email(to_email, otp):
@@ -216,32 +446,54 @@ def send_password_reset_email(to_email, username, reset_url):
         print(f"General error sending password reset email: {e}")
         return False
 
-# --- Persistent Session (JSON) ---
-def load_session():
-    if not os.path.exists(SESSION_FILE):
-        return {}
-    try:
-        with open(SESSION_FILE, 'r') as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_session(sess):
-    try:
-        with open(SESSION_FILE, 'w') as f:
-            json.dump(sess, f)
-    except Exception as e:
-        print(f"Error saving session: {e}")
-
 # --- Auth Decorator ---
 def login_required(f):
+    """Require a logged-in user and expose their id as g.user_id"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'username' not in session:
             return redirect(url_for('login'))
+        user_id = session.get('user_id')
+        if user_id is None:
+            # Sessions created before the id was stored at login
+            user_id = identity_cache.get_user_id(session['username'])
+            if user_id is None:
+                session.pop('username', None)
+                return redirect(url_for('login'))
+            session['user_id'] = user_id
+        g.user_id = user_id
         return f(*args, **kwargs)
     return decorated_function
 
+def conditional_on_data_version(f):
+    """Answer GETs with 304 Not Modified while the user's data version is unchanged.
+
+    The ETag covers the user's data version, the full request path and today's
+    date (overdue counts change at midnight), so an idle tab polling an
+    endpoint costs one primary-key lookup.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET':
+            return f(*args, **kwargs)
+        
+        conn = get_db(readonly=True)
+        version = get_data_version(conn, g.user_id)
+        conn.close()
+        
+        tag_source = f"{g.user_id}:{version}:{datetime.now().date()}:{request.full_path}"
+        etag = hashlib.sha1(tag_source.encode()).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return decorated_function
+
 def calculate_task_progress(task, media_timeline):
     """Calculate task progress based on media uploads and completion status"""
     if task['completed']:
@@ -284,7 +536,7 @@ def check_task_notifications(user_id, task_data):
         tomorrow = today + timedelta(days=1)
         
         # Get user info
-        conn = get_db()
+        conn = get_db(readonly=True)
         c = conn.cursor()
         c.execute('SELECT username, email FROM users WHERE id = ?', (user_id,))
         user = c.fetchone()
@@ -415,11 +667,15 @@ def register():
         if request.form.get('resend') == 'true':
             if 'pending_user' in session:
                 username = session['pending_user']
-                user_data = pending_users.get(username)
+                limited = rate_limited('otp_resend', account=username)
+                if limited:
+                    return limited
+                user_data = pending_registrations.get(username)
                 if user_data:
                     # Generate new OTP
                     new_otp = str(random.randint(100000, 999999))
-                    pending_users[username]['otp'] = new_otp
+                    if not pending_registrations.set_otp(username, new_otp):
+                        return '<div data-session-expired></div>'
                     
                     print(f"Resending OTP for {username}: {new_otp}")  # Debug log
                     
@@ -442,6 +698,10 @@ def register():
         if len(password) < 6:
             return '<div data-validation-error>Password must be at least 6 characters</div>'
 
+        limited = rate_limited('register', account=email)
+        if limited:
+            return limited
+
         conn = get_db()
         c = conn.cursor()
         
@@ -461,11 +721,12 @@ def register():
 
         # Generate OTP and store user data
         otp = str(random.randint(100000, 999999))
-        pending_users[username] = {
-            'password': generate_password_hash(password), 
-            'email': email, 
-            'otp': otp
-        }
+        try:
+            password_hash = password_hasher.hash(password)
+        except HashQueueFull:
+            return server_busy()
+        if not pending_registrations.put(username, email, password_hash, otp):
+            return '<div data-validation-error>Too many pending registrations. Please try again later.</div>'
         
         print(f"Generated OTP for {username}: {otp}")  # Debug log
         print(f"Sending OTP to email: {email}")  # Debug log
@@ -477,8 +738,7 @@ def register():
             return '<div data-otp-sent></div>'
         else:
             # Clean up pending user if email failed
-            if username in pending_users:
-                del pending_users[username]
+            pending_registrations.delete(username)
             return '<div data-otp-failed></div>'
 
     return render_template('login.html')
@@ -492,7 +752,11 @@ def verify_otp():
 
     if request.method == 'POST':
         user_input = request.form.get('otp', '').strip()
-        user_data = pending_users.get(username)
+        user_data = pending_registrations.get(username)
+
+        if user_data and user_input != user_data['otp']:
+            # The OTP may have been resent through another worker
+            user_data = pending_registrations.get(username, fresh=True)
 
         if not user_data:
             return '<div data-invalid-otp>Registration session expired. Please register again.</div>'
@@ -505,9 +769,10 @@ def verify_otp():
                          (username, user_data['password'], user_data['email']))
                 conn.commit()
                 conn.close()
+                identity_cache.invalidate(username)
                 
                 # Clean up
-                del pending_users[username]
+                pending_registrations.delete(username)
                 session.pop('pending_user', None)
                 
                 return '<div data-register-success></div>'
@@ -528,25 +793,45 @@ def login():
         if not username or not password:
             return '<div data-validation-error>Username and password are required</div>'
         
-        conn = get_db()
+        limited = rate_limited('login', account=username)
+        if limited:
+            return limited
+        
+        conn = get_db(readonly=True)
         c = conn.cursor()
-        c.execute('SELECT password FROM users WHERE username = ?', (username,))
+        c.execute('SELECT id, password FROM users WHERE username = ?', (username,))
         row = c.fetchone()
         conn.close()
         
-        if row and check_password_hash(row['password'], password):
+        try:
+            valid = bool(row) and password_hasher.verify(row['password'], password)
+        except HashQueueFull:
+            return server_busy()
+        
+        if valid:
+            if password_hasher.needs_rehash(row['password']):
+                # Hash parameters changed since this password was set; upgrade it now that we know it
+                try:
+                    new_hash = password_hasher.hash(password)
+                    conn = get_db()
+                    conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                                 (new_hash, row['id'], row['password']))
+                    conn.commit()
+                    conn.close()
+                except Exception as e:
+                    print(f"Error upgrading password hash: {e}")
+            session.regenerate()
             session['username'] = username
+            session['user_id'] = row['id']
             session.permanent = True
-            # Save persistent session
-            save_session({'username': username})
+            identity_cache.put(username, row['id'])
             return '<div data-login-success></div>'
         return '<div data-login-error>Invalid username or password</div>'
     return render_template('login.html')
 
 @app.route('/logout')
 def logout():
-    session.pop('username', None)
-    save_session({})
+    session.clear()
     return redirect(url_for('login'))
 
 @app.route('/forgot-password', methods=['GET', 'POST'])
@@ -557,7 +842,11 @@ def forgot_password():
         if not email:
             return '<div data-validation-error>Email address is required</div>'
         
-        conn = get_db()
+        limited = rate_limited('forgot_password', account=email)
+        if limited:
+            return limited
+        
+        conn = get_db(readonly=True)
         c = conn.cursor()
         c.execute('SELECT id, username FROM users WHERE email = ?', (email,))
         user = c.fetchone()
@@ -631,7 +920,11 @@ def reset_password(token):
             return '<div data-invalid-token>Reset link has expired</div>'
         
         # Update password
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = password_hasher.hash(password)
+        except HashQueueFull:
+            conn.close()
+            return server_busy()
         c.execute('UPDATE users SET password = ? WHERE id = ?', (hashed_password, token_data['user_id']))
         
         # Mark token as used
@@ -639,11 +932,12 @@ def reset_password(token):
         
         conn.commit()
         conn.close()
+        identity_cache.invalidate(token_data['username'])
         
         return '<div data-reset-success>Password reset successfully. You can now login with your new password.</div>'
     
     # GET request - show reset form
-    conn = get_db()
+    conn = get_db(readonly=True)
     c = conn.cursor()
     c.execute('''SELECT used, expires_at 
                  FROM password_reset_tokens 
@@ -673,37 +967,161 @@ def reset_password(token):
 def dashboard():
     return render_template('dashboard.html', username=session['username'])
 
+@app.route('/media/<path:filename>')
+def serve_media(filename):
+    """Uploads and their thumbnails, with Range requests, ETags and proxy offload"""
+    response = media_server.response(request, filename)
+    if response is None:
+        return 'Not found', 404
+    return response
+
+@app.route('/media/<int:media_id>/resize')
+@login_required
+def resize_media(media_id):
+    """One of the user's images at an allowed size: ?w=&h=&fit=contain|cover&fmt=webp|jpeg|png"""
+    try:
+        spec = resize_cache.parse(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    conn = get_db(readonly=True)
+    row = conn.execute('SELECT filename, file_type FROM media WHERE id = ? AND user_id = ?',
+                       (media_id, g.user_id)).fetchone()
+    conn.close()
+    if row is None or row['file_type'] not in IMAGE_EXTENSIONS:
+        return jsonify({'success': False, 'error': 'Image not found'}), 404
+
+    # A second attempt covers an entry evicted between rendering and sending
+    for _ in range(2):
+        try:
+            name = resize_cache.get(media_path(row['filename']), row['filename'], spec)
+        except FileNotFoundError:
+            return jsonify({'success': False, 'error': 'Image not found'}), 404
+        except Exception as e:
+            print(f"Error resizing media {media_id}: {e}")
+            return jsonify({'success': False, 'error': 'Could not resize image'}), 500
+        response = resized_media_server.response(request, name)
+        if response is not None:
+            # Behind a login, so shared caches must not keep it
+            response.cache_control.public = False
+            response.cache_control.private = True
+            return response
+    return jsonify({'success': False, 'error': 'Could not resize image'}), 500
+
 @app.route('/gallery')
 @login_required
 def gallery():
     return render_template('gallery.html', username=session['username'])
 
+# --- Task list pagination ---
+TASK_PAGE_DEFAULT_LIMIT = 50
+TASK_PAGE_MAX_LIMIT = 200
+TASK_PAGE_PARAMS = {'limit', 'cursor', 'sort', 'order', 'completed', 'priority', 'due_from', 'due_to'}
+
+# sort name -> (SQL sort expression, default order); each expression has a matching index
+TASK_SORTS = {
+    'created_at': ('created_at', 'desc'),
+    'due_date': (DUE_DATE_SORT_SQL, 'asc'),
+    'priority': (PRIORITY_RANK_SQL, 'asc'),
+}
+
+def encode_cursor(sort_value, task_id):
+    payload = json.dumps([sort_value, task_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, task_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    if sort_value is not None and (isinstance(sort_value, bool) or not isinstance(sort_value, (str, int))):
+        # Only scalars can be bound as query parameters
+        raise ValueError('Invalid cursor')
+    return sort_value, int(task_id)
+
+def parse_date_arg(value):
+    datetime.strptime(value, '%Y-%m-%d')
+    return value
+
+def fetch_task_page(c, user_id, args):
+    """Fetch one keyset-paginated, filtered page of a user's tasks.
+
+    Raises ValueError for malformed arguments.
+    """
+    sort = args.get('sort', 'created_at')
+    if sort not in TASK_SORTS:
+        raise ValueError(f'Unknown sort: {sort}')
+    sort_sql, order = TASK_SORTS[sort]
+    order = args.get('order', order).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError(f'Unknown order: {order}')
+
+    limit = int(args.get('limit', TASK_PAGE_DEFAULT_LIMIT))
+    limit = max(1, min(limit, TASK_PAGE_MAX_LIMIT))
+
+    where = ['user_id = ?']
+    params = [user_id]
+
+    completed = args.get('completed')
+    if completed is not None:
+        where.append('completed = ?')
+        params.append(1 if completed.lower() in ('true', '1', 'yes') else 0)
+
+    priorities = [p for p in args.get('priority', '').split(',') if p]
+    if priorities:
+        where.append(f"priority IN ({','.join('?' for _ in priorities)})")
+        params.extend(priorities)
+
+    if args.get('due_from'):
+        where.append('due_date >= ?')
+        params.append(parse_date_arg(args['due_from']))
+    if args.get('due_to'):
+        where.append('due_date <= ?')
+        params.append(parse_date_arg(args['due_to']))
+
+    cursor = args.get('cursor')
+    if cursor:
+        try:
+            sort_value, last_id = decode_cursor(cursor)
+        except Exception:
+            raise ValueError('Invalid cursor')
+        where.append(f"({sort_sql}, id) {'<' if order == 'desc' else '>'} (?, ?)")
+        params.extend([sort_value, last_id])
+
+    query = f'''SELECT *, {sort_sql} AS sort_value FROM tasks
+                WHERE {' AND '.join(where)}
+                ORDER BY {sort_sql} {order.upper()}, id {order.upper()}
+                LIMIT ?'''
+    c.execute(query, params + [limit + 1])
+    rows = c.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1]['sort_value'], rows[-1]['id']) if has_more else None
+    return rows, next_cursor
+
 # Enhanced Task API routes with notification integration
 @app.route('/api/tasks', methods=['GET', 'POST'])
 @login_required
+@conditional_on_data_version
 def tasks_api():
-    username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=request.method == 'GET')
     c = conn.cursor()
     
-    # Get user ID
-    try:
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-    except Exception as e:
-        conn.close()
-        return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
-    
     if request.method == 'GET':
         try:
-            # Get all tasks for the user
-            c.execute('SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+            paginated = bool(TASK_PAGE_PARAMS & set(request.args))
+            if paginated:
+                try:
+                    rows, next_cursor = fetch_task_page(c, user_id, request.args)
+                except ValueError as e:
+                    conn.close()
+                    return jsonify({'success': False, 'error': str(e)}), 400
+            else:
+                # Legacy clients get every task in one response
+                c.execute('SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+                rows = c.fetchall()
             tasks = []
-            for row in c.fetchall():
+            for row in rows:
                 tasks.append({
                     'id': row['id'],
                     'title': row['title'],
@@ -713,6 +1131,8 @@ def tasks_api():
                     'created_at': row['created_at'] if 'created_at' in row.keys() else ''
                 })
             conn.close()
+            if paginated:
+                return jsonify({'success': True, 'tasks': tasks, 'next_cursor': next_cursor})
             return jsonify({'success': True, 'tasks': tasks})
         except Exception as e:
             conn.close()
@@ -784,22 +1204,10 @@ def tasks_api():
 @app.route('/api/tasks/<int:task_id>', methods=['PUT', 'DELETE'])
 @login_required
 def task_detail_api(task_id):
-    username = session['username']
+    user_id = g.user_id
     conn = get_db()
     c = conn.cursor()
     
-    # Get user ID
-    try:
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-    except Exception as e:
-        conn.close()
-        return jsonify({'success': False, 'error': f'Database error: {str(e)}'}), 500
-    
     if request.method == 'PUT':
         try:
             # Handle both JSON and form data
@@ -895,29 +1303,20 @@ def task_detail_api(task_id):
             
             task_title = task_row['title']
             
-            # Delete associated media files first
+            # Find associated media files
             c.execute('SELECT filename FROM media WHERE task_id = ? AND user_id = ?', (task_id, user_id))
-            media_files = c.fetchall()
-            
-            # Delete media files from filesystem
-            for media in media_files:
-                try:
-                    filepath = os.path.join(app.config['UPLOAD_FOLDER'], media['filename'])
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                    # Delete thumbnail
-                    thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], f"thumb_{media['filename']}")
-                    if os.path.exists(thumbnail_path):
-                        os.remove(thumbnail_path)
-                except Exception as file_error:
-                    print(f"Error deleting media file: {file_error}")
+            media_files = [media['filename'] for media in c.fetchall()]
             
             # Delete media records
             c.execute('DELETE FROM media WHERE task_id = ? AND user_id = ?', (task_id, user_id))
             
             # Delete task
             c.execute('DELETE FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
+            
+            # Files no other media still uses are removed in the background
+            release_media_files(conn, media_files)
             conn.commit()
+            file_deleter.notify()
             
             # Create deletion notification
             if notification_system:
@@ -940,43 +1339,223 @@ def task_detail_api(task_id):
             print(f"Error deleting task: {str(e)}")
             return jsonify({'success': False, 'error': f'Failed to delete task: {str(e)}'}), 500
 
-@app.route('/api/stats')
+BATCH_MAX_OPERATIONS = 500
+BATCH_UPDATE_FIELDS = ('title', 'due_date', 'priority', 'completed')
+
+def serialize_task(row):
+    return {
+        'id': row['id'],
+        'title': row['title'],
+        'due_date': row['due_date'],
+        'priority': row['priority'],
+        'completed': bool(row['completed']),
+        'created_at': row['created_at'] if 'created_at' in row.keys() else ''
+    }
+
+def parse_completed(value):
+    if isinstance(value, str):
+        return value.lower() in ('true', '1', 'yes', 'on')
+    return bool(value)
+
+@app.route('/api/tasks/batch', methods=['POST'])
 @login_required
-def stats_api():
-    username = session['username']
+def tasks_batch_api():
+    """Apply many task creates, updates and deletes in one transaction.
+
+    Body: {"operations": [{"op": "create", "title": ..., "due_date": ..., "priority": ...},
+                          {"op": "update", "id": 1, "completed": true, ...},
+                          {"op": "delete", "id": 2}]}
+    Returns one result per operation, in request order. Invalid operations are
+    reported and skipped; the valid ones are written with executemany and a
+    single commit. Updates of the same task are merged in request order.
+    Updates of a task deleted later in the batch are reported as superseded;
+    operations on a task deleted earlier fail with "Task not found".
+    Completion and deletion notifications and media file cleanup run once,
+    after the commit. Due-date emails are left to the
+    scheduled checks so a large batch does not send one email per task.
+    """
+    user_id = g.user_id
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'success': False, 'error': 'operations must be a non-empty list'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_OPERATIONS} operations per batch'}), 400
+    
+    results = [None] * len(operations)
+    creates = []   # (index, title, due_date, priority)
+    updates = []   # (index, task_id, {field: value})
+    deletes = []   # (index, task_id)
+    
+    # Validate every operation before touching the database
+    for index, op in enumerate(operations):
+        if not isinstance(op, dict):
+            results[index] = {'success': False, 'error': 'Operation must be an object'}
+            continue
+        kind = op.get('op')
+        invalid = [key for key in ('title', 'due_date', 'priority')
+                   if op.get(key) is not None and not isinstance(op[key], str)]
+        if kind in ('create', 'update') and invalid:
+            # Anything else cannot be bound as a column value
+            results[index] = {'success': False, 'error': f"{', '.join(invalid)} must be a string"}
+            continue
+        if kind == 'create':
+            title = (op.get('title') or '').strip()
+            if not title:
+                results[index] = {'success': False, 'error': 'Task title is required'}
+                continue
+            creates.append((index, title, op.get('due_date') or None, op.get('priority', 'medium')))
+        elif kind in ('update', 'delete'):
+            try:
+                task_id = int(op.get('id'))
+            except (TypeError, ValueError):
+                results[index] = {'success': False, 'error': 'Task id is required'}
+                continue
+            if kind == 'delete':
+                deletes.append((index, task_id))
+                continue
+            fields = {}
+            if op.get('title') and op['title'].strip():
+                fields['title'] = op['title'].strip()
+            if 'due_date' in op:
+                fields['due_date'] = op['due_date'] or None
+            if 'priority' in op:
+                fields['priority'] = op['priority']
+            if 'completed' in op:
+                fields['completed'] = 1 if parse_completed(op['completed']) else 0
+            if not fields:
+                results[index] = {'success': False, 'error': 'No valid fields to update'}
+                continue
+            updates.append((index, task_id, fields))
+        else:
+            results[index] = {'success': False, 'error': f'Unknown op: {kind}'}
+    
     conn = get_db()
     c = conn.cursor()
     
     try:
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-        
-        # Get task statistics
-        c.execute('SELECT COUNT(*) as total FROM tasks WHERE user_id = ?', (user_id,))
-        total_tasks = c.fetchone()['total']
-        
-        c.execute('SELECT COUNT(*) as completed FROM tasks WHERE user_id = ? AND completed = 1', (user_id,))
-        completed_tasks = c.fetchone()['completed']
-        
-        c.execute('SELECT COUNT(*) as pending FROM tasks WHERE user_id = ? AND completed = 0', (user_id,))
-        pending_tasks = c.fetchone()['pending']
-        
-        # Get overdue tasks
-        c.execute('''SELECT COUNT(*) as overdue FROM tasks 
-                    WHERE user_id = ? AND completed = 0 AND due_date IS NOT NULL AND due_date < date('now')''', (user_id,))
-        overdue_tasks = c.fetchone()['overdue']
+        c.execute('BEGIN IMMEDIATE')
+        
+        # Ownership check for every referenced task in one query
+        referenced = {task_id for _, task_id, _ in updates} | {task_id for _, task_id in deletes}
+        existing = {}
+        if referenced:
+            placeholders = ','.join('?' for _ in referenced)
+            c.execute(f'SELECT id, title, completed FROM tasks WHERE user_id = ? AND id IN ({placeholders})',
+                      [user_id] + list(referenced))
+            existing = {row['id']: row for row in c.fetchall()}
+        
+        def owned(index, task_id):
+            if task_id in existing:
+                return True
+            results[index] = {'success': False, 'error': 'Task not found'}
+            return False
+        
+        # In request order, a task deleted earlier in the batch no longer exists
+        deleted_ids = []
+        for index, task_id in sorted([(u[0], u[1]) for u in updates] + deletes):
+            if task_id in deleted_ids:
+                results[index] = {'success': False, 'error': 'Task not found'}
+            elif owned(index, task_id) and operations[index]['op'] == 'delete':
+                deleted_ids.append(task_id)
+        updates = [u for u in updates if results[u[0]] is None]
+        deletes = [d for d in deletes if results[d[0]] is None]
+        
+        # Creates: one statement each, so every row's id is known without relying on allocation order
+        for index, title, due_date, priority in creates:
+            c.execute('''INSERT INTO tasks (user_id, title, due_date, priority, completed)
+                         VALUES (?, ?, ?, ?, 0)''', (user_id, title, due_date, priority))
+            results[index] = {'success': True, 'id': c.lastrowid}
+        
+        # Updates: repeated ids are merged in request order, so the last value of each field wins
+        merged = {}
+        for index, task_id, fields in updates:
+            if task_id in deleted_ids:
+                # Deleted later in the batch; nothing to write and no completion to announce
+                results[index] = {'success': True, 'id': task_id, 'superseded': True}
+                continue
+            merged.setdefault(task_id, {}).update(fields)
+            results[index] = {'success': True, 'id': task_id}
+        # One executemany per distinct set of changed fields
+        completed_titles = []
+        grouped = {}
+        for task_id, fields in merged.items():
+            grouped.setdefault(tuple(sorted(fields)), []).append((task_id, fields))
+            if fields.get('completed') and not existing[task_id]['completed']:
+                completed_titles.append(fields.get('title', existing[task_id]['title']))
+        for columns, items in grouped.items():
+            assignments = ', '.join(f'{column} = ?' for column in columns)
+            c.executemany(f'UPDATE tasks SET {assignments} WHERE id = ? AND user_id = ?',
+                          [[fields[column] for column in columns] + [task_id, user_id]
+                           for task_id, fields in items])
+        
+        # Deletes: media rows go with their tasks
+        deleted_files = []
+        if deletes:
+            delete_params = [(task_id, user_id) for _, task_id in deletes]
+            placeholders = ','.join('?' for _ in deletes)
+            c.execute(f'SELECT filename FROM media WHERE user_id = ? AND task_id IN ({placeholders})',
+                      [user_id] + [task_id for _, task_id in deletes])
+            deleted_files = [row['filename'] for row in c.fetchall()]
+            c.executemany('DELETE FROM media WHERE task_id = ? AND user_id = ?', delete_params)
+            c.executemany('DELETE FROM tasks WHERE id = ? AND user_id = ?', delete_params)
+            release_media_files(conn, deleted_files)
+            for index, task_id in deletes:
+                results[index] = {'success': True, 'id': task_id}
+        
+        # Return the final state of every created or updated task
+        touched = [result['id'] for result, op in zip(results, operations)
+                   if result and result['success'] and op.get('op') != 'delete']
+        if touched:
+            placeholders = ','.join('?' for _ in touched)
+            c.execute(f'SELECT * FROM tasks WHERE user_id = ? AND id IN ({placeholders})', [user_id] + touched)
+            rows = {row['id']: serialize_task(row) for row in c.fetchall()}
+            for result in results:
+                if result and result['success'] and result['id'] in rows:
+                    result['task'] = rows[result['id']]
         
-        # Get media statistics
-        c.execute('SELECT COUNT(*) as total_media FROM media WHERE user_id = ?', (user_id,))
-        total_media = c.fetchone()['total_media']
-        
-        c.execute('''SELECT COUNT(DISTINCT task_id) as tasks_with_media 
-                    FROM media WHERE user_id = ? AND task_id IS NOT NULL''', (user_id,))
-        tasks_with_media = c.fetchone()['tasks_with_media']
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        conn.close()
+        print(f"Error applying task batch: {str(e)}")
+        return jsonify({'success': False, 'error': f'Failed to apply batch: {str(e)}'}), 500
+    
+    conn.close()
+    
+    # Coalesced side effects, after the commit
+    if deleted_files:
+        file_deleter.notify()
+    if notification_system:
+        if len(completed_titles) == 1:
+            notification_system.create_in_app_notification(
+                user_id, "🎉 Task Completed!", f'Great job! You completed "{completed_titles[0]}"', 'info')
+        elif completed_titles:
+            notification_system.create_in_app_notification(
+                user_id, "🎉 Tasks Completed!", f'Great job! You completed {len(completed_titles)} tasks', 'info')
+        if deletes:
+            notification_system.create_in_app_notification(
+                user_id, "🗑️ Tasks Deleted",
+                f"{len(deletes)} task{'s' if len(deletes) != 1 else ''} permanently deleted", 'info')
+    
+    return jsonify({
+        'success': all(result['success'] for result in results),
+        'results': results
+    })
+
+@app.route('/api/stats')
+@login_required
+@conditional_on_data_version
+def stats_api():
+    user_id = g.user_id
+    conn = get_db(readonly=True)
+    
+    try:
+        # Counters are kept current by triggers; only the overdue count is live
+        stats = get_user_stats(conn, user_id)
+        total_tasks = stats['total_tasks']
+        completed_tasks = stats['completed_tasks']
         
         # Calculate completion rate
         completion_rate = 0
@@ -989,10 +1568,11 @@ def stats_api():
             'stats': {
                 'total_tasks': total_tasks,
                 'completed_tasks': completed_tasks,
-                'pending_tasks': pending_tasks,
-                'overdue_tasks': overdue_tasks,
-                'total_media': total_media,
-                'tasks_with_media': tasks_with_media,
+                'pending_tasks': stats['pending_tasks'],
+                'overdue_tasks': stats['overdue_tasks'],
+                'total_media': stats['total_media'],
+                'tasks_with_media': stats['tasks_with_media'],
+                'media_bytes': stats['media_bytes'],
                 'completion_rate': completion_rate
             }
         })
@@ -1002,19 +1582,24 @@ def stats_api():
         print(f"Error loading stats: {str(e)}")
         return jsonify({'success': False, 'error': f'Failed to load stats: {str(e)}'}), 500
 
+@app.route('/api/storage-usage')
+@login_required
+def storage_usage_api():
+    """The user's stored files and bytes against their quota, broken down by task"""
+    conn = get_db(readonly=True)
+    files, used = get_storage_usage(conn, g.user_id)
+    by_task = storage_usage_by_task(conn, g.user_id)
+    conn.close()
+    return jsonify({'success': True, 'usage': storage_usage(files, used), 'tasks': by_task})
+
 # Media API routes
 @app.route('/api/media', methods=['GET', 'POST', 'DELETE'])
 @login_required
+@conditional_on_data_version
 def media_api():
-    username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=request.method == 'GET')
     c = conn.cursor()
-    c.execute('SELECT id FROM users WHERE username = ?', (username,))
-    user_row = c.fetchone()
-    if not user_row:
-        conn.close()
-        return jsonify({'success': False, 'error': 'User not found'})
-    user_id = user_row['id']
     
     if request.method == 'GET':
         task_id = request.args.get('task_id')
@@ -1023,24 +1608,19 @@ def media_api():
         else:
             c.execute('SELECT * FROM media WHERE user_id = ? ORDER BY upload_date DESC', (user_id,))
         
-        media_files = []
-        for row in c.fetchall():
-            media_files.append({
-                'id': row['id'],
-                'filename': row['filename'],
-                'original_filename': row['original_filename'],
-                'file_type': row['file_type'],
-                'file_size': row['file_size'],
-                'upload_date': row['upload_date'],
-                'description': row['description'],
-                'task_id': row['task_id'],
-                'url': url_for('static', filename=f'uploads/{row["filename"]}'),
-                'is_video': is_video_file(row['filename'])
-            })
+        rows = c.fetchall()
+        variants = load_variants(conn, [row['id'] for row in rows])
+        media_files = [serialize_media(row, variants.get(row['id'])) for row in rows]
         conn.close()
         return jsonify({'success': True, 'media': media_files})
     
     elif request.method == 'POST':
+        # Before the form is parsed, which spools the file to disk
+        rejected = quota_exceeded(conn, user_id, max((request.content_length or 0) - MULTIPART_OVERHEAD, 0))
+        if rejected:
+            conn.close()
+            return rejected
+        
         if 'file' not in request.files:
             return jsonify({'success': False, 'error': 'No file selected'})
         
@@ -1052,46 +1632,36 @@ def media_api():
             return jsonify({'success': False, 'error': 'No file selected'})
         
         if file and allowed_file(file.filename):
-            # Generate unique filename
             file_extension = file.filename.rsplit('.', 1)[1].lower()
-            unique_filename = f"{uuid.uuid4().hex}.{file_extension}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            temp_path = None
             
             try:
-                file.save(filepath)
-                file_size = os.path.getsize(filepath)
-                
-                # Create thumbnail for images
-                if not is_video_file(unique_filename):
-                    thumbnail_filename = f"thumb_{unique_filename}"
-                    thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], thumbnail_filename)
-                    create_thumbnail(filepath, thumbnail_path)
+                # Stream to disk while hashing; identical files share one stored blob
+                temp_path, unique_filename, file_size = blob_store.receive(file.stream, file_extension)
+                metadata = extract_metadata(temp_path, file_extension)
                 
                 # Save to database
-                c.execute('''INSERT INTO media (user_id, task_id, filename, original_filename, 
-                           file_type, file_size, description) VALUES (?, ?, ?, ?, ?, ?, ?)''',
-                         (user_id, task_id if task_id else None, unique_filename, 
-                          file.filename, file_extension, file_size, description))
+                c.execute('BEGIN IMMEDIATE')
+                # Exact size, checked under the write lock so parallel uploads cannot overshoot
+                rejected = quota_exceeded(conn, user_id, file_size)
+                if rejected:
+                    conn.rollback()
+                    blob_store.discard(temp_path)
+                    conn.close()
+                    return rejected
+                media_id = insert_media(conn, user_id, task_id, temp_path, unique_filename, file.filename,
+                                        file_extension, file_size, description, metadata)
                 conn.commit()
-                media_id = c.lastrowid
+                media = load_media(conn, media_id)
                 conn.close()
+                thumbnail_worker.notify()
                 
-                return jsonify({
-                    'success': True,
-                    'media': {
-                        'id': media_id,
-                        'filename': unique_filename,
-                        'original_filename': file.filename,
-                        'file_type': file_extension,
-                        'file_size': file_size,
-                        'description': description,
-                        'task_id': int(task_id) if task_id else None,
-                        'url': url_for('static', filename=f'uploads/{unique_filename}'),
-                        'is_video': is_video_file(unique_filename),
-                        'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }
-                })
+                return jsonify({'success': True, 'media': media})
             except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if temp_path:
+                    blob_store.discard(temp_path)
                 conn.close()
                 return jsonify({'success': False, 'error': f'Failed to upload file: {str(e)}'})
         else:
@@ -1109,61 +1679,215 @@ def media_api():
             filename = row['filename']
             # Delete from database
             c.execute('DELETE FROM media WHERE id = ? AND user_id = ?', (media_id, user_id))
+            # File and thumbnails go in the background unless other media share them
+            release_media_files(conn, [filename])
             conn.commit()
-            
-            # Delete file from filesystem
-            try:
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-                
-                # Delete thumbnail if exists
-                thumbnail_filename = f"thumb_{filename}"
-                thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], thumbnail_filename)
-                if os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
+            file_deleter.notify()
         
         conn.close()
         return jsonify({'success': True})
 
+# Resumable chunked uploads
+def upload_state(upload):
+    return {
+        'id': upload['id'],
+        'offset': upload['received'],
+        'size': upload['total_size'],
+        'expires_at': upload['expires_at'],
+    }
+
+def upload_error(error):
+    response = jsonify({'success': False, 'error': str(error), 'offset': error.offset})
+    response.status_code = error.status
+    if error.offset is not None:
+        response.headers['Upload-Offset'] = str(error.offset)
+    return response
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def create_upload_api():
+    """Start a resumable upload.
+
+    Body: {"filename": ..., "size": <bytes>, "sha256": <hex digest of the whole file>,
+           "task_id": <optional>, "description": <optional>}
+    """
+    data = request.get_json(silent=True) or {}
+    filename = str(data.get('filename') or '')
+    if not allowed_file(filename):
+        return jsonify({'success': False, 'error': 'File type not allowed'}), 400
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'size is required'}), 400
+    
+    conn = get_db()
+    try:
+        chunked_uploads.validate(size, data.get('sha256'))
+        conn.execute('BEGIN IMMEDIATE')
+        # Open sessions count against the quota too, or parallel uploads could overshoot it
+        rejected = quota_exceeded(conn, g.user_id, size, chunked_uploads.reserved(conn, g.user_id))
+        if rejected:
+            conn.rollback()
+            return rejected
+        upload = chunked_uploads.create(conn, g.user_id, filename, filename.rsplit('.', 1)[1].lower(), size,
+                                        data['sha256'], task_id=data.get('task_id') or None,
+                                        description=data.get('description', ''))
+        conn.commit()
+    except UploadError as e:
+        if conn.in_transaction:
+            conn.rollback()
+        return upload_error(e)
+    finally:
+        conn.close()
+    return jsonify({'success': True, 'upload': upload_state(upload)}), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PUT', 'DELETE'])
+@login_required
+def upload_api(upload_id):
+    """GET: current offset. PUT: raw chunk body at the Upload-Offset header
+    (optional Upload-Checksum: "sha256 <hex>" of the chunk). DELETE: abort."""
+    try:
+        upload = chunked_uploads.get(upload_id, g.user_id)
+        
+        if request.method == 'PUT':
+            try:
+                offset = int(request.headers.get('Upload-Offset', ''))
+            except ValueError:
+                return jsonify({'success': False, 'error': 'Upload-Offset header is required'}), 400
+            checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+            upload['received'] = chunked_uploads.write_chunk(upload, offset, request.stream, checksum)
+        
+        elif request.method == 'DELETE':
+            conn = get_db()
+            chunked_uploads.delete(conn, upload_id)
+            conn.commit()
+            conn.close()
+            return jsonify({'success': True})
+    except UploadError as e:
+        return upload_error(e)
+    
+    response = jsonify({'success': True, 'upload': upload_state(upload)})
+    response.headers['Upload-Offset'] = str(upload['received'])
+    return response
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload_api(upload_id):
+    """Verify a complete upload's checksum and turn it into a media row"""
+    user_id = g.user_id
+    try:
+        upload = chunked_uploads.get(upload_id, user_id)
+        temp_path, digest, file_size = chunked_uploads.verify(upload)
+    except UploadError as e:
+        return upload_error(e)
+    metadata = extract_metadata(temp_path, upload['file_type'])
+    
+    conn = get_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        if not conn.execute('SELECT 1 FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone():
+            # Finalized concurrently by another request
+            conn.rollback()
+            conn.close()
+            return jsonify({'success': False, 'error': 'Upload not found or expired'}), 404
+        rejected = quota_exceeded(conn, user_id, file_size)
+        if rejected:
+            # Uploads deleted meanwhile free space, so the session is kept for a retry
+            conn.rollback()
+            conn.close()
+            return rejected
+        media_id = insert_media(conn, user_id, upload['task_id'], temp_path,
+                                shard_path(f"{digest}.{upload['file_type']}"),
+                                upload['original_filename'], upload['file_type'], file_size,
+                                upload['description'] or '', metadata)
+        chunked_uploads.delete(conn, upload_id)
+        conn.commit()
+        media = load_media(conn, media_id)
+        conn.close()
+    except Exception as e:
+        if conn.in_transaction:
+            conn.rollback()
+        conn.close()
+        print(f"Error finalizing upload: {e}")
+        return jsonify({'success': False, 'error': f'Failed to finalize upload: {str(e)}'}), 500
+    
+    thumbnail_worker.notify()
+    return jsonify({'success': True, 'media': media})
+
 # Additional routes (continuing with the rest of your routes...)
 @app.route('/api/tasks/<int:task_id>/media')
 @login_required
 def task_media(task_id):
     """Get media files for a specific task"""
-    username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=True)
     c = conn.cursor()
-    c.execute('SELECT id FROM users WHERE username = ?', (username,))
-    user_row = c.fetchone()
-    if not user_row:
-        conn.close()
-        return jsonify([])
-    user_id = user_row['id']
     
     c.execute('SELECT * FROM media WHERE user_id = ? AND task_id = ? ORDER BY upload_date DESC', (user_id, task_id))
+    rows = c.fetchall()
+    variants = load_variants(conn, [row['id'] for row in rows])
     media_files = []
-    for row in c.fetchall():
+    for row in rows:
         media_files.append({
             'id': row['id'],
             'filename': row['filename'],
             'original_filename': row['original_filename'],
-            'url': url_for('static', filename=f'uploads/{row["filename"]}'),
+            'url': media_url(row['filename']),
             'is_video': is_video_file(row['filename']),
-            'description': row['description']
+            'description': row['description'],
+            **metadata_fields(row),
+            **thumbnail_fields(row, variants.get(row['id']))
         })
     
     conn.close()
     return jsonify(media_files)
 
+@app.route('/api/rate-limit-stats')
+@login_required
+def rate_limit_stats_api():
+    """Allowed / limited counters of this worker's rate limiter"""
+    if session['username'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'stats': rate_limiter.get_stats()})
+
+@app.route('/api/password-hash-stats')
+@login_required
+def password_hash_stats_api():
+    """Queue wait / hash time metrics of this worker's hashing pool"""
+    if session['username'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'stats': password_hasher.get_stats()})
+
+@app.route('/api/thumbnail-stats')
+@login_required
+def thumbnail_stats_api():
+    """Completed / failed counters and queue depth of the thumbnail pipeline"""
+    if session['username'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'stats': thumbnail_worker.get_stats()})
+
+@app.route('/api/file-deletion-stats')
+@login_required
+def file_deletion_stats_api():
+    """Deleted / retried / failed counters and backlog of the file deletion queue"""
+    if session['username'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'stats': file_deleter.get_stats()})
+
+@app.route('/api/resize-stats')
+@login_required
+def resize_stats_api():
+    """Hit rate, renders and evictions of this worker's resize cache"""
+    if session['username'] != 'admin':
+        return jsonify({'error': 'Unauthorized'}), 403
+    return jsonify({'success': True, 'stats': resize_cache.get_stats()})
+
 @app.route('/api/all-tasks')
 @login_required
 def all_tasks_api():
     if session['username'] != 'admin':
         return jsonify({'error': 'Unauthorized'}), 403
-    conn = get_db()
+    conn = get_db(readonly=True)
     c = conn.cursor()
     c.execute('''SELECT tasks.*, users.username as user FROM tasks JOIN users ON tasks.user_id = users.id''')
     all_tasks = [dict(id=row['id'], title=row['title'], completed=bool(row['completed']), due_date=row['due_date'], user=row['user']) for row in c.fetchall()]
@@ -1174,15 +1898,9 @@ def all_tasks_api():
 @login_required
 def task_gallery(task_id):
     """Gallery view for a specific task"""
-    username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=True)
     c = conn.cursor()
-    c.execute('SELECT id FROM users WHERE username = ?', (username,))
-    user_row = c.fetchone()
-    if not user_row:
-        conn.close()
-        return redirect(url_for('dashboard'))
-    user_id = user_row['id']
     
     # Get task details
     c.execute('SELECT * FROM tasks WHERE id = ? AND user_id = ?', (task_id, user_id))
@@ -1197,6 +1915,55 @@ def task_gallery(task_id):
                          task=dict(task),
                          task_id=task_id)
 
+@app.route('/api/search')
+@login_required
+@conditional_on_data_version
+def search_api():
+    """Ranked prefix search over the user's task titles and media descriptions"""
+    user_id = g.user_id
+    match = build_match_query(request.args.get('q', ''))
+    if not match:
+        return jsonify({'success': False, 'error': 'Search query is required'}), 400
+    
+    search_type = request.args.get('type', 'all')
+    if search_type not in ('all', 'tasks', 'media'):
+        return jsonify({'success': False, 'error': f'Unknown search type: {search_type}'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    
+    conn = get_db(readonly=True)
+    try:
+        result = {'success': True, 'limit': limit, 'offset': offset}
+        
+        if search_type in ('all', 'tasks'):
+            rows = search_tasks(conn, user_id, match, limit, offset)
+            result['tasks'] = [dict(serialize_task(row), score=row['score']) for row in rows[:limit]]
+            result['tasks_has_more'] = len(rows) > limit
+        
+        if search_type in ('all', 'media'):
+            rows = search_media(conn, user_id, match, limit, offset)
+            variants = load_variants(conn, [row['id'] for row in rows[:limit]])
+            result['media'] = [{
+                'id': row['id'],
+                'filename': row['filename'],
+                'original_filename': row['original_filename'],
+                'description': row['description'],
+                'task_id': row['task_id'],
+                'url': media_url(row['filename']),
+                'is_video': is_video_file(row['filename']),
+                **metadata_fields(row),
+                **thumbnail_fields(row, variants.get(row['id'])),
+                'score': row['score']
+            } for row in rows[:limit]]
+            result['media_has_more'] = len(rows) > limit
+        
+        conn.close()
+        return jsonify(result)
+    except Exception as e:
+        conn.close()
+        print(f"Error searching: {str(e)}")
+        return jsonify({'success': False, 'error': f'Search failed: {str(e)}'}), 500
+
 # Completed Tasks Tab
 @app.route('/completed-tasks')
 @login_required
@@ -1206,20 +1973,14 @@ def completed_tasks():
 
 @app.route('/api/completed-tasks')
 @login_required
+@conditional_on_data_version
 def completed_tasks_api():
     """Get completed tasks sorted by priority and due date"""
-    username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=True)
     c = conn.cursor()
     
     try:
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-        
         # Get completed tasks with media count
         c.execute('''
             SELECT 
@@ -1270,18 +2031,11 @@ def trigger_notifications():
 def export_tasks():
     """Export selected tasks as a text report"""
     username = session['username']
-    conn = get_db()
+    user_id = g.user_id
+    conn = get_db(readonly=True)
     c = conn.cursor()
     
     try:
-        # Get user ID
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-        
         # Get task IDs from request
         data = request.get_json()
         task_ids = data.get('task_ids', [])
@@ -1336,28 +2090,28 @@ def export_tasks():
         print(f"Error exporting tasks: {str(e)}")
         return jsonify({'success': False, 'error': f'Failed to export tasks: {str(e)}'}), 500
 
-# Persistent login on server start
-@app.before_request
-def load_persistent_session():
-    if 'username' not in session:
-        sess = load_session()
-        if 'username' in sess:
-            session['username'] = sess['username']
-            session.permanent = True
-
 def initialize_app():
     """Initialize the application with notification system"""
     global notification_system
+    thumbnail_worker.start()
+    file_deleter.start()
+    
     try:
         # Import notification system here to avoid circular imports
         from notification_system import TaskNotificationSystem, add_notification_routes
         
         # Initialize notification system
-        notification_system = TaskNotificationSystem(app, DB_FILE, BREVO_API_KEY)
+        notification_system = TaskNotificationSystem(app, DB_FILE, BREVO_API_KEY, db=db,
+                                                     identity_cache=identity_cache)
         
         # Add notification routes
         add_notification_routes(app, notification_system)
         
+        # Nightly retention pass, run by the notification scheduler thread
+        schedule.every().day.at("03:00").do(retention_engine.run)
+        schedule.every(30).minutes.do(chunked_uploads.cleanup_stale)
+        schedule.every().day.at("04:00").do(upload_reconciler.run)
+        
         print("Notification system initialized successfully")
     except Exception as e:
         print(f"Warning: Could not initialize notification system: {e}")
@@ -1366,19 +2120,11 @@ def initialize_app():
 @app.route('/api/media/<int:media_id>', methods=['PUT'])
 @login_required
 def update_media(media_id):
-    username = session['username']
+    user_id = g.user_id
     conn = get_db()
     c = conn.cursor()
     
     try:
-        # Get user ID
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-        
         # Get the request data
         data = request.get_json()
         
@@ -1409,8 +2155,10 @@ def update_media(media_id):
                 'upload_date': updated_row['upload_date'],
                 'description': updated_row['description'],
                 'task_id': updated_row['task_id'],
-                'url': url_for('static', filename=f'uploads/{updated_row["filename"]}'),
-                'is_video': is_video_file(updated_row['filename'])
+                'url': media_url(updated_row['filename']),
+                'is_video': is_video_file(updated_row['filename']),
+                **metadata_fields(updated_row),
+                **thumbnail_fields(updated_row, load_variants(conn, [media_id]).get(media_id))
             }
             
             conn.close()
@@ -1427,19 +2175,11 @@ def update_media(media_id):
 @app.route('/api/media/<int:media_id>', methods=['DELETE'])
 @login_required  
 def delete_media_api(media_id):
-    username = session['username']
+    user_id = g.user_id
     conn = get_db()
     c = conn.cursor()
     
     try:
-        # Get user ID
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user_row = c.fetchone()
-        if not user_row:
-            conn.close()
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        user_id = user_row['id']
-        
         # Check if media exists and belongs to user
         c.execute('SELECT filename FROM media WHERE id = ? AND user_id = ?', (media_id, user_id))
         media_row = c.fetchone()
@@ -1451,21 +2191,10 @@ def delete_media_api(media_id):
         
         # Delete from database
         c.execute('DELETE FROM media WHERE id = ? AND user_id = ?', (media_id, user_id))
+        # File and thumbnails go in the background unless other media share them
+        release_media_files(conn, [filename])
         conn.commit()
-        
-        # Delete file from filesystem
-        try:
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            
-            # Delete thumbnail if exists
-            thumbnail_filename = f"thumb_{filename}"
-            thumbnail_path = os.path.join(app.config['UPLOAD_FOLDER'], thumbnail_filename)
-            if os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
-        except Exception as file_error:
-            print(f"Error deleting media file: {file_error}")
+        file_deleter.notify()
         
         conn.close()
         return jsonify({'success': True, 'message': 'Media deleted successfully'})
@@ -1475,6 +2204,95 @@ def delete_media_api(media_id):
         print(f"Error deleting media: {str(e)}")
         return jsonify({'success': False, 'error': f'Failed to delete media: {str(e)}'}), 500
 
+# --- Maintenance commands ---
+@app.cli.command('check-stats')
+@click.option('--repair', is_flag=True, help='Rebuild the counters when drift is found')
+def check_stats_command(repair):
+    """Compare per-user statistics counters against the source tables"""
+    conn = get_db()
+    drift = check_user_stats(conn, repair=repair)
+    conn.close()
+    for entry in drift:
+        click.echo(f"user {entry['user_id']}: {entry['field']} stored={entry['stored']} actual={entry['actual']}")
+    if not drift:
+        click.echo('Statistics are consistent')
+    elif repair:
+        click.echo(f'Repaired {len(drift)} drifted counter(s)')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Repopulate the full-text search tables from tasks and media"""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    rebuild_search_index(conn)
+    conn.commit()
+    conn.close()
+    click.echo('Search index rebuilt')
+
+@app.cli.command('run-retention')
+@click.option('--dry-run', is_flag=True, help='Only count the rows each policy would remove')
+@click.option('--enable-incremental-vacuum', is_flag=True,
+              help='Convert an existing database to auto_vacuum=INCREMENTAL first (rewrites the file)')
+def run_retention_command(dry_run, enable_incremental_vacuum):
+    """Delete expired notification, log and reset-token rows"""
+    if enable_incremental_vacuum:
+        retention_engine.enable_incremental_vacuum()
+    if notification_system:
+        notification_system.writer.flush()
+    report = retention_engine.run(dry_run=dry_run)
+    for name, result in report['policies'].items():
+        click.echo(f"{name} ({result['table']}): {result.get('rows', result.get('error'))}")
+    click.echo(f"Total rows: {report['rows']}, bytes reclaimed: {report['bytes_reclaimed']}")
+
+@app.cli.command('dedupe-media')
+@click.option('--dry-run', is_flag=True, help='Only report what would be merged')
+def dedupe_media_command(dry_run):
+    """Move legacy uploads to content-addressed names, storing duplicates once"""
+    conn = get_db()
+    report = blob_store.dedupe_legacy(conn, thumbnail_worker.enqueue, dry_run=dry_run)
+    conn.close()
+    click.echo(f"Legacy files: {report['files']}, moved: {report['moved']}, "
+               f"duplicates merged: {report['duplicates']}, missing on disk: {report['missing']}")
+    click.echo(f"Bytes saved: {report['bytes_saved']}" + (' (dry run)' if dry_run else ''))
+
+@app.cli.command('shard-uploads')
+@click.option('--batch-size', default=200, show_default=True, help='Files moved per transaction')
+def shard_uploads_command(batch_size):
+    """Move flat upload files into the sharded directory layout (resumable)"""
+    conn = get_db()
+    report = blob_store.shard_legacy(conn, batch_size=batch_size)
+    conn.close()
+    click.echo(f"Files moved: {report['files']} in {report['batches']} batches, "
+               f"missing on disk: {report['missing']}")
+
+@app.cli.command('reconcile-uploads')
+@click.option('--dry-run', is_flag=True, help='Only report orphaned files and missing ones')
+@click.option('--grace-hours', type=float, default=None, help='Override UPLOAD_GC_GRACE_HOURS')
+def reconcile_uploads_command(dry_run, grace_hours):
+    """Delete upload files no row references and report rows whose file is missing"""
+    report = upload_reconciler.run(dry_run=dry_run,
+                                   grace_seconds=None if grace_hours is None else grace_hours * 3600)
+    click.echo(f"Files scanned: {report['files_scanned']}, too recent to judge: {report['recent_skipped']}")
+    click.echo(f"Orphaned files: {report['orphans']} ({report['orphan_bytes']} bytes), "
+               f"deleted: {report['deleted']} ({report['deleted_bytes']} bytes)" + (' (dry run)' if dry_run else ''))
+    click.echo(f"Missing originals: {report['missing_originals']}, missing variants: {report['missing_variants']}, "
+               f"re-queued: {report['requeued']}")
+    if report['missing_media_ids']:
+        click.echo(f"Media with missing files: {', '.join(str(i) for i in report['missing_media_ids'])}")
+    if 'error' in report:
+        click.echo(f"Stopped early: {report['error']}")
+
+@app.cli.command('backfill-media-metadata')
+@click.option('--workers', default=4, show_default=True, help='Files read in parallel')
+@click.option('--batch-size', default=200, show_default=True, help='Rows updated per transaction')
+def backfill_media_metadata_command(workers, batch_size):
+    """Read dimensions, orientation, capture time and duration of media uploaded before they were stored"""
+    conn = get_db()
+    report = backfill_metadata(conn, UPLOAD_FOLDER, workers=workers, batch_size=batch_size)
+    conn.close()
+    click.echo(f"Media rows: {report['rows']}, with dimensions: {report['with_dimensions']}, "
+               f"missing on disk: {report['missing']}")
+
 # Initialize database on startup
 init_db()
 
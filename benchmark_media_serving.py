@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: media throughput of a single worker
+
+Serves a sample file from one single-threaded server (one worker) and
+compares the old static handler with /media streaming from Python, Range
+requests (video seeking), a revalidation that ends in 304, and the
+X-Accel-Redirect hand-off, where the worker only sends headers and the
+proxy sends the bytes.
+
+Usage: python benchmark_media_serving.py [--size-mb N] [--requests N]
+"""
+
+import argparse
+import hashlib
+import http.client
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+from media_serving import MediaServer
+from media_store import shard_path
+
+
+def make_app(root, offload):
+    app = Flask(__name__, static_folder=os.path.join(root, 'static'))
+    media_server = MediaServer(os.path.join(root, 'static', 'uploads'), offload=offload)
+
+    @app.route('/media/<path:filename>')
+    def serve_media(filename):
+        return media_server.response(request, filename) or ('Not found', 404)
+
+    return app
+
+
+def run_requests(port, path, count, headers=None):
+    """Sequential requests; returns (seconds, body bytes received, last status)"""
+    received = 0
+    status = None
+    started = time.perf_counter()
+    for _ in range(count):
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        received += len(response.read())
+        status = response.status
+        conn.close()
+    return time.perf_counter() - started, received, status
+
+
+def report(label, count, seconds, received, status):
+    print(f"  {label:<28} {status}  {count / seconds:8.1f} req/s  {received / seconds / 2**20:8.1f} MB/s body")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    print("Media Serving Benchmark (one worker)")
+    print("=" * 40)
+    with tempfile.TemporaryDirectory() as root:
+        data = os.urandom(args.size_mb * 2**20)
+        filename = shard_path(f"{hashlib.sha256(data).hexdigest()}.mp4")
+        path = os.path.join(root, 'static', 'uploads', filename)
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(data)
+        del data
+        print(f"Sample file: {args.size_mb} MB, {args.requests} requests per case")
+
+        for offload in ('', 'x-accel-redirect'):
+            server = make_server('127.0.0.1', 0, make_app(root, offload), threaded=False)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            port = server.server_port
+            n = args.requests
+            try:
+                if not offload:
+                    print("\nStreaming from Python")
+                    report('static handler (before)', n, *run_requests(port, f'/static/uploads/{filename}', n))
+                    seconds, received, status = run_requests(port, f'/media/{filename}', n)
+                    report('/media full file', n, seconds, received, status)
+                    report('/media Range 1 MB', n,
+                           *run_requests(port, f'/media/{filename}', n, {'Range': 'bytes=0-1048575'}))
+                    etag = f'"{os.path.basename(filename).split(".")[0]}"'
+                    report('/media If-None-Match', n,
+                           *run_requests(port, f'/media/{filename}', n, {'If-None-Match': etag}))
+                else:
+                    print("\nX-Accel-Redirect hand-off (worker time only; nginx sends the body)")
+                    report('/media full file', n, *run_requests(port, f'/media/{filename}', n))
+            finally:
+                server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
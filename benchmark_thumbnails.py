@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark: single full-resolution thumbnail vs. draft-decoded WebP variants
+
+Compares the time to decode and resize an upload and the bytes a gallery
+card / full view downloads before (original file) and after (WebP variant).
+
+Usage: python benchmark_thumbnails.py [image ...] [--runs N]
+Without images, a synthetic 4000x3000 JPEG photo is generated.
+"""
+
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+from PIL import Image, ImageFilter
+
+from thumbnails import create_variants, VARIANT_WIDTHS
+
+
+def make_sample(path, size=(4000, 3000)):
+    """Noisy gradient so JPEG compression behaves like a photo"""
+    gradient = Image.linear_gradient('L').resize(size)
+    noise = Image.effect_noise(size, 40).filter(ImageFilter.GaussianBlur(1))
+    Image.merge('RGB', (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))).save(
+        path, 'JPEG', quality=90)
+
+
+def old_thumbnail(filepath, thumbnail_path, size=(300, 300)):
+    """The previous approach: full decode, LANCZOS, source format"""
+    with Image.open(filepath) as img:
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        img.save(thumbnail_path, optimize=True, quality=85)
+
+
+def timed(func, runs):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def benchmark(path, runs, workdir):
+    filename = os.path.basename(path)
+    original_size = os.path.getsize(path)
+    with Image.open(path) as img:
+        dimensions = img.size
+
+    decode_full = timed(lambda: Image.open(path).load(), runs)
+
+    def decode_draft():
+        with Image.open(path) as img:
+            img.draft(None, (max(VARIANT_WIDTHS), max(VARIANT_WIDTHS)))
+            img.load()
+    decode_reduced = timed(decode_draft, runs)
+
+    old_path = os.path.join(workdir, f"thumb_{filename}")
+    old_time = timed(lambda: old_thumbnail(path, old_path), runs)
+    new_time = timed(lambda: create_variants(path, workdir, filename), runs)
+    variants = create_variants(path, workdir, filename)
+
+    print(f"\n{filename}: {dimensions[0]}x{dimensions[1]}, {original_size / 1024:.0f} KB")
+    print(f"  decode, full resolution      {decode_full * 1000:8.1f} ms")
+    print(f"  decode, draft mode           {decode_reduced * 1000:8.1f} ms")
+    print(f"  old: one 300px thumbnail     {old_time * 1000:8.1f} ms  ({os.path.getsize(old_path) / 1024:.0f} KB)")
+    print(f"  new: {len(variants)} WebP variants       {new_time * 1000:8.1f} ms")
+    for variant in variants:
+        print(f"       {variant['width']:>5}w x {variant['height']:<5}  {variant['file_size'] / 1024:8.1f} KB")
+
+    # Before: the gallery grid and the full view both downloaded the original
+    card = variants[0]['file_size']
+    full_view = variants[-1]['file_size']
+    print(f"  bytes per gallery card       {original_size / 1024:8.0f} KB -> {card / 1024:.0f} KB")
+    print(f"  bytes per full view          {original_size / 1024:8.0f} KB -> {full_view / 1024:.0f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print("Thumbnail Benchmark")
+    print("=" * 40)
+    with tempfile.TemporaryDirectory() as workdir:
+        images = args.images
+        if not images:
+            sample = os.path.join(workdir, 'sample.jpg')
+            make_sample(sample)
+            images = [sample]
+        for path in images:
+            benchmark(path, args.runs, workdir)
+
+
+if __name__ == "__main__":
+    main()
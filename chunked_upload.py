@@ -0,0 +1,208 @@
+# chunked_upload.py - Resumable chunked uploads
+#
+# A client creates an upload session, PUTs the file in chunks at explicit
+# offsets, can ask for the current offset after a dropped connection, and
+# finally asks for the upload to be finalized. Each chunk is streamed into a
+# file of its own. It is copied into the partial file only after its offset
+# has been claimed under the database write lock, so two requests racing for
+# the same offset can never overwrite accepted data. Sessions live in
+# upload_sessions (migration 14), so any worker can accept the next chunk.
+# The SHA-256 of the whole file is declared up front and checked before it
+# becomes a media row. Abandoned sessions expire and are removed by
+# cleanup_stale().
+import hashlib
+import os
+import secrets
+import time
+
+from media_store import hash_file
+
+CHUNK_READ_SIZE = 1024 * 1024
+
+
+def is_sha256(value):
+    return isinstance(value, str) and len(value) == 64 and all(ch in '0123456789abcdef' for ch in value.lower())
+
+
+def parse_checksum(header):
+    """Hex digest from an 'Upload-Checksum: sha256 <hex>' header, None when absent; raises UploadError"""
+    if not header:
+        return None
+    algorithm, _, digest = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256' or not is_sha256(digest.strip()):
+        raise UploadError('Upload-Checksum must be "sha256 <hex digest>"')
+    return digest.strip().lower()
+
+
+class UploadError(Exception):
+    """A chunked-upload request that cannot be applied; carries the HTTP status"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+class ChunkedUploadManager:
+    def __init__(self, db, upload_folder, max_size, ttl=86400, max_open=5):
+        self.db = db
+        self.partial_folder = os.path.join(upload_folder, '.partial')
+        self.max_size = max_size
+        self.ttl = ttl  # seconds an idle session is kept
+        self.max_open = max_open  # unexpired sessions per user; each may grow a partial file up to max_size
+        os.makedirs(self.partial_folder, exist_ok=True)
+
+    def part_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.part")
+
+    def validate(self, total_size, sha256):
+        if total_size <= 0:
+            raise UploadError('Upload size must be positive')
+        if total_size > self.max_size:
+            raise UploadError(f'File exceeds the {self.max_size} byte limit', 413)
+        if not is_sha256(sha256):
+            raise UploadError('sha256 of the whole file is required as a hex digest')
+
+    def reserved(self, conn, user_id):
+        """(open sessions, sum of their declared sizes) of a user's unexpired uploads"""
+        row = conn.execute('''SELECT COUNT(*), COALESCE(SUM(total_size), 0) FROM upload_sessions
+                              WHERE user_id = ? AND expires_at > ?''', (user_id, time.time())).fetchone()
+        return row[0], row[1]
+
+    def create(self, conn, user_id, original_filename, file_type, total_size, sha256, task_id=None,
+               description=''):
+        """Open a session in the caller's write transaction (BEGIN IMMEDIATE, so two requests
+        cannot both take a user's last slot)"""
+        self.validate(total_size, sha256)
+        if self.max_open and self.reserved(conn, user_id)[0] >= self.max_open:
+            raise UploadError(f'At most {self.max_open} uploads can be in progress at once', 429)
+
+        upload_id = secrets.token_urlsafe(24)
+        now = time.time()
+        open(self.part_path(upload_id), 'wb').close()
+        conn.execute('''INSERT INTO upload_sessions (id, user_id, original_filename, file_type, total_size,
+                            sha256, task_id, description, received, created_at, updated_at, expires_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?)''',
+                     (upload_id, user_id, original_filename, file_type, total_size,
+                      sha256.lower(), task_id, description, now, now, now + self.ttl))
+        return dict(conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone())
+
+    def get(self, upload_id, user_id):
+        conn = self.db.connect()
+        row = conn.execute('SELECT * FROM upload_sessions WHERE id = ? AND user_id = ? AND expires_at > ?',
+                           (upload_id, user_id, time.time())).fetchone()
+        conn.close()
+        if row is None:
+            raise UploadError('Upload not found or expired', 404)
+        return dict(row)
+
+    def chunk_path(self, upload_id):
+        return os.path.join(self.partial_folder, f"{upload_id}.{secrets.token_hex(8)}.chunk")
+
+    def write_chunk(self, upload, offset, stream, checksum=None):
+        """Write a chunk at `offset`; returns the new offset.
+
+        The offset must equal the bytes received so far. A chunk whose
+        optional SHA-256 `checksum` does not match is not counted, and the
+        client resends it from the same offset.
+        """
+        if offset != upload['received']:
+            raise UploadError('Offset does not match the bytes received so far', 409, upload['received'])
+
+        chunk_path = self.chunk_path(upload['id'])
+        try:
+            digest = hashlib.sha256()
+            written = 0
+            with open(chunk_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(CHUNK_READ_SIZE), b''):
+                    if offset + written + len(chunk) > upload['total_size']:
+                        raise UploadError('Chunk runs past the declared upload size', 413, upload['received'])
+                    f.write(chunk)
+                    digest.update(chunk)
+                    written += len(chunk)
+            if checksum and checksum != digest.hexdigest():
+                raise UploadError('Chunk checksum mismatch', 422, upload['received'])
+
+            now = time.time()
+            conn = self.db.connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                cur = conn.execute('''UPDATE upload_sessions SET received = ?, updated_at = ?, expires_at = ?
+                                      WHERE id = ? AND received = ?''',
+                                   (offset + written, now, now + self.ttl, upload['id'], offset))
+                if cur.rowcount:
+                    # The offset is ours; no other request can splice until we commit
+                    self._splice(chunk_path, upload['id'], offset)
+                conn.commit()
+            finally:
+                conn.close()
+        finally:
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+        if cur.rowcount == 0:
+            # Another request for the same session got there first
+            current = self.get(upload['id'], upload['user_id'])
+            raise UploadError('Offset does not match the bytes received so far', 409, current['received'])
+        return offset + written
+
+    def _splice(self, chunk_path, upload_id, offset):
+        """Copy a received chunk into the partial file at `offset`"""
+        with open(chunk_path, 'rb') as src, open(self.part_path(upload_id), 'r+b') as dst:
+            dst.seek(offset)
+            for block in iter(lambda: src.read(CHUNK_READ_SIZE), b''):
+                dst.write(block)
+            dst.truncate()
+
+    def verify(self, upload):
+        """Check a complete upload; returns (partial file path, sha256 hex digest, size)"""
+        if upload['received'] != upload['total_size']:
+            raise UploadError('Upload is not complete', 409, upload['received'])
+        path = self.part_path(upload['id'])
+        digest, size = hash_file(path)
+        if size != upload['total_size'] or (upload['sha256'] and upload['sha256'] != digest):
+            # The data cannot be trusted; start over from the beginning
+            with open(path, 'wb'):
+                pass
+            conn = self.db.connect()
+            conn.execute('UPDATE upload_sessions SET received = 0, updated_at = ? WHERE id = ?',
+                         (time.time(), upload['id']))
+            conn.commit()
+            conn.close()
+            raise UploadError('Checksum mismatch, upload must be restarted', 422, 0)
+        return path, digest, size
+
+    def delete(self, conn, upload_id):
+        """Drop a session row in the caller's transaction and remove its partial file if still there"""
+        conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+        path = self.part_path(upload_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def cleanup_stale(self, batch_size=500):
+        """Remove expired sessions and partial files with no session; returns sessions removed"""
+        conn = self.db.connect()
+        try:
+            rows = conn.execute('SELECT id FROM upload_sessions WHERE expires_at <= ? LIMIT ?',
+                                (time.time(), batch_size)).fetchall()
+            for row in rows:
+                self.delete(conn, row[0])
+            conn.commit()
+
+            # Partial files whose session row never made it or was removed elsewhere, and chunk files
+            # of requests that died before cleaning up
+            known = {row[0] for row in conn.execute('SELECT id FROM upload_sessions').fetchall()}
+            cutoff = time.time() - self.ttl
+            for name in os.listdir(self.partial_folder):
+                path = os.path.join(self.partial_folder, name)
+                if name.split('.', 1)[0] not in known and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Error cleaning up stale uploads: {e}")
+            return 0
+        finally:
+            conn.close()
+        if rows:
+            print(f"Removed {len(rows)} stale upload sessions")
+        return len(rows)
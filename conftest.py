@@ -0,0 +1,82 @@
+# conftest.py - Shared setup for the test scripts
+#
+# Plain helpers rather than pytest fixtures, so every test_*.py still runs on
+# its own with `python test_x.py` as well as under pytest.
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from db_manager import DatabaseManager
+from migrations import run_migrations
+
+
+@contextlib.contextmanager
+def temp_database():
+    """Yield (temp dir, DatabaseManager, connection) of a migrated database with user 1 and task 1"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'app.db'))
+        conn = db.connect()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run_migrations(conn)
+        conn.execute("INSERT INTO users (username, password, email) VALUES ('alice', 'x', 'alice@x.com')")
+        conn.execute("INSERT INTO tasks (user_id, title) VALUES (1, 'Task')")
+        conn.commit()
+        try:
+            yield tmp, db, conn
+        finally:
+            conn.close()
+            db.close_thread_connections()
+
+
+def write_file(folder, filename, data=b'data', age=0):
+    """Create folder/filename, with an mtime `age` seconds in the past; returns its path"""
+    path = os.path.join(folder, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if age:
+        os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+
+def insert_media(conn, filename, thumbnail_status='none'):
+    """Media row of user 1 / task 1 for a stored file; returns its id"""
+    cur = conn.execute('''INSERT INTO media (user_id, task_id, filename, original_filename, file_type, file_size,
+                                             thumbnail_status)
+                          VALUES (1, 1, ?, 'photo.jpg', 'jpg', 4, ?)''', (filename, thumbnail_status))
+    return cur.lastrowid
+
+
+_app = None
+
+
+def load_app():
+    """Import the Flask app once, inside a temp working directory (it keeps app.db and uploads relative)"""
+    global _app
+    if _app is None:
+        os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+        os.chdir(tempfile.mkdtemp())
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as appmod
+        appmod.app.config['TESTING'] = True
+        _app = appmod
+    return _app
+
+
+def logged_in_client(username):
+    """(test client, user id) of a new user who has logged in"""
+    appmod = load_app()
+    conn = appmod.get_db()
+    cur = conn.execute('INSERT INTO users (username, password, email) VALUES (?, ?, ?)',
+                       (username, appmod.password_hasher.hash('secret1'), f'{username}@example.com'))
+    user_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+    client = appmod.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': 'secret1'})
+    assert b'login-success' in response.data, response.data
+    return client, user_id
@@ -0,0 +1,87 @@
+# db_manager.py - Pooled SQLite connection management
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection that goes back to its pool when closed"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+
+    def close(self):
+        """Release one checkout, rolling back anything the last holder left uncommitted"""
+        self.checkouts = max(self.checkouts - 1, 0)
+        if self.checkouts == 0 and self.in_transaction:
+            self.rollback()
+
+    def release(self):
+        """Really close the underlying connection"""
+        super().close()
+
+
+class DatabaseManager:
+    """Hands out per-thread SQLite connections in WAL mode.
+
+    Every thread keeps one read-write and one read-only connection open and
+    reuses them, so callers can keep the ``conn = ...; conn.close()`` pattern
+    without paying for a new connection each time. Read-only connections never
+    take the write lock, so with WAL they never wait on writers.
+    """
+
+    def __init__(self, db_file, busy_timeout=5000):
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout  # milliseconds
+        self._local = threading.local()
+
+    def _open(self, readonly):
+        timeout = self.busy_timeout / 1000
+        if readonly:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_file))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=timeout, factory=PooledConnection)
+            conn.execute('PRAGMA query_only = 1')
+        else:
+            conn = sqlite3.connect(self.db_file, timeout=timeout, factory=PooledConnection)
+            # Only takes effect on a new database; lets retention passes return free pages
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect(self, readonly=False):
+        """Check out this thread's connection, opening it on first use"""
+        key = 'ro' if readonly else 'rw'
+        conn = getattr(self._local, key, None)
+        if conn is None:
+            try:
+                conn = self._open(readonly)
+            except sqlite3.OperationalError:
+                if not readonly:
+                    raise
+                # The database file or its WAL index does not exist yet
+                return self.connect()
+            setattr(self._local, key, conn)
+        conn.checkouts += 1
+        return conn
+
+    def reset(self):
+        """End-of-request cleanup: drop leaked checkouts and roll back open transactions"""
+        for key in ('rw', 'ro'):
+            conn = getattr(self._local, key, None)
+            if conn is not None:
+                conn.checkouts = 0
+                if conn.in_transaction:
+                    conn.rollback()
+
+    def close_thread_connections(self):
+        """Close the calling thread's connections for good"""
+        for key in ('rw', 'ro'):
+            conn = getattr(self._local, key, None)
+            if conn is not None:
+                conn.release()
+                setattr(self._local, key, None)
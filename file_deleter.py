@@ -0,0 +1,135 @@
+# file_deleter.py - Background removal of upload files whose media rows are gone
+#
+# Deleting media, or a task with hundreds of attachments, only removes rows.
+# Requests queue the stored filenames in file_deletions (migration 16) inside
+# the same transaction. A worker thread unlinks the files and their
+# thumbnails later, so requests neither touch the disk nor hold the write
+# lock while they do. The queue is a table, so deletes that were queued but
+# not yet done survive a restart. A failed unlink is retried with
+# exponential backoff. A blob is queued, and later removed, only while its
+# media_blobs.ref_count (kept by the migration 13 triggers) is 0. The count
+# is read again under the write lock just before the file is removed. Uploads
+# place content-addressed blobs under that lock, so a blob that was
+# re-uploaded in the meantime is kept.
+import os
+import threading
+import time
+
+# True when no media row references the blob `?`
+UNREFERENCED_SQL = 'COALESCE((SELECT ref_count FROM media_blobs WHERE filename = ?), 0) <= 0'
+
+
+class FileDeletionWorker:
+    def __init__(self, db, paths_for, poll_interval=5.0, batch_size=100, max_attempts=5, retry_delay=30):
+        """paths_for(filename) lists the file and every thumbnail/variant derived from it"""
+        self.db = db
+        self.paths_for = paths_for
+        self.poll_interval = poll_interval  # seconds between polls when nothing was queued locally
+        self.batch_size = batch_size  # files removed per write transaction
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay  # seconds before the first retry, doubled after each failure
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats = {'deleted': 0, 'kept': 0, 'retried': 0, 'failed': 0}
+
+    # --- producer side ---
+    def enqueue(self, conn, filenames):
+        """Queue stored files for removal; runs in the caller's transaction, after its media rows are deleted.
+
+        Only blobs whose reference count dropped to 0 are queued.
+        """
+        now = time.time()
+        conn.executemany(f'''INSERT INTO file_deletions (filename, created_at, next_attempt_at)
+                             SELECT ?, ?, ? WHERE {UNREFERENCED_SQL}
+                             ON CONFLICT (filename) DO NOTHING''',
+                         [(filename, now, now, filename) for filename in set(filenames)])
+
+    def notify(self):
+        """Wake the worker after committing new deletions"""
+        self._wake.set()
+
+    # --- worker ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='file-deleter', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        conn = self.db.connect()
+        try:
+            while not self._stop.is_set():
+                try:
+                    if self.run_once(conn) < self.batch_size:
+                        self._wake.wait(self.poll_interval)
+                        self._wake.clear()
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    print(f"Error in file deletion worker: {e}")
+                    time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+            self.db.close_thread_connections()
+
+    def _unlink(self, filename):
+        """Remove a file and its derived files; returns the first error, if any"""
+        error = None
+        for path in self.paths_for(filename):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                error = error or e
+        return error
+
+    def run_once(self, conn):
+        """Process one batch of due deletions; returns the number of queue entries handled"""
+        now = time.time()
+        rows = conn.execute('''SELECT filename, attempts FROM file_deletions WHERE next_attempt_at <= ?
+                               ORDER BY next_attempt_at LIMIT ?''', (now, self.batch_size)).fetchall()
+        if not rows:
+            return 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for filename, attempts in rows:
+                if not conn.execute(f'SELECT {UNREFERENCED_SQL}', (filename,)).fetchone()[0]:
+                    # Uploaded again since the delete was queued
+                    conn.execute('DELETE FROM file_deletions WHERE filename = ?', (filename,))
+                    self._stats['kept'] += 1
+                    continue
+                error = self._unlink(filename)
+                if error is None:
+                    conn.execute('DELETE FROM file_deletions WHERE filename = ?', (filename,))
+                    conn.execute('DELETE FROM media_blobs WHERE filename = ? AND ref_count <= 0', (filename,))
+                    self._stats['deleted'] += 1
+                elif attempts + 1 < self.max_attempts:
+                    conn.execute('''UPDATE file_deletions SET attempts = ?, next_attempt_at = ?, last_error = ?
+                                    WHERE filename = ?''',
+                                 (attempts + 1, now + self.retry_delay * 2 ** attempts, str(error), filename))
+                    self._stats['retried'] += 1
+                else:
+                    # Left for the upload reconciler to find
+                    print(f"Error deleting media file {filename}, giving up: {error}")
+                    conn.execute('DELETE FROM file_deletions WHERE filename = ?', (filename,))
+                    self._stats['failed'] += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return len(rows)
+
+    def get_stats(self):
+        conn = self.db.connect(readonly=True)
+        row = conn.execute('SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0) FROM file_deletions').fetchone()
+        conn.close()
+        return dict(self._stats, queued=row[0], retrying=row[1])
@@ -0,0 +1,54 @@
+# identity_cache.py - Bounded in-process username -> user id cache
+import threading
+from collections import OrderedDict
+
+
+class IdentityCache:
+    """LRU cache of username -> user id lookups.
+
+    Only hits are cached, so a username registered after a failed lookup is
+    found on the next call. Call invalidate() whenever a user row changes.
+    """
+
+    def __init__(self, db, max_size=1024):
+        self.db = db
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_user_id(self, username):
+        """Return the id for username, or None if there is no such user"""
+        with self._lock:
+            user_id = self._entries.get(username)
+            if user_id is not None:
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return user_id
+            self.misses += 1
+
+        conn = self.db.connect(readonly=True)
+        row = conn.execute('SELECT id FROM users WHERE username = ?', (username,)).fetchone()
+        conn.close()
+        if not row:
+            return None
+
+        self.put(username, row['id'])
+        return row['id']
+
+    def put(self, username, user_id):
+        """Record a known username -> id mapping, evicting the least recently used"""
+        with self._lock:
+            self._entries[username] = user_id
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """Forget one username, or everything when called without arguments"""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
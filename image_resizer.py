@@ -0,0 +1,239 @@
+# image_resizer.py - On-demand image resizing with a size-bounded LRU disk cache
+#
+# /media/<id>/resize renders a derivative of an uploaded image the first time
+# a size is asked for. New UI sizes therefore need no pass over the whole
+# library. Only a fixed set of dimensions is accepted, so clients cannot fill
+# the disk with arbitrary sizes. Results are kept in a cache directory. The
+# cache is limited to a byte budget and evicts least-recently-used entries.
+# File mtimes record use, so the LRU order survives restarts and is shared by
+# every process using the directory. Concurrent requests for the same
+# derivative wait for a single render. Cache entries are keyed by the stored
+# filename, which never changes content (see media_serving.is_immutable), so
+# an entry never needs invalidating.
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from PIL import Image, ImageOps
+
+from thumbnails import WEBP_QUALITY, WEBP_METHOD
+
+DEFAULT_SIZES = (64, 128, 160, 256, 320, 480, 640, 960, 1280, 1920)
+FITS = ('contain', 'cover')
+FORMATS = {
+    # fmt -> (Pillow format, file extension)
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+    'png': ('PNG', 'png'),
+}
+RENDER_VERSION = 1  # bump when rendering changes so old cache entries are not reused
+
+
+class ResizeCache:
+    def __init__(self, cache_dir, max_bytes, sizes=DEFAULT_SIZES, quality=WEBP_QUALITY, render_timeout=60,
+                 rescan_interval=60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.sizes = frozenset(sizes)
+        self.quality = quality
+        self.render_timeout = render_timeout  # seconds a collapsed request waits for the render
+        # Seconds between re-reads of the directory, which pick up renders of other processes sharing it
+        self.rescan_interval = rescan_interval
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # cache name -> size in bytes, least recently used first
+        self._total = 0
+        self._scanned_at = 0.0
+        self._in_flight = {}  # cache name -> Future of the render
+        self._stats = {'hits': 0, 'misses': 0, 'collapsed': 0, 'renders': 0, 'render_errors': 0,
+                       'evictions': 0, 'evicted_bytes': 0, 'render_time_total': 0.0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def parse(self, args):
+        """Validate w/h/fit/fmt query arguments; returns a spec dict or raises ValueError"""
+        spec = {}
+        for dim in ('w', 'h'):
+            value = args.get(dim)
+            if value in (None, ''):
+                spec[dim] = None
+                continue
+            if not value.isdigit() or int(value) not in self.sizes:
+                raise ValueError(f"{dim} must be one of {', '.join(str(s) for s in sorted(self.sizes))}")
+            spec[dim] = int(value)
+        if spec['w'] is None and spec['h'] is None:
+            raise ValueError('w or h is required')
+        spec['fit'] = args.get('fit') or 'contain'
+        if spec['fit'] not in FITS:
+            raise ValueError(f"fit must be one of {', '.join(FITS)}")
+        spec['fmt'] = args.get('fmt') or 'webp'
+        if spec['fmt'] not in FORMATS:
+            raise ValueError(f"fmt must be one of {', '.join(FORMATS)}")
+        return spec
+
+    def cache_name(self, filename, spec):
+        """<sha256 of source + spec>.<ext>, under a two-character shard directory"""
+        key = hashlib.sha256(f"{RENDER_VERSION}|{filename}|{spec['w']}|{spec['h']}|{spec['fit']}|"
+                             f"{spec['fmt']}|{self.quality}".encode()).hexdigest()
+        return f"{key[:2]}/{key}.{FORMATS[spec['fmt']][1]}"
+
+    def get(self, source_path, filename, spec):
+        """Cache name (relative to cache_dir) of the rendered derivative, rendering it if needed"""
+        name = self.cache_name(filename, spec)
+        path = os.path.join(self.cache_dir, name)
+        owner = False
+        with self._lock:
+            if os.path.exists(path):
+                self._hit(name, path)
+                return name
+            if name in self._entries:
+                # Removed by another process sharing the directory
+                self._total -= self._entries.pop(name)
+            future = self._in_flight.get(name)
+            if future is not None:
+                self._stats['collapsed'] += 1
+            else:
+                self._stats['misses'] += 1
+                future = self._in_flight[name] = Future()
+                owner = True
+        if not owner:
+            return future.result(timeout=self.render_timeout)
+
+        try:
+            started = time.perf_counter()
+            size = self._render(source_path, path, spec)
+            took = time.perf_counter() - started
+        except Exception as e:
+            with self._lock:
+                self._stats['render_errors'] += 1
+                self._in_flight.pop(name, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._stats['renders'] += 1
+            self._stats['render_time_total'] += took
+            self._add(name, size)
+            self._evict()
+            self._in_flight.pop(name, None)
+        future.set_result(name)
+        if time.monotonic() - self._scanned_at > self.rescan_interval:
+            self._load_index()
+        return name
+
+    def _hit(self, name, path):
+        """Record a use; caller holds the lock"""
+        self._stats['hits'] += 1
+        if name in self._entries:
+            self._entries.move_to_end(name)
+        else:
+            # Rendered by another process sharing the cache directory
+            self._add(name, os.path.getsize(path))
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _add(self, name, size):
+        if name in self._entries:
+            self._total -= self._entries.pop(name)
+        self._entries[name] = size
+        self._total += size
+
+    def _evict(self):
+        """Drop least recently used entries until within budget; caller holds the lock"""
+        # The newest entry is kept even if it alone is over budget
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error evicting resized image: {e}")
+            self._stats['evictions'] += 1
+            self._stats['evicted_bytes'] += size
+
+    def _load_index(self):
+        """Rebuild the LRU order from the files on disk, oldest use first.
+
+        Every process sharing the directory touches the files it serves, so
+        the disk holds the combined LRU order. Rebuilding from it makes the
+        byte budget apply to the directory as a whole, not to each process.
+        """
+        self._scanned_at = time.monotonic()
+        found = []
+        for directory, _, files in os.walk(self.cache_dir):
+            for file in files:
+                path = os.path.join(directory, file)
+                try:
+                    stat = os.stat(path)
+                    if file.endswith('.tmp'):
+                        if stat.st_mtime < time.time() - 3600:
+                            # Left by a render that was interrupted
+                            os.remove(path)
+                        continue
+                except FileNotFoundError:
+                    # Evicted by another process during the walk
+                    continue
+                found.append((stat.st_mtime, os.path.relpath(path, self.cache_dir).replace(os.sep, '/'),
+                              stat.st_size))
+        with self._lock:
+            self._entries.clear()
+            self._total = 0
+            for _, name, size in sorted(found):
+                self._add(name, size)
+            self._evict()
+
+    def _render(self, source_path, path, spec):
+        """Resize source_path into path; returns the file size. Never upscales."""
+        w, h = spec['w'], spec['h']
+        pil_format = FORMATS[spec['fmt']][0]
+        with Image.open(source_path) as img:
+            if img.format == 'JPEG':
+                # Decode at a reduced scale that still covers the requested box
+                img.draft(None, (max(w or 0, h or 0),) * 2)
+            img = ImageOps.exif_transpose(img)
+            if spec['fit'] == 'cover' and w and h:
+                factor = min(1.0, img.width / w, img.height / h)
+                img = ImageOps.fit(img, (max(1, round(w * factor)), max(1, round(h * factor))),
+                                   Image.Resampling.LANCZOS)
+            else:
+                scale = min((w or img.width) / img.width, (h or img.height) / img.height, 1.0)
+                size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+                if size != img.size:
+                    img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+            if pil_format == 'JPEG' and img.mode != 'RGB':
+                img = img.convert('RGB')
+            elif pil_format == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                if pil_format == 'WEBP':
+                    img.save(tmp_path, format='WEBP', quality=self.quality, method=WEBP_METHOD)
+                elif pil_format == 'JPEG':
+                    img.save(tmp_path, format='JPEG', quality=self.quality, optimize=True)
+                else:
+                    img.save(tmp_path, format='PNG')
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return os.path.getsize(path)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._total
+            stats['in_flight'] = len(self._in_flight)
+        lookups = stats['hits'] + stats['misses'] + stats['collapsed']
+        stats['max_bytes'] = self.max_bytes
+        stats['hit_rate'] = (stats['hits'] + stats['collapsed']) / lookups if lookups else 0.0
+        stats['render_time_avg'] = stats['render_time_total'] / stats['renders'] if stats['renders'] else 0.0
+        return stats
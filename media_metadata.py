@@ -0,0 +1,175 @@
+# media_metadata.py - Dimensions, orientation, capture time and duration of uploads
+#
+# Read at upload time and stored on the media row (migration 17), so the gallery
+# can lay out its grid before any image has loaded. Only headers are read.
+# Pillow opens images lazily and reads the size and EXIF block without
+# decoding pixels. MP4/MOV files are walked box by box, and the media data is
+# skipped with seeks. Width and height are as displayed, i.e. already swapped
+# for orientations that rotate by 90 degrees. `orientation` is the EXIF value
+# (1-8), or the equivalent of an MP4 track's rotation.
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from thumbnails import IMAGE_EXTENSIONS
+
+MP4_EXTENSIONS = ('mp4', 'mov')
+METADATA_FIELDS = ('width', 'height', 'orientation', 'captured_at', 'duration')
+
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 0x9003
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # width and height swap when displayed
+
+MP4_EPOCH = datetime(1904, 1, 1)
+MP4_CONTAINERS = (b'moov', b'trak')
+# tkhd matrix (a, b, c, d) in 16.16 fixed point -> EXIF-style orientation
+MP4_ROTATIONS = {
+    (0x10000, 0, 0, 0x10000): 1,
+    (0, 0x10000, -0x10000, 0): 6,  # 90 degrees clockwise
+    (-0x10000, 0, 0, -0x10000): 3,
+    (0, -0x10000, 0x10000, 0): 8,
+}
+
+
+def empty_metadata():
+    return dict.fromkeys(METADATA_FIELDS)
+
+
+def exif_datetime(value):
+    """'2024:05:01 13:45:00' -> '2024-05-01 13:45:00', or None if unparseable"""
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def image_metadata(path):
+    metadata = empty_metadata()
+    with Image.open(path) as img:
+        width, height = img.size
+        exif = img.getexif()
+        orientation = exif.get(EXIF_ORIENTATION)
+        captured = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    if orientation in ROTATED_ORIENTATIONS:
+        width, height = height, width
+    metadata.update(width=width, height=height, orientation=orientation if orientation in range(1, 9) else None,
+                    captured_at=exif_datetime(captured) if captured else None)
+    return metadata
+
+
+def iter_boxes(f, end):
+    """Yield (type, payload offset, payload size) of the ISO BMFF boxes up to `end`"""
+    offset = f.tell()
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return
+        yield box_type, offset + header, size - header
+        offset += size
+
+
+def mp4_metadata(path):
+    metadata = empty_metadata()
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        end = f.tell()
+        f.seek(0)
+        _walk_mp4(f, end, metadata)
+    return metadata
+
+
+def _walk_mp4(f, end, metadata):
+    for box_type, offset, size in iter_boxes(f, end):
+        f.seek(offset)
+        if box_type in MP4_CONTAINERS:
+            _walk_mp4(f, offset + size, metadata)
+        elif box_type == b'mvhd':
+            version = f.read(4)[0]
+            if version == 1:
+                created, _, timescale, duration = struct.unpack('>QQIQ', f.read(28))
+            else:
+                created, _, timescale, duration = struct.unpack('>IIII', f.read(16))
+            if timescale:
+                metadata['duration'] = round(duration / timescale, 3)
+            if created:
+                metadata['captured_at'] = (MP4_EPOCH + timedelta(seconds=created)).strftime('%Y-%m-%d %H:%M:%S')
+        elif box_type == b'tkhd' and metadata['width'] is None:
+            version = f.read(4)[0]
+            # Skip times, track id, duration, layer, group, volume
+            f.seek(offset + 4 + (32 if version == 1 else 20) + 16)
+            a, b, _, c, d = struct.unpack('>5i', f.read(20))
+            f.seek(offset + size - 8)
+            width, height = (value >> 16 for value in struct.unpack('>II', f.read(8)))
+            if width and height:
+                # Audio tracks have no size; the first sized track is the video
+                orientation = MP4_ROTATIONS.get((a, b, c, d))
+                if orientation in ROTATED_ORIENTATIONS:
+                    width, height = height, width
+                metadata.update(width=width, height=height, orientation=orientation)
+
+
+def extract_metadata(path, file_type):
+    """Metadata dict (see METADATA_FIELDS) of an upload; fields that cannot be read are None"""
+    try:
+        if file_type in IMAGE_EXTENSIONS:
+            return image_metadata(path)
+        if file_type in MP4_EXTENSIONS:
+            return mp4_metadata(path)
+    except Exception as e:
+        print(f"Error reading media metadata: {e}")
+    return empty_metadata()
+
+
+def backfill_metadata(conn, upload_folder, workers=4, batch_size=200):
+    """Extract metadata for media rows that predate it; returns a report dict.
+
+    Files are read on a thread pool, since the work is mostly waiting on
+    disk. Rows are updated one batch per transaction, so the command can be
+    interrupted and run again.
+    """
+    report = {'rows': 0, 'with_dimensions': 0, 'missing': 0}
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = conn.execute('''SELECT id, filename, file_type FROM media
+                                   WHERE metadata_at IS NULL AND id > ? ORDER BY id LIMIT ?''',
+                                (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            paths = [os.path.join(upload_folder, row['filename']) for row in rows]
+            results = list(pool.map(lambda item: extract_metadata(*item) if os.path.exists(item[0]) else None,
+                                    [(path, row['file_type']) for path, row in zip(paths, rows)]))
+            now = time.time()
+            updates = []
+            for row, metadata in zip(rows, results):
+                if metadata is None:
+                    report['missing'] += 1
+                    metadata = empty_metadata()
+                elif metadata['width']:
+                    report['with_dimensions'] += 1
+                updates.append(tuple(metadata[field] for field in METADATA_FIELDS) + (now, row['id']))
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany(f'''UPDATE media SET {', '.join(f'{field} = ?' for field in METADATA_FIELDS)},
+                                         metadata_at = ? WHERE id = ?''', updates)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            report['rows'] += len(rows)
+            last_id = rows[-1]['id']
+            print(f"Read metadata of {report['rows']} media files")
+    return report
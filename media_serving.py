@@ -0,0 +1,106 @@
+# media_serving.py - Serve uploads with Range support, offload and long-lived caching
+#
+# Uploads and their variants are served by /media/<filename> rather than the
+# static handler. Byte-range requests are answered with 206 so browsers can
+# seek in videos without downloading them. When a front proxy is configured
+# (nginx X-Accel-Redirect, or Apache/lighttpd X-Sendfile), the Python worker
+# only checks the request and sets headers; the proxy sends the bytes.
+# Original files never change once stored: content-addressed names are the
+# SHA-256 of the bytes and legacy names are random. They are served with a
+# strong ETag and `Cache-Control: immutable`, so browsers never revalidate
+# them. Derived files can be re-rendered under the same name, so they get a
+# shorter max-age and are revalidated by ETag.
+#
+# nginx, with MEDIA_OFFLOAD=x-accel-redirect and the default MEDIA_ACCEL_PREFIX:
+#     location /_media/ {
+#         internal;
+#         alias /path/to/app/static/uploads/;
+#         add_header ETag $upstream_http_etag;
+#         add_header Cache-Control $upstream_http_cache_control;
+#     }
+# In the location that proxies to the app, pass the client address on and set
+# TRUSTED_PROXY_HOPS=1, or every client shares nginx's rate limit buckets:
+#     proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+#     proxy_set_header X-Forwarded-Proto $scheme;
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from flask import send_file, Response
+from werkzeug.security import safe_join
+
+from media_store import is_content_addressed
+
+OFFLOAD_MODES = ('', 'x-accel-redirect', 'x-sendfile')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+# <sha256>.<ext> (content-addressed) or <uuid4 hex>.<ext> (legacy random name)
+ORIGINAL_NAME_RE = re.compile(r'^(?:[0-9a-f]{64}|[0-9a-f]{32})\.[A-Za-z0-9]+$')
+
+
+def is_immutable(filename):
+    """True for stored originals, whose bytes never change under the same name"""
+    return bool(ORIGINAL_NAME_RE.match(posixpath.basename(filename)))
+
+
+class MediaServer:
+    def __init__(self, upload_folder, offload='', accel_prefix='/_media/', max_age=86400):
+        if offload not in OFFLOAD_MODES:
+            raise ValueError(f"Unknown media offload mode {offload!r}, expected one of {OFFLOAD_MODES}")
+        self.upload_folder = upload_folder
+        self.offload = offload
+        self.accel_prefix = accel_prefix.rstrip('/') + '/'  # internal nginx location aliased to upload_folder
+        self.max_age = max_age  # seconds, for derived files that may be re-rendered
+
+    def resolve(self, filename):
+        """Filesystem path of a servable file, or None.
+
+        Rejects traversal and hidden entries (temporary uploads, the .partial
+        folder of resumable uploads).
+        """
+        if any(part.startswith('.') for part in filename.split('/')):
+            return None
+        path = safe_join(self.upload_folder, filename)
+        if path is None or not os.path.isfile(path):
+            return None
+        return os.path.abspath(path)
+
+    def etag(self, filename, stat):
+        if is_content_addressed(filename) and is_immutable(filename):
+            # The name is the content hash
+            return posixpath.basename(filename).split('.', 1)[0]
+        return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+    def response(self, request, filename):
+        """Response for GET/HEAD of an upload, or None when there is no such file"""
+        path = self.resolve(filename)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        etag = self.etag(filename, stat)
+        immutable = is_immutable(filename)
+        max_age = IMMUTABLE_MAX_AGE if immutable else self.max_age
+
+        if self.offload:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            rv = Response(mimetype=mimetype)
+            rv.set_etag(etag)
+            rv.last_modified = int(stat.st_mtime)
+            rv = rv.make_conditional(request)
+            if rv.status_code == 200:
+                # The proxy sends the file and answers Range requests itself
+                if self.offload == 'x-accel-redirect':
+                    rv.headers['X-Accel-Redirect'] = self.accel_prefix + quote(filename)
+                else:
+                    rv.headers['X-Sendfile'] = path
+        else:
+            # conditional=True answers If-None-Match with 304 and Range with 206
+            rv = send_file(path, etag=etag, conditional=True, last_modified=stat.st_mtime, max_age=max_age)
+            # Tell players up front that they may seek with Range requests
+            rv.accept_ranges = 'bytes'
+
+        rv.cache_control.public = True
+        rv.cache_control.max_age = max_age
+        rv.cache_control.immutable = immutable
+        return rv
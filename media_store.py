@@ -0,0 +1,203 @@
+# media_store.py - Content-addressed, deduplicated storage for uploads
+#
+# Uploads are hashed as they stream to disk and stored as <sha256>.<ext>, so
+# identical files are kept once however many media rows use them. Files live
+# in a two-level sharded layout (ab/cd/abcd....ext). That keeps directories
+# small. media.filename holds this relative path, and every route resolves
+# paths and URLs from it. Triggers on media (migration 13) maintain
+# media_blobs.ref_count. A blob and its thumbnails are queued for removal
+# only once that count is 0 (see file_deleter). Placing a file and unlinking
+# an unreferenced one both happen while the database write lock is held, so
+# an upload can never reuse a blob that is being deleted.
+import hashlib
+import os
+import posixpath
+import re
+import time
+import uuid
+
+from thumbnails import derived_files
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST_NAME_RE = re.compile(r'^[0-9a-f]{64}\.')
+
+
+def is_content_addressed(filename):
+    return bool(DIGEST_NAME_RE.match(posixpath.basename(filename)))
+
+
+def shard_path(filename):
+    """'abcdef0123.jpg' -> 'ab/cd/abcdef0123.jpg'; spreads files over 65536 directories"""
+    base = posixpath.basename(filename)
+    return f"{base[:2]}/{base[2:4]}/{base}"
+
+
+def hash_file(path, chunk_size=CHUNK_SIZE):
+    """Return (sha256 hex digest, size in bytes) of a file"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class BlobStore:
+    def __init__(self, upload_folder, delete_files, chunk_size=CHUNK_SIZE):
+        """delete_files(filenames) removes blobs together with their derived thumbnails"""
+        self.upload_folder = upload_folder
+        self.delete_files = delete_files
+        self.chunk_size = chunk_size
+
+    def path(self, filename):
+        return os.path.join(self.upload_folder, filename)
+
+    def receive(self, stream, extension):
+        """Copy an upload stream to a temporary file while hashing it.
+
+        Returns (temp_path, sharded content-addressed filename, size). Pass the temp
+        path to place() inside the transaction that inserts the media row, or
+        to discard() if the upload is abandoned.
+        """
+        temp_path = self.path(f".upload-{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in iter(lambda: stream.read(self.chunk_size), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        except Exception:
+            self.discard(temp_path)
+            raise
+        return temp_path, shard_path(f"{digest.hexdigest()}.{extension}"), size
+
+    def place(self, temp_path, filename):
+        """Move a received upload into place; returns False when the blob already existed.
+
+        Call while holding the write transaction that references the blob.
+        """
+        target = self.path(filename)
+        if os.path.exists(target):
+            self.discard(temp_path)
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp_path, target)
+        return True
+
+    def discard(self, temp_path):
+        try:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        except OSError as e:
+            print(f"Error removing temporary upload: {e}")
+
+    def dedupe_legacy(self, conn, enqueue_thumbnail, dry_run=False):
+        """Move files stored under random names to content-addressed names.
+
+        Duplicates collapse onto one blob. Affected images get their variants
+        re-rendered under the new name through enqueue_thumbnail(conn, media_id).
+        Returns a report with the number of files, duplicates and bytes saved.
+        """
+        report = {'dry_run': dry_run, 'files': 0, 'moved': 0, 'duplicates': 0, 'missing': 0, 'bytes_saved': 0}
+        legacy = [row[0] for row in conn.execute('SELECT DISTINCT filename FROM media').fetchall()
+                  if not is_content_addressed(row[0])]
+        planned = set()
+        for filename in legacy:
+            source = self.path(filename)
+            if not os.path.exists(source):
+                report['missing'] += 1
+                continue
+            report['files'] += 1
+            digest, size = hash_file(source, self.chunk_size)
+            extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+            target = shard_path(f"{digest}.{extension}")
+            duplicate = target in planned or os.path.exists(self.path(target))
+            planned.add(target)
+            if duplicate:
+                report['duplicates'] += 1
+                report['bytes_saved'] += size
+            else:
+                report['moved'] += 1
+            if dry_run:
+                continue
+
+            conn.execute('BEGIN IMMEDIATE')
+            moved = False
+            try:
+                if not os.path.exists(self.path(target)):
+                    os.makedirs(os.path.dirname(self.path(target)), exist_ok=True)
+                    os.replace(source, self.path(target))
+                    moved = True
+                media_ids = [row[0] for row in conn.execute('SELECT id FROM media WHERE filename = ?', (filename,))]
+                conn.execute('''UPDATE media SET filename = ?,
+                                    thumbnail_status = CASE thumbnail_status WHEN 'none' THEN 'none' ELSE 'pending' END
+                                WHERE filename = ?''', (target, filename))
+                conn.execute('DELETE FROM media_blobs WHERE filename = ? AND ref_count <= 0', (filename,))
+                for media_id in media_ids:
+                    conn.execute('DELETE FROM media_variants WHERE media_id = ?', (media_id,))
+                    status = conn.execute('SELECT thumbnail_status FROM media WHERE id = ?', (media_id,)).fetchone()
+                    if status[0] == 'pending':
+                        enqueue_thumbnail(conn, media_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                if moved:
+                    os.replace(self.path(target), source)
+                raise
+            # Old original (if it was a duplicate) plus its thumbnails and variants. Only after the
+            # commit, so a rollback never points rows back at a removed file. Random legacy names are
+            # never reused, so nothing can claim the name in between.
+            self.delete_files([filename])
+        return report
+
+    def _move_to_shard(self, filename, target):
+        """Move a flat file and its thumbnails/variants into the shard directory; False if missing"""
+        target_dir = os.path.dirname(self.path(target))
+        os.makedirs(target_dir, exist_ok=True)
+        for path in derived_files(self.upload_folder, filename):
+            if os.path.exists(path):
+                os.replace(path, os.path.join(target_dir, os.path.basename(path)))
+        source = self.path(filename)
+        if os.path.exists(source):
+            os.replace(source, self.path(target))
+            return True
+        # Already moved by an interrupted run
+        return os.path.exists(self.path(target))
+
+    def shard_legacy(self, conn, batch_size=200, pause=0.05):
+        """Move files stored in the flat upload folder into the sharded layout.
+
+        Works in batches, each committed separately, so uploads and deletes
+        keep running. Safe to interrupt and re-run: files already moved are
+        detected and only their rows are rewritten. Returns a report dict.
+        """
+        report = {'files': 0, 'missing': 0, 'batches': 0}
+        while True:
+            rows = conn.execute("SELECT DISTINCT filename FROM media WHERE instr(filename, '/') = 0 LIMIT ?",
+                                (batch_size,)).fetchall()
+            if not rows:
+                break
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for (filename,) in rows:
+                    target = shard_path(filename)
+                    if not self._move_to_shard(filename, target):
+                        report['missing'] += 1
+                    prefix = posixpath.dirname(target) + '/'
+                    conn.execute('''UPDATE media_variants SET filename = ? || filename
+                                    WHERE instr(filename, '/') = 0
+                                      AND media_id IN (SELECT id FROM media WHERE filename = ?)''', (prefix, filename))
+                    conn.execute('UPDATE media SET filename = ? WHERE filename = ?', (target, filename))
+                    conn.execute('DELETE FROM media_blobs WHERE filename = ? AND ref_count <= 0', (filename,))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            report['files'] += len(rows)
+            report['batches'] += 1
+            print(f"Sharded {report['files']} files ({report['missing']} missing on disk)")
+            time.sleep(pause)
+        return report
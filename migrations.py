@@ -0,0 +1,517 @@
+# migrations.py - Versioned schema migrations for the TaskFlow database
+#
+# Each migration runs exactly once, in order, inside its own transaction.
+# The highest applied version is recorded in the schema_version table.
+# To change the schema, append a new (version, name, steps) entry to
+# MIGRATIONS. Never edit a migration that has already shipped. A step is
+# either a SQL string or a callable that receives the connection.
+
+from user_stats import rebuild_user_stats
+from search import rebuild_search_index
+
+# Sort key that orders task priorities high -> medium -> low. Queries must use
+# this exact expression for SQLite to answer them from the expression index.
+PRIORITY_RANK_SQL = "CASE priority WHEN 'high' THEN 1 WHEN 'medium' THEN 2 WHEN 'low' THEN 3 ELSE 4 END"
+
+# Sort key for due dates; tasks without a due date sort last
+DUE_DATE_SORT_SQL = "IFNULL(due_date, '9999-12-31')"
+
+MIGRATIONS = [
+    (1, 'Core tables', [
+        '''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            due_date DATE,
+            priority TEXT DEFAULT 'medium',
+            completed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS media (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            task_id INTEGER,
+            filename TEXT NOT NULL,
+            original_filename TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            description TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(task_id) REFERENCES tasks(id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS password_reset_tokens (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token TEXT UNIQUE NOT NULL,
+            expires_at TIMESTAMP NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )''',
+    ]),
+    (2, 'Notification tables', [
+        '''CREATE TABLE IF NOT EXISTS notification_preferences (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            email_enabled INTEGER DEFAULT 1,
+            due_today_enabled INTEGER DEFAULT 1,
+            due_tomorrow_enabled INTEGER DEFAULT 1,
+            overdue_enabled INTEGER DEFAULT 1,
+            reminder_hours INTEGER DEFAULT 24,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS notification_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            task_id INTEGER NOT NULL,
+            notification_type TEXT NOT NULL,
+            status TEXT DEFAULT 'pending',
+            sent_at TIMESTAMP,
+            error_message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS in_app_notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            message TEXT NOT NULL,
+            type TEXT DEFAULT 'info',
+            read_status INTEGER DEFAULT 0,
+            task_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )''',
+    ]),
+    (3, 'Hot-path indexes', [
+        # tasks WHERE user_id = ? ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at)',
+        # media WHERE user_id = ? AND task_id = ? ORDER BY upload_date
+        'CREATE INDEX IF NOT EXISTS idx_media_user_task_upload ON media (user_id, task_id, upload_date)',
+        # media WHERE user_id = ? ORDER BY upload_date
+        'CREATE INDEX IF NOT EXISTS idx_media_user_upload ON media (user_id, upload_date)',
+        # LEFT JOIN media m ON t.id = m.task_id
+        'CREATE INDEX IF NOT EXISTS idx_media_task ON media (task_id)',
+        # in_app_notifications WHERE user_id = ? AND read_status = 0 ORDER BY created_at
+        'CREATE INDEX IF NOT EXISTS idx_in_app_user_read ON in_app_notifications (user_id, read_status, created_at)',
+        # notification_log dedupe check in already_notified_today
+        '''CREATE INDEX IF NOT EXISTS idx_notification_log_dedupe
+           ON notification_log (user_id, notification_type, status, task_id, sent_at)''',
+        'CREATE INDEX IF NOT EXISTS idx_notification_prefs_user ON notification_preferences (user_id)',
+    ]),
+    (4, 'Task list sort indexes', [
+        f'CREATE INDEX IF NOT EXISTS idx_tasks_user_due ON tasks (user_id, {DUE_DATE_SORT_SQL})',
+        f'CREATE INDEX IF NOT EXISTS idx_tasks_user_priority ON tasks (user_id, {PRIORITY_RANK_SQL})',
+    ]),
+    (5, 'Per-user statistics', [
+        '''CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_tasks INTEGER NOT NULL DEFAULT 0,
+            completed_tasks INTEGER NOT NULL DEFAULT 0,
+            pending_tasks INTEGER NOT NULL DEFAULT 0,
+            total_media INTEGER NOT NULL DEFAULT 0,
+            tasks_with_media INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        # Overdue count: user_id = ? AND completed = 0 AND due_date < date('now')
+        'CREATE INDEX IF NOT EXISTS idx_tasks_user_open_due ON tasks (user_id, completed, due_date)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_task_insert AFTER INSERT ON tasks BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET
+                total_tasks = total_tasks + 1,
+                completed_tasks = completed_tasks + (NEW.completed = 1),
+                pending_tasks = pending_tasks + (NEW.completed = 0)
+            WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_task_update AFTER UPDATE OF completed ON tasks
+           WHEN OLD.completed IS NOT NEW.completed BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET
+                completed_tasks = completed_tasks + (NEW.completed = 1) - (OLD.completed = 1),
+                pending_tasks = pending_tasks + (NEW.completed = 0) - (OLD.completed = 0)
+            WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_task_delete AFTER DELETE ON tasks BEGIN
+            UPDATE user_stats SET
+                total_tasks = total_tasks - 1,
+                completed_tasks = completed_tasks - (OLD.completed = 1),
+                pending_tasks = pending_tasks - (OLD.completed = 0)
+            WHERE user_id = OLD.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_media_insert AFTER INSERT ON media BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET
+                total_media = total_media + 1,
+                tasks_with_media = tasks_with_media + (NEW.task_id IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM media WHERE user_id = NEW.user_id AND task_id = NEW.task_id AND id != NEW.id))
+            WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_media_update AFTER UPDATE OF task_id ON media
+           WHEN OLD.task_id IS NOT NEW.task_id BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET
+                tasks_with_media = tasks_with_media
+                    - (OLD.task_id IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM media WHERE user_id = OLD.user_id AND task_id = OLD.task_id))
+                    + (NEW.task_id IS NOT NULL AND NOT EXISTS (
+                        SELECT 1 FROM media WHERE user_id = NEW.user_id AND task_id = NEW.task_id AND id != NEW.id))
+            WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_media_delete AFTER DELETE ON media BEGIN
+            UPDATE user_stats SET
+                total_media = total_media - 1,
+                tasks_with_media = tasks_with_media - (OLD.task_id IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM media WHERE user_id = OLD.user_id AND task_id = OLD.task_id))
+            WHERE user_id = OLD.user_id;
+        END''',
+        rebuild_user_stats,
+    ]),
+    (6, 'Per-user data version', [
+        'ALTER TABLE user_stats ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_tasks_insert AFTER INSERT ON tasks BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_tasks_update AFTER UPDATE ON tasks BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_tasks_delete AFTER DELETE ON tasks BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (OLD.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = OLD.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_media_insert AFTER INSERT ON media BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_media_update AFTER UPDATE ON media BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_data_version_media_delete AFTER DELETE ON media BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (OLD.user_id);
+            UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = OLD.user_id;
+        END''',
+    ]),
+    (7, 'Full-text search', [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+            title, content='tasks', content_rowid='id', prefix='2 3'
+        )''',
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(
+            description, original_filename, content='media', content_rowid='id', prefix='2 3'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_insert AFTER INSERT ON tasks BEGIN
+            INSERT INTO tasks_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_delete AFTER DELETE ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_tasks_fts_update AFTER UPDATE OF title ON tasks BEGIN
+            INSERT INTO tasks_fts (tasks_fts, rowid, title) VALUES ('delete', OLD.id, OLD.title);
+            INSERT INTO tasks_fts (rowid, title) VALUES (NEW.id, NEW.title);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_fts_insert AFTER INSERT ON media BEGIN
+            INSERT INTO media_fts (rowid, description, original_filename)
+            VALUES (NEW.id, NEW.description, NEW.original_filename);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_fts_delete AFTER DELETE ON media BEGIN
+            INSERT INTO media_fts (media_fts, rowid, description, original_filename)
+            VALUES ('delete', OLD.id, OLD.description, OLD.original_filename);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_fts_update AFTER UPDATE OF description, original_filename ON media BEGIN
+            INSERT INTO media_fts (media_fts, rowid, description, original_filename)
+            VALUES ('delete', OLD.id, OLD.description, OLD.original_filename);
+            INSERT INTO media_fts (rowid, description, original_filename)
+            VALUES (NEW.id, NEW.description, NEW.original_filename);
+        END''',
+        rebuild_search_index,
+    ]),
+    (8, 'Server-side sessions', [
+        '''CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)',
+    ]),
+    (9, 'Pending registrations', [
+        '''CREATE TABLE IF NOT EXISTS pending_registrations (
+            username TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            otp TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_pending_registrations_expires ON pending_registrations (expires_at)',
+    ]),
+    (10, 'Rate limit buckets', [
+        '''CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            full_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_full ON rate_limit_buckets (full_at)',
+    ]),
+    (11, 'Thumbnail jobs', [
+        "ALTER TABLE media ADD COLUMN thumbnail_status TEXT NOT NULL DEFAULT 'none'",
+        '''CREATE TABLE IF NOT EXISTS thumbnail_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_id INTEGER NOT NULL UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_thumbnail_jobs_status ON thumbnail_jobs (status, id)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_thumbnail_jobs_media_delete AFTER DELETE ON media BEGIN
+            DELETE FROM thumbnail_jobs WHERE media_id = OLD.id;
+        END''',
+        # Existing images get their thumbnails (re)generated by the worker
+        '''UPDATE media SET thumbnail_status = 'pending'
+           WHERE lower(file_type) IN ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp')''',
+        '''INSERT OR IGNORE INTO thumbnail_jobs (media_id, created_at)
+           SELECT id, CAST(strftime('%s', 'now') AS REAL) FROM media WHERE thumbnail_status = 'pending' ''',
+    ]),
+    (12, 'Media variants', [
+        '''CREATE TABLE IF NOT EXISTS media_variants (
+            media_id INTEGER NOT NULL,
+            width INTEGER NOT NULL,
+            height INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            file_size INTEGER NOT NULL,
+            PRIMARY KEY (media_id, width)
+        ) WITHOUT ROWID''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_variants_media_delete AFTER DELETE ON media BEGIN
+            DELETE FROM media_variants WHERE media_id = OLD.id;
+        END''',
+        # Images that only have a single-size thumbnail get their variants rendered
+        "UPDATE media SET thumbnail_status = 'pending' WHERE thumbnail_status = 'ready'",
+        '''INSERT OR IGNORE INTO thumbnail_jobs (media_id, created_at)
+           SELECT id, CAST(strftime('%s', 'now') AS REAL) FROM media WHERE thumbnail_status = 'pending' ''',
+    ]),
+    (13, 'Content-addressed media blobs', [
+        '''CREATE TABLE IF NOT EXISTS media_blobs (
+            filename TEXT PRIMARY KEY,
+            file_size INTEGER NOT NULL DEFAULT 0,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_media_filename ON media (filename)',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_insert AFTER INSERT ON media BEGIN
+            INSERT INTO media_blobs (filename, file_size, ref_count) VALUES (NEW.filename, NEW.file_size, 1)
+            ON CONFLICT (filename) DO UPDATE SET ref_count = ref_count + 1;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_delete AFTER DELETE ON media BEGIN
+            UPDATE media_blobs SET ref_count = ref_count - 1 WHERE filename = OLD.filename;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_media_blobs_rename AFTER UPDATE OF filename ON media
+           WHEN NEW.filename != OLD.filename BEGIN
+            UPDATE media_blobs SET ref_count = ref_count - 1 WHERE filename = OLD.filename;
+            INSERT INTO media_blobs (filename, file_size, ref_count) VALUES (NEW.filename, NEW.file_size, 1)
+            ON CONFLICT (filename) DO UPDATE SET ref_count = ref_count + 1;
+        END''',
+        '''INSERT OR IGNORE INTO media_blobs (filename, file_size, ref_count)
+           SELECT filename, MAX(file_size), COUNT(*) FROM media GROUP BY filename''',
+    ]),
+    (14, 'Chunked upload sessions', [
+        '''CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            original_filename TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            total_size INTEGER NOT NULL,
+            sha256 TEXT,
+            task_id INTEGER,
+            description TEXT,
+            received INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions (expires_at)',
+    ]),
+    (15, 'Media variant filename index', [
+        # Lets the upload reconciler read referenced filenames in order
+        'CREATE INDEX IF NOT EXISTS idx_media_variants_filename ON media_variants (filename)',
+    ]),
+    (16, 'File deletion queue', [
+        '''CREATE TABLE IF NOT EXISTS file_deletions (
+            filename TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            next_attempt_at REAL NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS idx_file_deletions_due ON file_deletions (next_attempt_at)',
+    ]),
+    (17, 'Media metadata', [
+        'ALTER TABLE media ADD COLUMN width INTEGER',
+        'ALTER TABLE media ADD COLUMN height INTEGER',
+        'ALTER TABLE media ADD COLUMN orientation INTEGER',
+        'ALTER TABLE media ADD COLUMN captured_at TEXT',
+        'ALTER TABLE media ADD COLUMN duration REAL',
+        # NULL until read at upload or by `flask backfill-media-metadata`
+        'ALTER TABLE media ADD COLUMN metadata_at REAL',
+    ]),
+    (18, 'Per-user storage bytes', [
+        'ALTER TABLE user_stats ADD COLUMN media_bytes INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_media_bytes_insert AFTER INSERT ON media BEGIN
+            INSERT OR IGNORE INTO user_stats (user_id) VALUES (NEW.user_id);
+            UPDATE user_stats SET media_bytes = media_bytes + COALESCE(NEW.file_size, 0)
+            WHERE user_id = NEW.user_id;
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS trg_user_stats_media_bytes_delete AFTER DELETE ON media BEGIN
+            UPDATE user_stats SET media_bytes = media_bytes - COALESCE(OLD.file_size, 0)
+            WHERE user_id = OLD.user_id;
+        END''',
+        rebuild_user_stats,
+    ]),
+    (19, 'Upload sessions by user', [
+        # Open sessions per user, counted against the session cap and storage quota
+        'CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions (user_id, expires_at)',
+    ]),
+    (20, 'Retention indexes', [
+        # Let retention policies find expired rows without scanning the table
+        'CREATE INDEX IF NOT EXISTS idx_notification_log_created ON notification_log (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_in_app_created ON in_app_notifications (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_expires ON password_reset_tokens (expires_at)',
+        # With the above, answers `used = 1 OR expires_at < ...` as a union of two index searches
+        'CREATE INDEX IF NOT EXISTS idx_password_reset_tokens_used ON password_reset_tokens (used)',
+    ]),
+]
+
+# Hot-path queries and the index each one must be answered from.
+# Used by check_query_plans() and test_migrations.py.
+HOT_PATH_QUERIES = {
+    'tasks_by_user': (
+        'SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC',
+        (1,),
+        'idx_tasks_user_created',
+    ),
+    'tasks_page_by_created_at': (
+        '''SELECT * FROM tasks WHERE user_id = ? AND (created_at, id) < (?, ?)
+           ORDER BY created_at DESC, id DESC LIMIT ?''',
+        (1, '2024-01-01 00:00:00', 1, 50),
+        'idx_tasks_user_created',
+    ),
+    'tasks_page_by_due_date': (
+        f'''SELECT * FROM tasks WHERE user_id = ? AND ({DUE_DATE_SORT_SQL}, id) > (?, ?)
+            ORDER BY {DUE_DATE_SORT_SQL} ASC, id ASC LIMIT ?''',
+        (1, '2024-01-01', 1, 50),
+        'idx_tasks_user_due',
+    ),
+    'tasks_page_by_priority': (
+        f'''SELECT * FROM tasks WHERE user_id = ? AND ({PRIORITY_RANK_SQL}, id) > (?, ?)
+            ORDER BY {PRIORITY_RANK_SQL} ASC, id ASC LIMIT ?''',
+        (1, 1, 1, 50),
+        'idx_tasks_user_priority',
+    ),
+    'overdue_count': (
+        '''SELECT COUNT(*) as overdue FROM tasks
+           WHERE user_id = ? AND completed = 0 AND due_date IS NOT NULL AND due_date < date('now')''',
+        (1,),
+        'idx_tasks_user_open_due',
+    ),
+    'media_by_task': (
+        'SELECT * FROM media WHERE user_id = ? AND task_id = ? ORDER BY upload_date DESC',
+        (1, 1),
+        'idx_media_user_task_upload',
+    ),
+    'media_by_user': (
+        'SELECT * FROM media WHERE user_id = ? ORDER BY upload_date DESC',
+        (1,),
+        'idx_media_user_upload',
+    ),
+    'unread_notifications': (
+        '''SELECT * FROM in_app_notifications WHERE user_id = ? AND read_status = 0
+           ORDER BY created_at DESC LIMIT ?''',
+        (1, 10),
+        'idx_in_app_user_read',
+    ),
+    'notification_dedupe': (
+        '''SELECT COUNT(*) as count FROM notification_log
+           WHERE user_id = ? AND task_id IN (?, ?)
+           AND notification_type = ? AND status = 'sent'
+           AND DATE(sent_at) = ?''',
+        (1, 1, 2, 'overdue', '2024-01-01'),
+        'idx_notification_log_dedupe',
+    ),
+    'retention_notification_log': (
+        "SELECT id FROM notification_log WHERE (created_at < datetime('now', '-90 days')) LIMIT ?",
+        (500,),
+        'idx_notification_log_created',
+    ),
+    'retention_read_notifications': (
+        "SELECT id FROM in_app_notifications WHERE (read_status = 1 AND created_at < datetime('now', '-30 days')) LIMIT ?",
+        (500,),
+        'idx_in_app_created',
+    ),
+}
+
+
+def get_schema_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn):
+    """Apply every pending migration in order; returns the versions applied"""
+    applied = []
+    get_schema_version(conn)
+    for version, name, steps in MIGRATIONS:
+        # BEGIN IMMEDIATE serializes concurrent workers booting at the same time;
+        # re-read the version once we hold the write lock.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if get_schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {name}")
+        applied.append(version)
+    return applied
+
+
+def explain_query_plan(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail lines for a query"""
+    return [row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def check_query_plans(conn):
+    """Map each hot-path query name to (uses_expected_index, plan lines)"""
+    results = {}
+    for name, (sql, params, index_name) in HOT_PATH_QUERIES.items():
+        plan = explain_query_plan(conn, sql, params)
+        results[name] = (any(index_name in line for line in plan), plan)
+    return results
@@ -5,16 +5,139 @@ import os
 import schedule
 import time
 import threading
-from datetime import datetime, timedelta, date
+import atexit
+from datetime import datetime, timedelta, date, timezone
 from flask import Flask, jsonify, request, session
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
+from db_manager import DatabaseManager
+from migrations import run_migrations
+from identity_cache import IdentityCache
+
+
+class NotificationWriter:
+    """Write-behind buffer for notification_log and in_app_notifications rows.
+
+    Rows are queued in memory and written with executemany in one transaction
+    once batch_size rows are pending or flush_interval seconds have passed.
+    Pending rows are flushed at interpreter shutdown. Rows that arrive while
+    max_buffered rows are already pending are dropped and counted.
+    """
+    
+    def __init__(self, db, batch_size=200, flush_interval=2.0, max_buffered=10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self._log_rows = []
+        self._in_app_rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.counters = {'buffered': 0, 'flushed': 0, 'dropped': 0, 'flushes': 0, 'flush_errors': 0}
+        
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def _pending(self):
+        return len(self._log_rows) + len(self._in_app_rows)
+    
+    def _add(self, rows, row):
+        with self._lock:
+            if self._pending() >= self.max_buffered:
+                self.counters['dropped'] += 1
+                return False
+            rows.append(row)
+            self.counters['buffered'] += 1
+            if self._pending() >= self.batch_size:
+                self._wakeup.set()
+        return True
+    
+    def add_log(self, user_id, task_id, notification_type, status, sent_at, error_message):
+        return self._add(self._log_rows,
+                         (user_id, task_id, notification_type, status, sent_at, error_message, _utc_timestamp()))
+    
+    def add_in_app(self, user_id, title, message, notification_type, task_id):
+        return self._add(self._in_app_rows,
+                         (user_id, title, message, notification_type, task_id, _utc_timestamp()))
+    
+    def flush(self):
+        """Write all pending rows in one transaction; returns the number written"""
+        with self._flush_lock:
+            with self._lock:
+                log_rows, self._log_rows = self._log_rows, []
+                in_app_rows, self._in_app_rows = self._in_app_rows, []
+            count = len(log_rows) + len(in_app_rows)
+            if not count:
+                return 0
+            
+            conn = self.db.connect()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('''INSERT INTO notification_log 
+                                    (user_id, task_id, notification_type, status, sent_at, error_message, created_at) 
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)''', log_rows)
+                conn.executemany('''INSERT INTO in_app_notifications 
+                                    (user_id, title, message, type, task_id, created_at) 
+                                    VALUES (?, ?, ?, ?, ?, ?)''', in_app_rows)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Error flushing notification rows: {e}")
+                self._requeue(log_rows, in_app_rows)
+                return 0
+            finally:
+                conn.close()
+            
+            with self._lock:
+                self.counters['flushed'] += count
+                self.counters['flushes'] += 1
+            return count
+    
+    def _requeue(self, log_rows, in_app_rows):
+        """Put rows from a failed flush back in front of the queue, dropping what no longer fits"""
+        with self._lock:
+            self.counters['flush_errors'] += 1
+            room = self.max_buffered - self._pending()
+            keep_log = log_rows[:max(room, 0)]
+            keep_in_app = in_app_rows[:max(room - len(keep_log), 0)]
+            self.counters['dropped'] += len(log_rows) + len(in_app_rows) - len(keep_log) - len(keep_in_app)
+            self._log_rows = keep_log + self._log_rows
+            self._in_app_rows = keep_in_app + self._in_app_rows
+    
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+    
+    def get_stats(self):
+        with self._lock:
+            return dict(self.counters, pending=self._pending())
+    
+    def close(self):
+        """Stop the background flusher and write whatever is still pending"""
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+
+def _utc_timestamp():
+    # Matches the format and timezone of SQLite's CURRENT_TIMESTAMP default
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
 
 class TaskNotificationSystem:
-    def __init__(self, app, db_file='app.db', brevo_api_key=None):
+    def __init__(self, app, db_file='app.db', brevo_api_key=None, db=None, identity_cache=None,
+                 batch_size=200, flush_interval=2.0):
         self.app = app
         self.db_file = db_file
+        self.db = db or DatabaseManager(db_file)
+        self.identity_cache = identity_cache or IdentityCache(self.db)
+        self.writer = NotificationWriter(self.db, batch_size=batch_size, flush_interval=flush_interval)
         self.brevo_api_key = brevo_api_key
         self.notification_log = []
         self.user_preferences = {}
@@ -27,58 +150,19 @@ class TaskNotificationSystem:
     
     def init_notification_tables(self):
         """Initialize notification-related database tables"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        # Notification preferences table
-        c.execute('''CREATE TABLE IF NOT EXISTS notification_preferences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            email_enabled INTEGER DEFAULT 1,
-            due_today_enabled INTEGER DEFAULT 1,
-            due_tomorrow_enabled INTEGER DEFAULT 1,
-            overdue_enabled INTEGER DEFAULT 1,
-            reminder_hours INTEGER DEFAULT 24,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )''')
-        
-        # Notification log table
-        c.execute('''CREATE TABLE IF NOT EXISTS notification_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            task_id INTEGER NOT NULL,
-            notification_type TEXT NOT NULL,
-            status TEXT DEFAULT 'pending',
-            sent_at TIMESTAMP,
-            error_message TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (task_id) REFERENCES tasks (id)
-        )''')
-        
-        # In-app notifications table
-        c.execute('''CREATE TABLE IF NOT EXISTS in_app_notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            title TEXT NOT NULL,
-            message TEXT NOT NULL,
-            type TEXT DEFAULT 'info',
-            read_status INTEGER DEFAULT 0,
-            task_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (task_id) REFERENCES tasks (id)
-        )''')
-        
-        conn.commit()
+        conn = self.db.connect()
+        run_migrations(conn)
         conn.close()
     
+    def resolve_user_id(self, username):
+        """Get a user's id from the session or the identity cache"""
+        if username == session.get('username') and session.get('user_id') is not None:
+            return session['user_id']
+        return self.identity_cache.get_user_id(username)
+    
     def get_user_preferences(self, user_id):
         """Get notification preferences for a user"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        conn = self.db.connect()
         c = conn.cursor()
         
         c.execute('SELECT * FROM notification_preferences WHERE user_id = ?', (user_id,))
@@ -165,8 +249,7 @@ class TaskNotificationSystem:
         """Enhanced method to check all users' tasks and send notifications"""
         print(f"Checking all users' tasks at {datetime.now()}")
         
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         # Get all users with their incomplete tasks
@@ -202,8 +285,7 @@ class TaskNotificationSystem:
 
     def get_user_due_tasks(self, user_id, notification_type):
         """Get due tasks for a specific user"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         today = date.today()
@@ -291,7 +373,8 @@ class TaskNotificationSystem:
 
     def already_notified_today(self, user_id, task_ids, notification_type):
         """Check if we already sent notifications for these tasks today"""
-        conn = sqlite3.connect(self.db_file)
+        self.writer.flush()
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         today = date.today().strftime('%Y-%m-%d')
@@ -312,7 +395,7 @@ class TaskNotificationSystem:
     
     def update_user_preferences(self, user_id, preferences):
         """Update notification preferences for a user"""
-        conn = sqlite3.connect(self.db_file)
+        conn = self.db.connect()
         c = conn.cursor()
         
         c.execute('''UPDATE notification_preferences 
@@ -331,8 +414,7 @@ class TaskNotificationSystem:
     
     def get_due_tasks(self, notification_type='due_today'):
         """Get tasks that are due based on notification type"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         today = date.today()
@@ -488,32 +570,14 @@ class TaskNotificationSystem:
         return subject, html_content
     
     def create_in_app_notification(self, user_id, title, message, notification_type='info', task_id=None):
-        """Create an in-app notification"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''INSERT INTO in_app_notifications 
-                    (user_id, title, message, type, task_id) 
-                    VALUES (?, ?, ?, ?, ?)''', 
-                  (user_id, title, message, notification_type, task_id))
-        
-        conn.commit()
-        conn.close()
+        """Queue an in-app notification for the next batched write"""
+        self.writer.add_in_app(user_id, title, message, notification_type, task_id)
     
     def log_notification(self, user_id, task_id, notification_type, status='sent', error_message=None):
-        """Log notification attempt"""
-        conn = sqlite3.connect(self.db_file)
-        c = conn.cursor()
-        
-        c.execute('''INSERT INTO notification_log 
-                    (user_id, task_id, notification_type, status, sent_at, error_message) 
-                    VALUES (?, ?, ?, ?, ?, ?)''', 
-                  (user_id, task_id, notification_type, status, 
-                   datetime.now().strftime('%Y-%m-%d %H:%M:%S') if status == 'sent' else None,
-                   error_message))
-        
-        conn.commit()
-        conn.close()
+        """Queue a notification log row for the next batched write"""
+        self.writer.add_log(user_id, task_id, notification_type, status,
+                            datetime.now().strftime('%Y-%m-%d %H:%M:%S') if status == 'sent' else None,
+                            error_message)
     
     def process_notifications(self, notification_type):
         """Process notifications for a specific type"""
@@ -616,8 +680,8 @@ class TaskNotificationSystem:
     
     def get_user_notifications(self, user_id, limit=10, include_read=False):
         """Get in-app notifications for a user"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        self.writer.flush()
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         query = '''SELECT * FROM in_app_notifications 
@@ -638,7 +702,8 @@ class TaskNotificationSystem:
     
     def mark_notification_read(self, notification_id, user_id):
         """Mark a notification as read"""
-        conn = sqlite3.connect(self.db_file)
+        self.writer.flush()
+        conn = self.db.connect()
         c = conn.cursor()
         
         c.execute('''UPDATE in_app_notifications 
@@ -651,8 +716,8 @@ class TaskNotificationSystem:
     
     def get_notification_stats(self, user_id):
         """Get notification statistics for a user"""
-        conn = sqlite3.connect(self.db_file)
-        conn.row_factory = sqlite3.Row
+        self.writer.flush()
+        conn = self.db.connect(readonly=True)
         c = conn.cursor()
         
         # Get unread count
@@ -683,18 +748,10 @@ def add_notification_routes(app, notification_system):
         
         username = request.args.get('username') or session.get('username')
         
-        # Get user ID
-        conn = sqlite3.connect(notification_system.db_file)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user = c.fetchone()
-        conn.close()
-        
-        if not user:
+        user_id = notification_system.resolve_user_id(username)
+        if user_id is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_id = user['id']
         limit = request.args.get('limit', 10, type=int)
         include_read = request.args.get('include_read', 'false').lower() == 'true'
         
@@ -715,18 +772,10 @@ def add_notification_routes(app, notification_system):
         
         username = session['username']
         
-        # Get user ID
-        conn = sqlite3.connect(notification_system.db_file)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user = c.fetchone()
-        conn.close()
-        
-        if not user:
+        user_id = notification_system.resolve_user_id(username)
+        if user_id is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_id = user['id']
         notification_system.mark_notification_read(notification_id, user_id)
         
         return jsonify({'success': True})
@@ -739,19 +788,10 @@ def add_notification_routes(app, notification_system):
         
         username = session['username']
         
-        # Get user ID
-        conn = sqlite3.connect(notification_system.db_file)
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute('SELECT id FROM users WHERE username = ?', (username,))
-        user = c.fetchone()
-        conn.close()
-        
-        if not user:
+        user_id = notification_system.resolve_user_id(username)
+        if user_id is None:
             return jsonify({'error': 'User not found'}), 404
         
-        user_id = user['id']
-        
         if request.method == 'GET':
             preferences = notification_system.get_user_preferences(user_id)
             return jsonify({'success': True, 'preferences': preferences})
@@ -761,6 +801,14 @@ def add_notification_routes(app, notification_system):
             notification_system.update_user_preferences(user_id, preferences)
             return jsonify({'success': True, 'message': 'Preferences updated'})
     
+    @app.route('/api/notification-writer-stats')
+    def notification_writer_stats():
+        """Buffered / flushed / dropped counters of the notification writer"""
+        if session.get('username') != 'admin':
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        return jsonify({'success': True, 'stats': notification_system.writer.get_stats()})
+    
     @app.route('/api/test-notification', methods=['POST'])
     def test_notification():
         """Send a test notification (for development)"""
@@ -0,0 +1,109 @@
+# password_hasher.py - Bounded executor for password hashing
+#
+# Password hashes are deliberately slow. They run on a small dedicated thread
+# pool, so a login storm cannot occupy every request thread. hashlib releases
+# the GIL while it hashes, which lets these threads run in parallel. Once
+# `max_workers + max_queue` hashes are in flight, new work is rejected at once
+# with HashQueueFull instead of waiting in an unbounded queue. A hash still
+# waiting after `timeout` seconds raises HashTimeout, a HashQueueFull.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashQueueFull(Exception):
+    """The hashing executor is saturated; the caller should retry later"""
+
+
+class HashTimeout(HashQueueFull):
+    """A queued hash did not finish within the timeout; handled like a full queue"""
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=2, max_queue=16, timeout=30):
+        self.method = method
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout  # seconds a request waits for its hash
+        # Full parameter prefix of hashes made with `method`, e.g. 'scrypt:32768:8:1'
+        self.method_prefix = generate_password_hash('', method=method).split('$', 1)[0]
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='password-hash')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {'hashes': 0, 'verifies': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0,
+                       'queue_wait_total': 0.0, 'queue_wait_max': 0.0,
+                       'hash_time_total': 0.0, 'hash_time_max': 0.0}
+
+    def _run(self, func, *args):
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._stats['rejected'] += 1
+                raise HashQueueFull()
+            self._in_flight += 1
+
+        submitted = time.perf_counter()
+
+        def task():
+            started = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._in_flight -= 1
+                    wait, took = started - submitted, finished - started
+                    self._stats['queue_wait_total'] += wait
+                    self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], wait)
+                    self._stats['hash_time_total'] += took
+                    self._stats['hash_time_max'] = max(self._stats['hash_time_max'], took)
+
+        try:
+            future = self._executor.submit(task)
+        except RuntimeError:
+            with self._lock:
+                self._in_flight -= 1
+            raise
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._stats['timeouts'] += 1
+                if future.cancel():
+                    # Never started, so task() will not release its slot
+                    self._in_flight -= 1
+            raise HashTimeout()
+        except Exception:
+            with self._lock:
+                self._stats['errors'] += 1
+            raise
+
+    def hash(self, password):
+        """Hash a new password with the configured method"""
+        result = self._run(generate_password_hash, password, self.method)
+        with self._lock:
+            self._stats['hashes'] += 1
+        return result
+
+    def verify(self, pwhash, password):
+        result = self._run(check_password_hash, pwhash, password)
+        with self._lock:
+            self._stats['verifies'] += 1
+        return result
+
+    def needs_rehash(self, pwhash):
+        """True when a stored hash was made with other parameters than the configured ones"""
+        return pwhash.split('$', 1)[0] != self.method_prefix
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        completed = stats['hashes'] + stats['verifies'] + stats['errors']
+        stats['method'] = self.method_prefix
+        stats['in_flight'] = in_flight
+        stats['queued'] = max(in_flight - self.max_workers, 0)
+        stats['queue_wait_avg'] = stats['queue_wait_total'] / completed if completed else 0.0
+        stats['hash_time_avg'] = stats['hash_time_total'] / completed if completed else 0.0
+        return stats
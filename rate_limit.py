@@ -0,0 +1,116 @@
+# rate_limit.py - Token-bucket rate limiting shared across worker processes
+#
+# Bucket state lives in the rate_limit_buckets table (migration 10), so every
+# worker sees the same counts. Each limited endpoint has one bucket per client
+# IP and one per account (username or email). A request is let through only
+# when all of its buckets have a token. Full buckets carry no information, so
+# rows are deleted once they would have refilled.
+import math
+import threading
+import time
+
+RATE_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_rate(rate):
+    """'5/minute' -> (capacity, tokens refilled per second)"""
+    count, unit = rate.split('/')
+    count = int(count)
+    seconds = RATE_UNITS[unit.strip().rstrip('s')]
+    return count, count / seconds
+
+
+class RateLimiter:
+    def __init__(self, db, limits, enabled=True, cleanup_every=500):
+        """limits maps an endpoint name to {'ip': rate, 'account': rate}; either may be omitted"""
+        self.db = db
+        self.limits = {endpoint: {scope: parse_rate(rate) for scope, rate in scopes.items() if rate}
+                       for endpoint, scopes in limits.items()}
+        self.enabled = enabled
+        self.cleanup_every = cleanup_every
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._counters = {endpoint: {'allowed': 0, 'limited': 0, 'limited_by_ip': 0,
+                                     'limited_by_account': 0, 'errors': 0}
+                          for endpoint in self.limits}
+
+    def _count(self, endpoint, *names):
+        with self._lock:
+            for name in names:
+                self._counters[endpoint][name] += 1
+
+    def hit(self, endpoint, ip=None, account=None, cost=1):
+        """Take `cost` tokens from every bucket of the caller.
+
+        Returns (allowed, retry_after_seconds). Nothing is taken when any
+        bucket is short, so a blocked account does not drain the IP bucket.
+        """
+        scopes = self.limits.get(endpoint)
+        if not self.enabled or not scopes:
+            return True, 0
+
+        buckets = []
+        for scope, value in (('ip', ip), ('account', account)):
+            if scope in scopes and value:
+                capacity, refill_rate = scopes[scope]
+                buckets.append((scope, f"{endpoint}:{scope}:{str(value).strip().lower()}", capacity, refill_rate))
+        if not buckets:
+            return True, 0
+
+        now = time.time()
+        conn = self.db.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            states = []
+            for scope, key, capacity, refill_rate in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?',
+                                   (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * refill_rate)
+                states.append((scope, key, capacity, refill_rate, tokens))
+
+            short = [(scope, (cost - tokens) / refill_rate)
+                     for scope, key, capacity, refill_rate, tokens in states if tokens < cost]
+            if short:
+                conn.rollback()
+                self._count(endpoint, 'limited', *{f'limited_by_{scope}' for scope, _ in short})
+                return False, max(1, math.ceil(max(wait for _, wait in short)))
+
+            conn.executemany('''INSERT INTO rate_limit_buckets (key, tokens, updated_at, full_at)
+                                VALUES (?, ?, ?, ?)
+                                ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens,
+                                    updated_at = excluded.updated_at, full_at = excluded.full_at''',
+                             [(key, tokens - cost, now, now + (capacity - tokens + cost) / refill_rate)
+                              for scope, key, capacity, refill_rate, tokens in states])
+            conn.commit()
+        except Exception as e:
+            # Fail open: an unavailable limiter must not lock everyone out
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Error in rate limiter: {e}")
+            self._count(endpoint, 'errors')
+            return True, 0
+        finally:
+            conn.close()
+
+        self._count(endpoint, 'allowed')
+        with self._lock:
+            self._hits += 1
+            run_cleanup = self._hits % self.cleanup_every == 0
+        if run_cleanup:
+            self.cleanup()
+        return True, 0
+
+    def cleanup(self, batch_size=500):
+        """Delete one batch of buckets that have refilled; returns the number removed"""
+        conn = self.db.connect()
+        cur = conn.execute('''DELETE FROM rate_limit_buckets WHERE key IN (
+                                  SELECT key FROM rate_limit_buckets WHERE full_at <= ? LIMIT ?)''',
+                           (time.time(), batch_size))
+        conn.commit()
+        conn.close()
+        return cur.rowcount
+
+    def get_stats(self):
+        with self._lock:
+            counters = {endpoint: dict(values) for endpoint, values in self._counters.items()}
+        return {'enabled': self.enabled, 'endpoints': counters}
@@ -0,0 +1,123 @@
+# registration_store.py - Shared, expiring store for registrations awaiting OTP verification
+#
+# Pending registrations live in the pending_registrations table (migration 9)
+# so /register and /verify-otp work when they land on different workers.
+# Entries expire after `ttl` seconds. Expired rows are swept at most once
+# every `sweep_interval` seconds. The number of pending entries is capped.
+import threading
+import time
+from collections import OrderedDict
+
+
+class PendingRegistrationStore:
+    def __init__(self, db, ttl=600, max_pending=10000, cache_size=1024, sweep_interval=60):
+        self.db = db
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.sweep_interval = sweep_interval
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = 0
+
+    def _cache_put(self, username, record):
+        with self._lock:
+            self._cache[username] = record
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, username):
+        with self._lock:
+            self._cache.pop(username, None)
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.sweep()
+
+    def sweep(self):
+        """Delete expired registrations; returns the number removed"""
+        now = time.time()
+        conn = self.db.connect()
+        cur = conn.execute('DELETE FROM pending_registrations WHERE expires_at <= ?', (now,))
+        conn.commit()
+        conn.close()
+        with self._lock:
+            for username in [u for u, record in self._cache.items() if record['expires_at'] <= now]:
+                del self._cache[username]
+        return cur.rowcount
+
+    def put(self, username, email, password_hash, otp):
+        """Store (or replace) a pending registration; False when the store is full"""
+        self._maybe_sweep()
+        now = time.time()
+        record = {'email': email, 'password': password_hash, 'otp': otp, 'expires_at': now + self.ttl}
+
+        conn = self.db.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            count = conn.execute('''SELECT COUNT(*) FROM pending_registrations
+                                    WHERE expires_at > ? AND username != ?''', (now, username)).fetchone()[0]
+            if count >= self.max_pending:
+                conn.rollback()
+                return False
+            conn.execute('''INSERT INTO pending_registrations (username, email, password, otp, expires_at)
+                            VALUES (?, ?, ?, ?, ?)
+                            ON CONFLICT (username) DO UPDATE SET email = excluded.email,
+                                password = excluded.password, otp = excluded.otp, expires_at = excluded.expires_at''',
+                         (username, email, password_hash, otp, record['expires_at']))
+            conn.commit()
+        finally:
+            conn.close()
+
+        self._cache_put(username, record)
+        return True
+
+    def get(self, username, fresh=False):
+        """Return the pending registration dict, or None if missing or expired.
+
+        fresh=True bypasses the cache; use it when another worker may have
+        changed the entry (e.g. an OTP resent elsewhere).
+        """
+        self._maybe_sweep()
+        now = time.time()
+        if not fresh:
+            with self._lock:
+                record = self._cache.get(username)
+            if record and record['expires_at'] > now:
+                return dict(record)
+
+        conn = self.db.connect(readonly=True)
+        row = conn.execute('''SELECT email, password, otp, expires_at FROM pending_registrations
+                              WHERE username = ? AND expires_at > ?''', (username, now)).fetchone()
+        conn.close()
+        if not row:
+            self._cache_drop(username)
+            return None
+        record = dict(row)
+        self._cache_put(username, record)
+        return dict(record)
+
+    def set_otp(self, username, otp):
+        """Replace the OTP and restart the expiry clock; False if the entry is gone"""
+        expires_at = time.time() + self.ttl
+        conn = self.db.connect()
+        cur = conn.execute('''UPDATE pending_registrations SET otp = ?, expires_at = ?
+                              WHERE username = ? AND expires_at > ?''',
+                           (otp, expires_at, username, time.time()))
+        conn.commit()
+        conn.close()
+        if not cur.rowcount:
+            self._cache_drop(username)
+            return False
+        self.get(username, fresh=True)
+        return True
+
+    def delete(self, username):
+        conn = self.db.connect()
+        conn.execute('DELETE FROM pending_registrations WHERE username = ?', (username,))
+        conn.commit()
+        conn.close()
+        self._cache_drop(username)
@@ -0,0 +1,138 @@
+# retention.py - Retention and compaction for append-only tables
+#
+# notification_log, in_app_notifications and password_reset_tokens only grow.
+# RetentionEngine deletes rows matching per-table policies in small batches,
+# committing between batches so the write lock is never held for long. Each
+# batch is found on a read-only connection first; under the lock only its ids
+# are looked up again.
+# Deleted rows can optionally be archived to gzip-compressed NDJSON files.
+# Each pass ends with an incremental vacuum.
+import gzip
+import json
+import os
+import time
+from datetime import datetime
+
+
+class RetentionPolicy:
+    """Rows of `table` matching the SQL condition `where` are expired"""
+
+    def __init__(self, name, table, where, archive=True):
+        self.name = name
+        self.table = table
+        self.where = where
+        self.archive = archive
+
+
+def default_policies(log_days=90, read_notification_days=30, unread_notification_days=180,
+                     reset_token_grace_days=1):
+    """Standard policies; created_at columns are UTC, expires_at is local time"""
+    return [
+        RetentionPolicy('old_notification_log', 'notification_log',
+                        f"created_at < datetime('now', '-{int(log_days)} days')"),
+        RetentionPolicy('read_notifications', 'in_app_notifications',
+                        f"read_status = 1 AND created_at < datetime('now', '-{int(read_notification_days)} days')"),
+        RetentionPolicy('stale_notifications', 'in_app_notifications',
+                        f"created_at < datetime('now', '-{int(unread_notification_days)} days')"),
+        RetentionPolicy('spent_reset_tokens', 'password_reset_tokens',
+                        f"used = 1 OR expires_at < datetime('now', 'localtime', '-{int(reset_token_grace_days)} days')",
+                        archive=False),
+    ]
+
+
+class RetentionEngine:
+    def __init__(self, db, policies=None, batch_size=500, pause=0.05, archive_dir=None):
+        self.db = db
+        self.policies = policies if policies is not None else default_policies()
+        self.batch_size = batch_size
+        self.pause = pause  # seconds between batches, lets waiting writers in
+        self.archive_dir = archive_dir
+
+    def _archive(self, table, rows):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{table}-{datetime.now().strftime('%Y%m%d')}.ndjson.gz")
+        # Appending creates a new gzip member; gzip readers concatenate them transparently
+        with gzip.open(path, 'at', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(dict(row), default=str) + '\n')
+
+    def apply_policy(self, policy, dry_run=False):
+        """Delete (or, with dry_run, count) the rows a policy expires"""
+        conn = self.db.connect()
+        try:
+            if dry_run:
+                return conn.execute(f'SELECT COUNT(*) FROM {policy.table} WHERE ({policy.where})').fetchone()[0]
+
+            deleted = 0
+            while True:
+                # Find the batch on a read-only connection, so the search never holds the write lock.
+                # No ORDER BY: the planner can then answer from the policy's index (migration 20).
+                reader = self.db.connect(readonly=True)
+                try:
+                    ids = [row[0] for row in reader.execute(
+                        f'SELECT id FROM {policy.table} WHERE ({policy.where}) LIMIT ?', (self.batch_size,))]
+                finally:
+                    reader.close()
+                if not ids:
+                    break
+                conn.execute('BEGIN IMMEDIATE')
+                # Primary-key lookups; rows changed since they were found are left alone
+                rows = conn.execute(f'''SELECT * FROM {policy.table}
+                                        WHERE id IN ({','.join('?' * len(ids))}) AND ({policy.where})''',
+                                    ids).fetchall()
+                if policy.archive and self.archive_dir and rows:
+                    self._archive(policy.table, rows)
+                conn.executemany(f'DELETE FROM {policy.table} WHERE id = ?', [(row['id'],) for row in rows])
+                conn.commit()
+                deleted += len(rows)
+                if len(ids) < self.batch_size or not rows:
+                    break
+                time.sleep(self.pause)
+            return deleted
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def vacuum(self):
+        """Return free pages to the filesystem; returns bytes reclaimed"""
+        conn = self.db.connect()
+        try:
+            page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+            before = conn.execute('PRAGMA page_count').fetchone()[0]
+            # A no-op unless the database uses auto_vacuum = INCREMENTAL (see enable_incremental_vacuum)
+            conn.execute('PRAGMA incremental_vacuum').fetchall()
+            after = conn.execute('PRAGMA page_count').fetchone()[0]
+            return (before - after) * page_size
+        finally:
+            conn.close()
+
+    def enable_incremental_vacuum(self):
+        """One-off conversion of an existing database; rewrites the whole file"""
+        conn = self.db.connect()
+        try:
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+        finally:
+            conn.close()
+
+    def run(self, dry_run=False):
+        """Run every policy and vacuum; returns a report dict"""
+        started = time.time()
+        report = {'dry_run': dry_run, 'policies': {}, 'rows': 0, 'bytes_reclaimed': 0}
+        for policy in self.policies:
+            try:
+                count = self.apply_policy(policy, dry_run=dry_run)
+            except Exception as e:
+                print(f"Retention policy {policy.name} failed: {e}")
+                report['policies'][policy.name] = {'table': policy.table, 'error': str(e)}
+                continue
+            report['policies'][policy.name] = {'table': policy.table, 'rows': count}
+            report['rows'] += count
+        if not dry_run:
+            report['bytes_reclaimed'] = self.vacuum()
+        report['duration_seconds'] = round(time.time() - started, 3)
+        print(f"Retention pass: {report['rows']} rows, {report['bytes_reclaimed']} bytes reclaimed")
+        return report
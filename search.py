@@ -0,0 +1,48 @@
+# search.py - Full-text search over task titles and media descriptions
+#
+# tasks_fts and media_fts are external-content FTS5 tables over tasks and
+# media (migration 7). Triggers keep them in sync with every write.
+# Results are scoped to one user by joining back to the source table.
+import re
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix.
+
+    Returns None when the text has no searchable words.
+    """
+    tokens = TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    # Quote each token so FTS5 operators typed by the user are matched literally
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_tasks(conn, user_id, match, limit=20, offset=0):
+    """Ranked task matches for a user; fetches one extra row to detect more pages"""
+    return conn.execute('''SELECT t.*, bm25(tasks_fts) AS score
+                           FROM tasks_fts
+                           JOIN tasks t ON t.id = tasks_fts.rowid
+                           WHERE tasks_fts MATCH ? AND t.user_id = ?
+                           ORDER BY score
+                           LIMIT ? OFFSET ?''',
+                        (match, user_id, limit + 1, offset)).fetchall()
+
+
+def search_media(conn, user_id, match, limit=20, offset=0):
+    """Ranked media matches for a user; fetches one extra row to detect more pages"""
+    return conn.execute('''SELECT m.*, bm25(media_fts) AS score
+                           FROM media_fts
+                           JOIN media m ON m.id = media_fts.rowid
+                           WHERE media_fts MATCH ? AND m.user_id = ?
+                           ORDER BY score
+                           LIMIT ? OFFSET ?''',
+                        (match, user_id, limit + 1, offset)).fetchall()
+
+
+def rebuild_search_index(conn):
+    """Repopulate both FTS tables from their content tables (caller commits)"""
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO media_fts (media_fts) VALUES ('rebuild')")
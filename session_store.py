@@ -0,0 +1,166 @@
+# session_store.py - Server-side sessions stored in SQLite
+#
+# The browser only holds a random session id. Session data lives in the
+# sessions table (migration 8), so every worker process sees the same data.
+# Expired rows are removed lazily every few hundred saves. An optional
+# in-process cache (cache_ttl > 0) can sit in front of the table. Only a
+# single-process deployment should enable it: a logout or change handled by
+# one process does not reach the caches of the others.
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, stored_expiry=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.stored_expiry = stored_expiry
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the session to a fresh id (call on login to prevent fixation)"""
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+
+class SQLiteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, db, cache_ttl=0, cache_size=10000, cleanup_every=200,
+                 default_lifetime=timedelta(days=1), touch_interval=3600):
+        self.db = db
+        self.cache_ttl = cache_ttl  # seconds a cached session is trusted without the DB; 0 disables the cache
+        self.cache_size = cache_size
+        self.cleanup_every = cleanup_every
+        self.default_lifetime = default_lifetime  # server-side expiry of non-permanent sessions
+        self.touch_interval = touch_interval  # only rewrite expires_at when it moves this far
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._saves = 0
+
+    # --- cache ---
+    def _cache_get(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(sid)
+            if entry is None:
+                return None
+            data, expires_at, cached_at = entry
+            if now - cached_at > self.cache_ttl or expires_at <= now:
+                del self._cache[sid]
+                return None
+            self._cache.move_to_end(sid)
+            return data, expires_at
+
+    def _cache_put(self, sid, data, expires_at):
+        if self.cache_ttl <= 0:
+            return
+        with self._lock:
+            self._cache[sid] = (data, expires_at, time.time())
+            self._cache.move_to_end(sid)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_drop(self, sid):
+        with self._lock:
+            self._cache.pop(sid, None)
+
+    # --- storage ---
+    def _load(self, sid):
+        cached = self._cache_get(sid)
+        if cached is not None:
+            return cached
+        conn = self.db.connect(readonly=True)
+        row = conn.execute('SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?',
+                           (sid, time.time())).fetchone()
+        conn.close()
+        if not row:
+            return None
+        self._cache_put(sid, row['data'], row['expires_at'])
+        return row['data'], row['expires_at']
+
+    def _delete(self, conn, sid):
+        conn.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+        self._cache_drop(sid)
+
+    def cleanup_expired(self, batch_size=500):
+        """Delete one batch of expired sessions; returns the number removed"""
+        conn = self.db.connect()
+        cur = conn.execute('''DELETE FROM sessions WHERE id IN (
+                                  SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?)''',
+                           (time.time(), batch_size))
+        conn.commit()
+        conn.close()
+        return cur.rowcount
+
+    # --- SessionInterface ---
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self._load(sid)
+            if stored is not None:
+                data, expires_at = stored
+                return ServerSideSession(self.serializer.loads(data), sid=sid, stored_expiry=expires_at)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified:
+                # Emptied (e.g. logout): forget it on both sides
+                conn = self.db.connect()
+                self._delete(conn, session.sid)
+                if session.previous_sid:
+                    self._delete(conn, session.previous_sid)
+                conn.commit()
+                conn.close()
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        cookie_expiry = self.get_expiration_time(app, session)
+        expires_at = cookie_expiry.timestamp() if cookie_expiry else time.time() + self.default_lifetime.total_seconds()
+
+        needs_touch = session.stored_expiry is None or expires_at - session.stored_expiry > self.touch_interval
+        if session.modified or needs_touch:
+            data = self.serializer.dumps(dict(session))
+            conn = self.db.connect()
+            if session.previous_sid:
+                self._delete(conn, session.previous_sid)
+            conn.execute('''INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                            ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at''',
+                         (session.sid, data, expires_at))
+            conn.commit()
+            conn.close()
+            self._cache_put(session.sid, data, expires_at)
+
+            self._saves += 1
+            if self._saves % self.cleanup_every == 0:
+                self.cleanup_expired()
+
+        if session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=cookie_expiry,
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Test script for resumable chunked uploads: create, PUT, offset, finalize and their error cases
+"""
+
+import hashlib
+import os
+
+from conftest import load_app, logged_in_client
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_chunked_upload():
+    print("Testing Chunked Uploads")
+    print("=" * 40)
+
+    appmod = load_app()
+    client, user_id = logged_in_client('upload_user')
+    data = os.urandom(3000)
+    first, rest = data[:1000], data[1000:]
+
+    def create(**body):
+        return client.post('/api/uploads', json=dict({'filename': 'clip.mp4', 'size': len(data)}, **body))
+
+    def put(upload_id, offset, chunk, checksum=None):
+        headers = {'Upload-Offset': str(offset)}
+        if checksum:
+            headers['Upload-Checksum'] = checksum
+        return client.put(f'/api/uploads/{upload_id}', data=chunk, headers=headers)
+
+    def offset(upload_id):
+        response = client.get(f'/api/uploads/{upload_id}')
+        assert response.status_code == 200, response.data
+        assert response.headers['Upload-Offset'] == str(response.get_json()['upload']['offset'])
+        return response.get_json()['upload']['offset']
+
+    # Test 1: The whole-file digest is required up front
+    print("\n1. Creating upload sessions...")
+    assert create().status_code == 400
+    assert create(sha256='zz').status_code == 400
+    assert create(sha256=sha256(data), size=0).status_code == 400
+    response = create(sha256=sha256(data).upper())
+    assert response.status_code == 201, response.data
+    upload = response.get_json()['upload']
+    assert upload['offset'] == 0 and upload['size'] == len(data)
+    upload_id = upload['id']
+    print(f"✓ Missing and malformed digests rejected, session {upload_id[:8]}... created")
+
+    # Test 2: Chunks land at the offset the server expects
+    print("\n2. Uploading and resuming...")
+    response = put(upload_id, 0, first, f'sha256 {sha256(first)}')
+    assert response.status_code == 200, response.data
+    assert response.headers['Upload-Offset'] == '1000'
+    assert offset(upload_id) == 1000
+    print("✓ First chunk accepted, GET reports offset 1000")
+
+    # Test 3: A stale offset gets 409 with the offset to resume from
+    print("\n3. Offset mismatch...")
+    response = put(upload_id, 0, first)
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '1000' and response.get_json()['offset'] == 1000
+    assert put(upload_id, 2000, rest[1000:]).status_code == 409
+    print("✓ Stale and skipped-ahead chunks got 409 with Upload-Offset 1000")
+
+    # Test 4: Chunk checksums
+    print("\n4. Chunk checksums...")
+    assert put(upload_id, 1000, rest, 'md5 abc').status_code == 400
+    assert put(upload_id, 1000, rest, sha256(rest)).status_code == 400
+    response = put(upload_id, 1000, rest, f'sha256 {sha256(first)}')
+    assert response.status_code == 422 and response.get_json()['offset'] == 1000
+    assert offset(upload_id) == 1000
+    assert put(upload_id, 1000, rest + b'x').status_code == 413
+    assert offset(upload_id) == 1000
+    assert not [name for name in os.listdir(appmod.chunked_uploads.partial_folder) if name.endswith('.chunk')]
+    print("✓ Malformed header 400, mismatched chunk 422, oversized chunk 413; offset unchanged, no chunk files left")
+
+    # Test 5: Finalizing turns the complete upload into a media row
+    print("\n5. Finalizing...")
+    assert client.post(f'/api/uploads/{upload_id}/finalize').status_code == 409
+    assert put(upload_id, 1000, rest, f'sha256 {sha256(rest)}').status_code == 200
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert response.status_code == 200, response.data
+    media = response.get_json()['media']
+    assert media['original_filename'] == 'clip.mp4'
+    conn = appmod.get_db()
+    filename = conn.execute('SELECT filename FROM media WHERE id = ? AND user_id = ?',
+                            (media['id'], user_id)).fetchone()[0]
+    conn.close()
+    assert os.path.basename(filename) == f'{sha256(data)}.mp4'
+    with open(os.path.join(appmod.UPLOAD_FOLDER, filename), 'rb') as f:
+        assert f.read() == data
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert not os.path.exists(appmod.chunked_uploads.part_path(upload_id))
+    print(f"✓ Stored as {filename}, session and partial file removed")
+
+    # Test 6: A whole-file digest mismatch restarts the upload
+    print("\n6. Whole-file checksum mismatch...")
+    upload_id = create(sha256=sha256(b'other bytes')).get_json()['upload']['id']
+    assert put(upload_id, 0, data).status_code == 200
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert response.status_code == 422 and response.get_json()['offset'] == 0
+    assert offset(upload_id) == 0
+    assert os.path.getsize(appmod.chunked_uploads.part_path(upload_id)) == 0
+    assert client.delete(f'/api/uploads/{upload_id}').status_code == 200
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    print("✓ Mismatch got 422 and reset the offset to 0; aborted session is gone")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_chunked_upload()
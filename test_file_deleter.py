@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script for the background media file deletion worker
+"""
+
+import os
+
+from conftest import insert_media, temp_database, write_file
+from file_deleter import FileDeletionWorker
+from thumbnails import derived_files, variant_name
+
+
+def test_file_deleter():
+    print("Testing File Deletion Worker")
+    print("=" * 40)
+
+    with temp_database() as (tmp, db, conn):
+        uploads = os.path.join(tmp, 'uploads')
+        worker = FileDeletionWorker(
+            db, lambda filename: [os.path.join(uploads, filename)] + derived_files(uploads, filename),
+            retry_delay=0)
+        shared = 'ab/cd/' + 'ab' * 32 + '.jpg'
+        shared_path = write_file(uploads, shared)
+        variant_path = write_file(uploads, variant_name(shared, 320))
+        first, second = insert_media(conn, shared), insert_media(conn, shared)
+        conn.commit()
+
+        # Test 1: A blob shared by two rows survives deleting one of them
+        print("\n1. Deleting one of two rows sharing a blob...")
+        conn.execute('DELETE FROM media WHERE id = ?', (first,))
+        worker.enqueue(conn, [shared])
+        conn.commit()
+        assert conn.execute('SELECT COUNT(*) FROM file_deletions').fetchone()[0] == 0
+        assert worker.run_once(conn) == 0
+        assert os.path.exists(shared_path)
+        assert conn.execute('SELECT ref_count FROM media_blobs WHERE filename = ?', (shared,)).fetchone()[0] == 1
+        print("✓ Shared blob was not queued and is still on disk")
+
+        # Test 2: Deleting the last row removes the blob and its variants
+        print("\n2. Deleting the last row...")
+        conn.execute('DELETE FROM media WHERE id = ?', (second,))
+        worker.enqueue(conn, [shared])
+        conn.commit()
+        assert worker.run_once(conn) == 1
+        assert not os.path.exists(shared_path) and not os.path.exists(variant_path)
+        assert conn.execute('SELECT COUNT(*) FROM media_blobs').fetchone()[0] == 0
+        assert conn.execute('SELECT COUNT(*) FROM file_deletions').fetchone()[0] == 0
+        print(f"✓ Blob and variant removed, stats {worker.get_stats()}")
+
+        # Test 3: A blob uploaded again after its delete was queued is kept
+        print("\n3. Re-uploading a queued blob...")
+        blob = 'cd/ef/' + 'cd' * 32 + '.jpg'
+        blob_path = write_file(uploads, blob)
+        media_id = insert_media(conn, blob)
+        conn.commit()
+        conn.execute('DELETE FROM media WHERE id = ?', (media_id,))
+        worker.enqueue(conn, [blob])
+        conn.commit()
+        insert_media(conn, blob)
+        conn.commit()
+        assert worker.run_once(conn) == 1
+        assert os.path.exists(blob_path)
+        assert conn.execute('SELECT COUNT(*) FROM file_deletions').fetchone()[0] == 0
+        assert worker.get_stats()['kept'] == 1
+        print("✓ Re-uploaded blob was kept and its queue entry dropped")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_file_deleter()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Test script for content-addressed media storage: dedupe and sharding of legacy files
+"""
+
+import hashlib
+import io
+import os
+
+from conftest import insert_media, temp_database, write_file
+from media_store import BlobStore, shard_path
+from thumbnails import derived_files, variant_name
+
+
+def test_media_store():
+    print("Testing Media Store")
+    print("=" * 40)
+
+    with temp_database() as (tmp, db, conn):
+        uploads = os.path.join(tmp, 'uploads')
+
+        def delete_files(filenames):
+            for filename in filenames:
+                for path in [os.path.join(uploads, filename)] + derived_files(uploads, filename):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+        store = BlobStore(uploads, delete_files)
+        enqueued = []
+
+        # Test 1: Identical legacy files collapse onto one content-addressed blob
+        print("\n1. Deduplicating legacy files...")
+        data = b'same bytes'
+        target = shard_path(f"{hashlib.sha256(data).hexdigest()}.jpg")
+        first = write_file(uploads, 'a' * 32 + '.jpg', data)
+        second = write_file(uploads, 'b' * 32 + '.jpg', data)
+        old_variant = write_file(uploads, variant_name('b' * 32 + '.jpg', 320), b'variant')
+        ids = [insert_media(conn, 'a' * 32 + '.jpg', 'ready'), insert_media(conn, 'b' * 32 + '.jpg', 'ready')]
+        conn.commit()
+        report = store.dedupe_legacy(conn, lambda conn, media_id: enqueued.append(media_id), dry_run=True)
+        assert report['duplicates'] == 1 and os.path.exists(first) and os.path.exists(second)
+        report = store.dedupe_legacy(conn, lambda conn, media_id: enqueued.append(media_id))
+        assert report['moved'] == 1 and report['duplicates'] == 1 and report['bytes_saved'] == len(data)
+        assert not os.path.exists(first) and not os.path.exists(second) and not os.path.exists(old_variant)
+        assert os.path.exists(os.path.join(uploads, target))
+        assert [r[0] for r in conn.execute('SELECT DISTINCT filename FROM media')] == [target]
+        assert conn.execute('SELECT ref_count FROM media_blobs WHERE filename = ?', (target,)).fetchone()[0] == 2
+        assert conn.execute('SELECT COUNT(*) FROM media_blobs').fetchone()[0] == 1
+        assert sorted(enqueued) == ids
+        print(f"✓ {report['files']} files became one blob, {report['bytes_saved']} bytes saved")
+
+        # Test 2: A received upload of the same bytes reuses the blob
+        print("\n2. Receiving a duplicate upload...")
+        temp_path, filename, size = store.receive(io.BytesIO(data), 'jpg')
+        assert filename == target and size == len(data)
+        assert store.place(temp_path, filename) is False and not os.path.exists(temp_path)
+        print("✓ Duplicate upload was discarded in favour of the stored blob")
+
+        # Test 3: Flat content-addressed files move into the sharded layout with their variants
+        print("\n3. Sharding flat files...")
+        flat = hashlib.sha256(b'flat').hexdigest() + '.jpg'
+        write_file(uploads, flat, b'flat')
+        write_file(uploads, variant_name(flat, 320), b'variant')
+        media_id = insert_media(conn, flat, 'ready')
+        conn.execute('''INSERT INTO media_variants (media_id, width, height, filename, file_size)
+                        VALUES (?, 320, 240, ?, 7)''', (media_id, variant_name(flat, 320)))
+        conn.commit()
+        report = store.shard_legacy(conn, pause=0)
+        sharded = shard_path(flat)
+        assert report['files'] == 1 and report['missing'] == 0
+        assert not os.path.exists(os.path.join(uploads, flat))
+        assert os.path.exists(os.path.join(uploads, sharded))
+        assert os.path.exists(os.path.join(uploads, variant_name(sharded, 320)))
+        assert conn.execute('SELECT filename FROM media WHERE id = ?', (media_id,)).fetchone()[0] == sharded
+        assert conn.execute('SELECT filename FROM media_variants WHERE media_id = ?',
+                            (media_id,)).fetchone()[0] == variant_name(sharded, 320)
+        assert store.shard_legacy(conn, pause=0)['files'] == 0
+        print(f"✓ Moved {report['files']} file into {os.path.dirname(sharded)}/, re-run is a no-op")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_media_store()
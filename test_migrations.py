@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Test script for schema migrations and hot-path indexes
+"""
+
+import os
+import sqlite3
+import tempfile
+
+from migrations import MIGRATIONS, check_query_plans, get_schema_version, run_migrations
+
+
+def test_migrations():
+    print("Testing Schema Migrations")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'app.db'))
+
+        # Test 1: Fresh database gets every migration
+        print("\n1. Migrating a fresh database...")
+        applied = run_migrations(conn)
+        assert applied == [version for version, _, _ in MIGRATIONS]
+        assert get_schema_version(conn) == MIGRATIONS[-1][0]
+        print(f"✓ Applied versions {applied}")
+
+        # Test 2: Second run is a no-op
+        print("\n2. Re-running migrations...")
+        assert run_migrations(conn) == []
+        print("✓ Nothing applied twice")
+
+        # Test 3: Hot-path queries are answered from their indexes
+        print("\n3. Checking query plans...")
+        for name, (uses_index, plan) in check_query_plans(conn).items():
+            assert uses_index, f"{name} does not use its index: {plan}"
+            print(f"✓ {name}: {plan[0]}")
+
+        conn.close()
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_migrations()
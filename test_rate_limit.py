@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Test script for the shared token-bucket rate limiter
+"""
+
+import os
+import tempfile
+
+from db_manager import DatabaseManager
+from migrations import run_migrations
+from rate_limit import RateLimiter, parse_rate
+
+
+def test_rate_limit():
+    print("Testing Rate Limiter")
+    print("=" * 40)
+
+    assert parse_rate('5/minute') == (5, 5 / 60)
+    assert parse_rate('3/hours') == (3, 3 / 3600)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'app.db'))
+        conn = db.connect()
+        run_migrations(conn)
+        conn.close()
+
+        limiter = RateLimiter(db, {'login': {'ip': '5/minute', 'account': '3/minute'}})
+
+        # Test 1: The account bucket runs out first
+        print("\n1. Account limit...")
+        results = [limiter.hit('login', ip='10.0.0.1', account='Bob')[0] for _ in range(4)]
+        assert results == [True, True, True, False], results
+        allowed, retry_after = limiter.hit('login', ip='10.0.0.1', account='bob')
+        assert not allowed and 1 <= retry_after <= 20, retry_after
+        print(f"✅ Blocked after 3 attempts, retry after {retry_after}s")
+
+        # Test 2: Blocked attempts did not drain the IP bucket
+        print("\n2. IP limit...")
+        results = [limiter.hit('login', ip='10.0.0.1', account=f'user{i}')[0] for i in range(3)]
+        assert results == [True, True, False], results
+        print("✅ IP bucket shared across accounts")
+
+        # Test 3: A second limiter on the same database sees the same buckets
+        print("\n3. Shared state...")
+        other = RateLimiter(db, {'login': {'ip': '5/minute', 'account': '3/minute'}})
+        assert not other.hit('login', ip='10.0.0.1')[0]
+        assert other.hit('login', ip='10.0.0.2')[0]
+        print("✅ State shared through SQLite")
+
+        stats = limiter.get_stats()['endpoints']['login']
+        assert stats['allowed'] == 5 and stats['limited_by_account'] == 2 and stats['limited_by_ip'] == 1, stats
+        assert limiter.hit('unlimited-endpoint', ip='10.0.0.1') == (True, 0)
+        db.close_thread_connections()
+
+    print("\n" + "=" * 40)
+    print("Rate limiter test completed!")
+
+
+if __name__ == "__main__":
+    test_rate_limit()
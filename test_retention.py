@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Test script for the notification / reset-token retention engine
+"""
+
+import gzip
+import os
+import sqlite3
+import tempfile
+
+from db_manager import DatabaseManager
+from migrations import run_migrations
+from retention import RetentionEngine, default_policies
+
+
+def test_retention():
+    print("Testing Retention Engine")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, 'app.db'))
+        conn = db.connect()
+        run_migrations(conn)
+        conn.executemany('''INSERT INTO notification_log (user_id, task_id, notification_type, created_at)
+                            VALUES (1, 1, 'overdue', datetime('now', ?))''',
+                         [('-200 days',)] * 1200 + [('-1 days',)] * 10)
+        conn.executemany('''INSERT INTO in_app_notifications (user_id, title, message, read_status, created_at)
+                            VALUES (1, 't', 'm', ?, datetime('now', ?))''',
+                         [(1, '-60 days'), (0, '-60 days'), (1, '-1 days'), (0, '-365 days')])
+        conn.executemany('''INSERT INTO password_reset_tokens (user_id, token, expires_at, used)
+                            VALUES (1, ?, datetime('now', 'localtime', ?), ?)''',
+                         [('a', '+1 hours', 1), ('b', '-3 days', 0), ('c', '+1 hours', 0)])
+        conn.commit()
+
+        engine = RetentionEngine(db, default_policies(), batch_size=500, pause=0,
+                                 archive_dir=os.path.join(tmp, 'archive'))
+
+        # Test 1: Dry run only counts
+        print("\n1. Dry run...")
+        report = engine.run(dry_run=True)
+        assert report['rows'] == 1200 + 2 + 2
+        assert conn.execute('SELECT COUNT(*) FROM notification_log').fetchone()[0] == 1210
+        print(f"✓ Dry run found {report['rows']} expired rows and deleted nothing")
+
+        # Test 2: Real pass deletes in batches and archives
+        print("\n2. Retention pass...")
+        report = engine.run()
+        assert report['policies']['old_notification_log']['rows'] == 1200
+        assert conn.execute('SELECT COUNT(*) FROM notification_log').fetchone()[0] == 10
+        assert conn.execute('SELECT COUNT(*) FROM in_app_notifications').fetchone()[0] == 2
+        assert [r[0] for r in conn.execute('SELECT token FROM password_reset_tokens')] == ['c']
+        archives = os.listdir(os.path.join(tmp, 'archive'))
+        with gzip.open(os.path.join(tmp, 'archive', [a for a in archives if a.startswith('notification_log')][0]), 'rt') as f:
+            assert sum(1 for _ in f) == 1200
+        print(f"✓ Deleted {report['rows']} rows, reclaimed {report['bytes_reclaimed']} bytes")
+
+        conn.close()
+        db.close_thread_connections()
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_retention()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Test script for keyset-paginated task listing: cursor round-trips, sorts and filters
+"""
+
+import base64
+import json
+
+from conftest import load_app, logged_in_client
+
+# title, due_date, priority, completed, created_at; several rows share a sort value
+TASKS = [
+    ('a', '2024-03-01', 'high', 0, '2024-01-01 10:00:00'),
+    ('b', None, 'low', 0, '2024-01-01 10:00:00'),
+    ('c', '2024-02-01', 'medium', 1, '2024-01-01 10:00:00'),
+    ('d', '2024-02-01', 'high', 0, '2024-01-02 09:00:00'),
+    ('e', '2024-05-01', 'low', 1, '2024-01-03 09:00:00'),
+    ('f', None, 'high', 0, '2024-01-03 09:00:00'),
+    ('g', '2024-04-01', 'medium', 0, '2024-01-04 09:00:00'),
+]
+PRIORITY_RANK = {'high': 1, 'medium': 2, 'low': 3}
+
+
+def make_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+def test_task_pagination():
+    print("Testing Task Pagination")
+    print("=" * 40)
+
+    appmod = load_app()
+    client, user_id = logged_in_client('page_user')
+    conn = appmod.get_db()
+    tasks = {}
+    for title, due_date, priority, completed, created_at in TASKS:
+        cur = conn.execute('''INSERT INTO tasks (user_id, title, due_date, priority, completed, created_at)
+                              VALUES (?, ?, ?, ?, ?, ?)''',
+                           (user_id, title, due_date, priority, completed, created_at))
+        tasks[cur.lastrowid] = dict(zip(('title', 'due_date', 'priority', 'completed', 'created_at'),
+                                        (title, due_date, priority, completed, created_at)))
+    conn.commit()
+    conn.close()
+
+    def walk(**args):
+        """Titles of every page, following next_cursor until it runs out"""
+        titles, cursor, pages = [], None, 0
+        while True:
+            query = dict(args, limit=2, **({'cursor': cursor} if cursor else {}))
+            response = client.get('/api/tasks', query_string=query)
+            assert response.status_code == 200, response.data
+            body = response.get_json()
+            titles.extend(task['title'] for task in body['tasks'])
+            pages += 1
+            cursor = body['next_cursor']
+            if cursor is None:
+                return titles, pages
+
+    def expected(key, reverse=False, keep=lambda task: True):
+        ids = sorted((task_id for task_id, task in tasks.items() if keep(task)),
+                     key=lambda task_id: (key(tasks[task_id]), task_id), reverse=reverse)
+        return [tasks[task_id]['title'] for task_id in ids]
+
+    # Test 1: Default sort walks every task once, ties broken by id
+    print("\n1. Default created_at pages...")
+    titles, pages = walk()
+    assert titles == expected(lambda task: task['created_at'], reverse=True), titles
+    assert pages == 4 and len(set(titles)) == len(TASKS)
+    print(f"✓ {len(titles)} tasks over {pages} pages: {''.join(titles)}")
+
+    # Test 2: The other sorts and both orders round-trip their cursors
+    print("\n2. Due date and priority sorts...")
+    by_due = lambda task: task['due_date'] or '9999-12-31'
+    by_priority = lambda task: PRIORITY_RANK[task['priority']]
+    assert walk(sort='due_date')[0] == expected(by_due)
+    assert walk(sort='due_date', order='desc')[0] == expected(by_due, reverse=True)
+    assert walk(sort='priority')[0] == expected(by_priority)
+    assert walk(sort='created_at', order='asc')[0] == expected(lambda task: task['created_at'])
+    print(f"✓ due_date: {''.join(expected(by_due))}, priority: {''.join(expected(by_priority))}")
+
+    # Test 3: Filters apply on every page
+    print("\n3. Filters...")
+    titles = walk(sort='priority', completed='false', priority='high,low')[0]
+    assert titles == expected(by_priority, keep=lambda task: not task['completed']
+                              and task['priority'] in ('high', 'low')), titles
+    titles = walk(sort='due_date', due_from='2024-02-01', due_to='2024-04-01')[0]
+    assert titles == expected(by_due, keep=lambda task: task['due_date']
+                              and '2024-02-01' <= task['due_date'] <= '2024-04-01'), titles
+    print(f"✓ Filtered pages: {''.join(titles)}")
+
+    # Test 4: Malformed arguments are rejected
+    print("\n4. Malformed cursors and arguments...")
+    bad = [{'cursor': 'not-a-cursor'}, {'cursor': make_cursor([{'x': 1}, 1])}, {'cursor': make_cursor([[1], 1])},
+           {'cursor': make_cursor([True, 1])}, {'cursor': make_cursor(['2024-01-01', 'x'])},
+           {'sort': 'title'}, {'order': 'sideways'}, {'due_from': '01/02/2024'}]
+    for args in bad:
+        response = client.get('/api/tasks', query_string=args)
+        assert response.status_code == 400, (args, response.status_code)
+        assert response.get_json()['success'] is False
+    print(f"✓ {len(bad)} malformed requests got 400")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_task_pagination()
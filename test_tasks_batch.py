@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test script for the task batch endpoint: per-item results, ordering and side effects
+"""
+
+from conftest import load_app, logged_in_client
+
+
+def test_tasks_batch():
+    print("Testing Task Batch API")
+    print("=" * 40)
+
+    appmod = load_app()
+    client, user_id = logged_in_client('batch_user')
+
+    def batch(operations):
+        response = client.post('/api/tasks/batch', json={'operations': operations})
+        assert response.status_code == 200, response.data
+        return response.get_json()
+
+    # Test 1: One result per operation, in request order; invalid ones are skipped
+    print("\n1. Mixed valid and invalid operations...")
+    body = batch([{'op': 'create', 'title': 'first'},
+                  {'op': 'create', 'title': 5},
+                  {'op': 'update', 'id': 999999, 'title': 'nope'},
+                  {'op': 'create', 'title': 'second'},
+                  {'op': 'archive', 'id': 1}])
+    results = body['results']
+    assert body['success'] is False
+    assert [result['success'] for result in results] == [True, False, False, True, False]
+    assert results[1]['error'] == 'title must be a string'
+    assert results[2]['error'] == 'Task not found'
+    assert results[4]['error'] == 'Unknown op: archive'
+    assert results[0]['id'] < results[3]['id']
+    assert (results[0]['task']['title'], results[3]['task']['title']) == ('first', 'second')
+    print(f"✓ {len(results)} results in request order, created ids {results[0]['id']} and {results[3]['id']}")
+
+    # Test 2: Updates of the same task are merged, the last value of each field wins
+    print("\n2. Repeated updates of one task...")
+    task_id = results[0]['id']
+    body = batch([{'op': 'update', 'id': task_id, 'title': 'b'},
+                  {'op': 'update', 'id': task_id, 'title': 'a', 'completed': True},
+                  {'op': 'update', 'id': task_id, 'title': 'c'}])
+    assert body['success'] is True
+    assert [result['id'] for result in body['results']] == [task_id] * 3
+    task = body['results'][2]['task']
+    assert task['title'] == 'c' and task['completed']
+    print(f"✓ Final task: {task['title']!r}, completed={task['completed']}")
+
+    # Test 3: An update superseded by a later delete, and operations after the delete
+    print("\n3. Update, delete and update of the same task...")
+    doomed = batch([{'op': 'create', 'title': 'doomed'}])['results'][0]['id']
+    body = batch([{'op': 'update', 'id': doomed, 'completed': True},
+                  {'op': 'delete', 'id': doomed},
+                  {'op': 'update', 'id': doomed, 'title': 'late'},
+                  {'op': 'delete', 'id': doomed}])
+    results = body['results']
+    assert results[0] == {'success': True, 'id': doomed, 'superseded': True}
+    assert results[1] == {'success': True, 'id': doomed}
+    assert results[2] == results[3] == {'success': False, 'error': 'Task not found'}
+    conn = appmod.get_db()
+    assert conn.execute('SELECT COUNT(*) FROM tasks WHERE id = ?', (doomed,)).fetchone()[0] == 0
+    conn.close()
+    print("✓ Superseded update reported, later operations failed with Task not found")
+
+    # Test 4: Notifications are coalesced and only announce what was committed
+    print("\n4. Notifications...")
+    appmod.notification_system.writer.flush()
+    conn = appmod.get_db()
+    messages = [row[0] for row in conn.execute('SELECT message FROM in_app_notifications WHERE user_id = ? '
+                                               'ORDER BY id', (user_id,))]
+    conn.close()
+    assert messages == ['Great job! You completed "c"', '1 task permanently deleted'], messages
+    print(f"✓ {len(messages)} notifications, none for the deleted task's completion")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_tasks_batch()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for the upload folder / media table reconciler
+"""
+
+import os
+
+from conftest import insert_media, temp_database, write_file
+from upload_reconciler import UploadReconciler
+
+
+def test_upload_reconciler():
+    print("Testing Upload Reconciler")
+    print("=" * 40)
+
+    day = 86400
+    with temp_database() as (tmp, db, conn):
+        uploads = os.path.join(tmp, 'uploads')
+
+        # 'ab.jpg' and 'ab-x.jpg' sort before the 'ab/' directory, as SQLite sorts the strings
+        blob = 'ab/cd/' + 'ab' * 32 + '.jpg'
+        kept = {
+            blob: write_file(uploads, blob, age=2 * day),
+            'ab.jpg': write_file(uploads, 'ab.jpg', age=2 * day),
+            'thumb_ab.jpg': write_file(uploads, 'thumb_ab.jpg', age=2 * day),  # pre-variant thumbnail
+            'ab/cd/variant_320w.webp': write_file(uploads, 'ab/cd/variant_320w.webp', age=2 * day),
+            'young.jpg': write_file(uploads, 'ab/young.jpg', age=60),
+            'partial': write_file(uploads, '.partial/upload.part', age=2 * day),
+        }
+        orphans = [write_file(uploads, name, age=2 * day) for name in ('ab-x.jpg', 'ab/cd/orphan.jpg', 'zz.jpg')]
+        blob_id = insert_media(conn, blob)
+        insert_media(conn, 'ab.jpg')
+        conn.execute('''INSERT INTO media_variants (media_id, width, height, filename, file_size)
+                        VALUES (?, 320, 240, 'ab/cd/variant_320w.webp', 4)''', (blob_id,))
+        missing_id = insert_media(conn, 'gone.jpg')
+        image_id = insert_media(conn, 'ef.jpg')
+        write_file(uploads, 'ef.jpg', age=2 * day)
+        conn.execute('''INSERT INTO media_variants (media_id, width, height, filename, file_size)
+                        VALUES (?, 320, 240, 'ef_320w.webp', 4)''', (image_id,))
+        conn.commit()
+
+        requeued = []
+        reconciler = UploadReconciler(db, uploads, lambda conn, media_id: requeued.append(media_id),
+                                      grace_seconds=day, batch_size=2, page_size=2, pause=0)
+
+        # Test 1: Dry run reports without touching anything
+        print("\n1. Dry run...")
+        report = reconciler.run(dry_run=True)
+        assert report['orphans'] == 3 and report['deleted'] == 0
+        assert report['recent_skipped'] == 1
+        assert all(os.path.exists(path) for path in orphans)
+        print(f"✓ Found {report['orphans']} orphans, deleted nothing")
+
+        # Test 2: Old orphans go; referenced, young and in-progress files stay
+        print("\n2. Reconciliation pass...")
+        report = reconciler.run()
+        assert 'error' not in report, report
+        assert report['deleted'] == 3
+        assert not any(os.path.exists(path) for path in orphans)
+        assert all(os.path.exists(path) for path in kept.values())
+        print(f"✓ Deleted {report['deleted']} orphans, kept referenced, young and partial files")
+
+        # Test 3: Rows whose files are missing
+        print("\n3. Missing files...")
+        assert report['missing_originals'] == 1 and report['missing_media_ids'] == [missing_id]
+        assert report['missing_variants'] == 1 and requeued == [image_id]
+        assert conn.execute('SELECT thumbnail_status FROM media WHERE id = ?', (image_id,)).fetchone()[0] == 'pending'
+        assert conn.execute('SELECT COUNT(*) FROM media_variants WHERE media_id = ?', (image_id,)).fetchone()[0] == 0
+        print("✓ Missing original reported, missing variant re-queued")
+
+        # Test 4: A file claimed after the scan is re-checked under the write lock
+        print("\n4. File claimed between scan and delete...")
+        claimed = 'ab/cd/claimed.jpg'
+        path = write_file(uploads, claimed, age=2 * day)
+        reconciler = UploadReconciler(db, uploads, lambda conn, media_id: None, grace_seconds=day, pause=0)
+        scan = reconciler.disk_files
+
+        def disk_files(directory=''):
+            # An upload takes the name right after the scan has judged it an orphan (the scan
+            # recurses through this wrapper, so only the top level claims it)
+            for path_stat in scan(directory):
+                yield path_stat
+                if not directory and path_stat[0] == claimed:
+                    insert_media(conn, claimed)
+                    conn.commit()
+
+        reconciler.disk_files = disk_files
+        report = reconciler.run()
+        assert 'error' not in report, report
+        assert report['orphans'] == 1 and report['deleted'] == 0 and os.path.exists(path)
+        assert conn.execute('SELECT ref_count FROM media_blobs WHERE filename = ?', (claimed,)).fetchone()[0] == 1
+        print("✓ Newly referenced file was kept")
+
+    print("\n" + "=" * 40)
+    print("Test completed!")
+
+
+if __name__ == "__main__":
+    test_upload_reconciler()
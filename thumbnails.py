@@ -0,0 +1,267 @@
+# thumbnails.py - Background thumbnail generation for uploaded images
+#
+# Every image gets a set of WebP variants (one per configured width), recorded
+# in media_variants (migration 12) so listings can offer them as a srcset.
+# Uploads only record a job in thumbnail_jobs (migration 11) and return.
+# A dispatcher thread claims jobs atomically and renders them on a process
+# pool, so resizing large photos never holds a request thread or the GIL.
+# The job table survives restarts. Jobs claimed by a worker that died are
+# picked up again once their lease expires, so several app processes can run
+# dispatchers against the same database.
+import glob
+import os
+import posixpath
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+VARIANT_WIDTHS = (320, 640, 1280)
+WEBP_QUALITY = 80
+WEBP_METHOD = 4  # encoder effort, 0 (fast) - 6 (smallest)
+IMAGE_EXTENSIONS = ('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp')
+
+
+def thumbnail_name(filename):
+    """Single-size thumbnail written before variants existed"""
+    directory, base = posixpath.split(filename)
+    return posixpath.join(directory, f"thumb_{base}")
+
+
+def variant_name(filename, width):
+    return f"{filename.rsplit('.', 1)[0]}_{width}w.webp"
+
+
+def derived_files(upload_folder, filename):
+    """Paths of every thumbnail/variant file derived from an upload"""
+    stem = filename.rsplit('.', 1)[0]
+    return ([os.path.join(upload_folder, thumbnail_name(filename))]
+            + glob.glob(os.path.join(glob.escape(upload_folder), f"{glob.escape(stem)}_*w.webp")))
+
+
+def create_variants(filepath, upload_folder, filename, widths=VARIANT_WIDTHS, quality=WEBP_QUALITY):
+    """Render WebP variants of an image (runs in a worker process).
+
+    Returns a list of {width, height, filename, file_size}, smallest first.
+    Widths at or above the source width are skipped; an image narrower than
+    every configured width gets a single variant at its own width.
+    """
+    with Image.open(filepath) as img:
+        if img.format == 'JPEG':
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale when that still covers the largest variant
+            img.draft(None, (max(widths), max(widths)))
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+        targets = [width for width in sorted(widths) if width < img.width] or [img.width]
+        variants = []
+        # Largest first, each resized from the previous one
+        for width in reversed(targets):
+            height = max(1, round(img.height * width / img.width))
+            if (width, height) != img.size:
+                img = img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+            name = variant_name(filename, width)
+            path = os.path.join(upload_folder, name)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            try:
+                img.save(tmp_path, format='WEBP', quality=quality, method=WEBP_METHOD)
+                # Readers never see a half-written variant
+                os.replace(tmp_path, path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            variants.append({'width': width, 'height': height, 'filename': name,
+                             'file_size': os.path.getsize(path)})
+    return variants[::-1]
+
+
+def reuse_variants(conn, media_id, filename):
+    """Copy the variants already rendered for the same stored file; True if any were copied"""
+    source = conn.execute('''SELECT id FROM media WHERE filename = ? AND id != ? AND thumbnail_status = 'ready'
+                             LIMIT 1''', (filename, media_id)).fetchone()
+    if source is None:
+        return False
+    cur = conn.execute('''INSERT INTO media_variants (media_id, width, height, filename, file_size)
+                          SELECT ?, width, height, filename, file_size FROM media_variants WHERE media_id = ?''',
+                       (media_id, source[0]))
+    return cur.rowcount > 0
+
+
+def load_variants(conn, media_ids):
+    """media_id -> list of variant rows (smallest first) for the given media"""
+    media_ids = list(media_ids)
+    variants = {}
+    for start in range(0, len(media_ids), 500):
+        chunk = media_ids[start:start + 500]
+        rows = conn.execute(f'''SELECT media_id, width, height, filename, file_size FROM media_variants
+                                WHERE media_id IN ({','.join('?' * len(chunk))})
+                                ORDER BY media_id, width''', chunk).fetchall()
+        for row in rows:
+            variants.setdefault(row['media_id'], []).append(row)
+    return variants
+
+
+class ThumbnailWorker:
+    def __init__(self, db, upload_folder, processes=2, poll_interval=2.0, max_attempts=3, lease_seconds=300,
+                 widths=VARIANT_WIDTHS, quality=WEBP_QUALITY):
+        self.db = db
+        self.upload_folder = upload_folder
+        self.widths = tuple(widths)
+        self.quality = quality
+        self.processes = processes
+        self.poll_interval = poll_interval  # seconds between polls when nothing was enqueued locally
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds  # after this a running job is assumed abandoned
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pool = None
+        self._running = {}  # future -> (job_id, media_id)
+        self._stats = {'completed': 0, 'failed': 0, 'retried': 0}
+
+    # --- producer side ---
+    def enqueue(self, conn, media_id):
+        """Queue a thumbnail for a media row; runs in the caller's transaction"""
+        conn.execute('INSERT OR IGNORE INTO thumbnail_jobs (media_id, created_at) VALUES (?, ?)',
+                     (media_id, time.time()))
+
+    def notify(self):
+        """Wake the dispatcher after committing new jobs"""
+        self._wake.set()
+
+    # --- dispatcher ---
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='thumbnail-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _claim(self, conn, limit):
+        now = time.time()
+        rows = conn.execute('''UPDATE thumbnail_jobs
+                               SET status = 'running', claimed_by = ?, claimed_at = ?, attempts = attempts + 1
+                               WHERE id IN (SELECT id FROM thumbnail_jobs
+                                            WHERE status = 'pending' OR (status = 'running' AND claimed_at < ?)
+                                            ORDER BY id LIMIT ?)
+                               RETURNING id, media_id''',
+                            (self.worker_id, now, now - self.lease_seconds, limit)).fetchall()
+        conn.commit()
+        jobs = []
+        for job_id, media_id in rows:
+            media = conn.execute('SELECT filename FROM media WHERE id = ?', (media_id,)).fetchone()
+            if media is None:
+                conn.execute('DELETE FROM thumbnail_jobs WHERE id = ?', (job_id,))
+                conn.commit()
+                continue
+            jobs.append((job_id, media_id, media[0]))
+        return jobs
+
+    def _finish(self, conn, job_id, media_id, error, variants=None):
+        if error is None:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM media_variants WHERE media_id = ?', (media_id,))
+            conn.executemany('''INSERT INTO media_variants (media_id, width, height, filename, file_size)
+                                SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM media WHERE id = ?)''',
+                             [(media_id, v['width'], v['height'], v['filename'], v['file_size'], media_id)
+                              for v in variants])
+            conn.execute("UPDATE media SET thumbnail_status = 'ready' WHERE id = ?", (media_id,))
+            conn.execute('DELETE FROM thumbnail_jobs WHERE id = ?', (job_id,))
+            conn.commit()
+            self._stats['completed'] += 1
+            return
+
+        print(f"Error creating thumbnail for media {media_id}: {error}")
+        attempts = conn.execute('SELECT attempts FROM thumbnail_jobs WHERE id = ?', (job_id,)).fetchone()
+        conn.execute('BEGIN IMMEDIATE')
+        if attempts and attempts[0] < self.max_attempts:
+            conn.execute("UPDATE thumbnail_jobs SET status = 'pending', last_error = ? WHERE id = ?",
+                         (str(error), job_id))
+            self._stats['retried'] += 1
+        else:
+            conn.execute("UPDATE media SET thumbnail_status = 'failed' WHERE id = ?", (media_id,))
+            conn.execute('DELETE FROM thumbnail_jobs WHERE id = ?', (job_id,))
+            self._stats['failed'] += 1
+        conn.commit()
+
+    def _run(self):
+        conn = self.db.connect()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self.run_once(conn)
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    print(f"Error in thumbnail dispatcher: {e}")
+                    time.sleep(self.poll_interval)
+        finally:
+            conn.close()
+            self.db.close_thread_connections()
+
+    def run_once(self, conn, timeout=None):
+        """Claim free slots' worth of jobs and collect finished ones"""
+        free = self.processes - len(self._running)
+        if free > 0:
+            jobs = self._claim(conn, free)
+            if jobs and self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.processes)
+            for index, (job_id, media_id, filename) in enumerate(jobs):
+                try:
+                    future = self._pool.submit(create_variants, os.path.join(self.upload_folder, filename),
+                                               self.upload_folder, filename, self.widths, self.quality)
+                except BrokenProcessPool as e:
+                    # A child died since the last pass; the claimed jobs count as failed attempts
+                    for job_id, media_id, _ in jobs[index:]:
+                        self._finish(conn, job_id, media_id, e)
+                    self._reset_pool(conn, e)
+                    break
+                self._running[future] = (job_id, media_id)
+
+        if not self._running:
+            self._wake.wait(self.poll_interval if timeout is None else timeout)
+            self._wake.clear()
+            return
+
+        done, _ = wait(list(self._running), timeout=self.poll_interval if timeout is None else timeout,
+                       return_when=FIRST_COMPLETED)
+        broken = None
+        for future in done:
+            job_id, media_id = self._running.pop(future)
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                broken = error
+            self._finish(conn, job_id, media_id, error, None if error else future.result())
+        if broken:
+            # A child was killed (e.g. out of memory); the pool cannot be used again
+            self._reset_pool(conn, broken)
+
+    def _reset_pool(self, conn, error):
+        """Fail every job of a broken pool and drop it, so the next pass creates a new one"""
+        for job_id, media_id in self._running.values():
+            self._finish(conn, job_id, media_id, error)
+        self._running.clear()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def get_stats(self):
+        conn = self.db.connect(readonly=True)
+        counts = dict(conn.execute('SELECT status, COUNT(*) FROM thumbnail_jobs GROUP BY status').fetchall())
+        conn.close()
+        return dict(self._stats, in_progress=len(self._running), pending_jobs=counts.get('pending', 0),
+                    running_jobs=counts.get('running', 0))
@@ -0,0 +1,179 @@
+# upload_reconciler.py - Find and remove upload files the database no longer references
+#
+# Files can outlive their rows: a crash between commit and unlink, a failed
+# unlink that was only logged, or an upload that died after writing its temp
+# file. Rows can also outlive their files. The reconciler compares the two
+# sides with a sorted merge. The upload folder is walked in path order, one
+# directory listing at a time. Referenced filenames (blobs with a non-zero
+# media_blobs.ref_count, and variants) are read in keyset pages in the same
+# order. Neither side is ever
+# loaded fully into memory.
+#
+# Files younger than the grace period are left alone, since an upload or a
+# thumbnail render may not have written its row yet. Orphans are deleted in
+# batches. Each file is checked again under the database write lock just
+# before it is unlinked, because uploads and renames place their files under
+# that lock (see media_store). Rows whose file is missing are reported. Missing
+# variants are queued for re-rendering; missing originals are only listed.
+import os
+import posixpath
+import time
+
+PARTIAL_DIR = '.partial'  # resumable uploads in progress, cleaned up by ChunkedUploadManager
+MISSING_SAMPLE_SIZE = 50
+
+
+class UploadReconciler:
+    def __init__(self, db, upload_folder, enqueue_thumbnail, grace_seconds=86400, batch_size=200,
+                 page_size=1000, pause=0.05):
+        """enqueue_thumbnail(conn, media_id) re-queues an image whose variants are missing"""
+        self.db = db
+        self.upload_folder = upload_folder
+        self.enqueue_thumbnail = enqueue_thumbnail
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size  # files deleted per write transaction
+        self.page_size = page_size  # referenced filenames read per query
+        self.pause = pause  # seconds between delete batches
+
+    def disk_files(self, directory=''):
+        """Yield (relative path, stat) of every file, sorted like SQLite sorts the path strings"""
+        with os.scandir(os.path.join(self.upload_folder, directory)) as it:
+            # 'ab/...' must come after 'ab-x.jpg' and 'ab.jpg', as in a plain string sort
+            entries = sorted(((entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name), entry)
+                             for entry in it)
+        for key, entry in entries:
+            path = posixpath.join(directory, entry.name)
+            if key.endswith('/'):
+                if path != PARTIAL_DIR:
+                    yield from self.disk_files(path)
+            elif entry.is_file(follow_symlinks=False):
+                yield path, entry.stat(follow_symlinks=False)
+
+    def referenced_files(self, conn):
+        """Yield every filename used by a media or variant row, in sorted order, one page at a time"""
+        last = ''
+        while True:
+            rows = conn.execute('''SELECT filename FROM media_blobs WHERE filename > ? AND ref_count > 0
+                                   UNION
+                                   SELECT filename FROM media_variants WHERE filename > ?
+                                   ORDER BY filename LIMIT ?''', (last, last, self.page_size)).fetchall()
+            for (filename,) in rows:
+                yield filename
+            if len(rows) < self.page_size:
+                return
+            last = rows[-1][0]
+
+    def is_referenced(self, conn, filename):
+        if conn.execute('''SELECT 1 FROM media_blobs WHERE filename = ? AND ref_count > 0
+                           UNION ALL SELECT 1 FROM media_variants WHERE filename = ? LIMIT 1''',
+                        (filename, filename)).fetchone():
+            return True
+        directory, base = posixpath.split(filename)
+        if base.startswith('thumb_'):
+            # Single-size thumbnail from before variants; belongs to its original
+            original = posixpath.join(directory, base[len('thumb_'):])
+            return conn.execute('SELECT 1 FROM media_blobs WHERE filename = ? AND ref_count > 0',
+                                (original,)).fetchone() is not None
+        return False
+
+    def run(self, dry_run=False, grace_seconds=None):
+        """Reconcile the upload folder with the database; returns a report dict"""
+        started = time.time()
+        grace = self.grace_seconds if grace_seconds is None else grace_seconds
+        cutoff = started - grace
+        report = {'dry_run': dry_run, 'files_scanned': 0, 'orphans': 0, 'orphan_bytes': 0, 'deleted': 0,
+                  'deleted_bytes': 0, 'recent_skipped': 0, 'missing_originals': 0, 'missing_variants': 0,
+                  'requeued': 0, 'missing_media_ids': []}
+        conn = self.db.connect()
+        try:
+            batch = []
+            disk = self.disk_files()
+            referenced = self.referenced_files(conn)
+            file = next(disk, None)
+            row = next(referenced, None)
+            while file is not None or row is not None:
+                if row is None or (file is not None and file[0] < row):
+                    path, stat = file
+                    report['files_scanned'] += 1
+                    if stat.st_mtime > cutoff:
+                        report['recent_skipped'] += 1
+                    elif not self.is_referenced(conn, path):
+                        report['orphans'] += 1
+                        report['orphan_bytes'] += stat.st_size
+                        batch.append((path, stat.st_size))
+                        if len(batch) >= self.batch_size:
+                            self._delete_batch(conn, batch, cutoff, report, dry_run)
+                            batch = []
+                    file = next(disk, None)
+                elif file is None or row < file[0]:
+                    self._missing(conn, row, report, dry_run)
+                    row = next(referenced, None)
+                else:
+                    report['files_scanned'] += 1
+                    file = next(disk, None)
+                    row = next(referenced, None)
+            if batch:
+                self._delete_batch(conn, batch, cutoff, report, dry_run)
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"Error reconciling uploads: {e}")
+            report['error'] = str(e)
+        finally:
+            conn.close()
+        report['duration_seconds'] = round(time.time() - started, 3)
+        print(f"Upload reconciliation{' (dry run)' if dry_run else ''}: {report['orphans']} orphaned files "
+              f"({report['orphan_bytes']} bytes), {report['deleted']} deleted, "
+              f"{report['missing_originals']} missing originals, {report['missing_variants']} missing variants")
+        return report
+
+    def _delete_batch(self, conn, batch, cutoff, report, dry_run):
+        if dry_run:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for filename, size in batch:
+                # An upload, rename or re-render may have claimed the name since it was scanned
+                if self.is_referenced(conn, filename):
+                    continue
+                path = os.path.join(self.upload_folder, filename)
+                try:
+                    if os.stat(path).st_mtime > cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                conn.execute('DELETE FROM media_blobs WHERE filename = ? AND ref_count <= 0', (filename,))
+                report['deleted'] += 1
+                report['deleted_bytes'] += size
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        time.sleep(self.pause)
+
+    def _missing(self, conn, filename, report, dry_run):
+        """A referenced file that is not on disk"""
+        media_ids = [r[0] for r in conn.execute('SELECT id FROM media WHERE filename = ?', (filename,))]
+        if media_ids:
+            report['missing_originals'] += len(media_ids)
+            room = MISSING_SAMPLE_SIZE - len(report['missing_media_ids'])
+            report['missing_media_ids'].extend(media_ids[:max(room, 0)])
+            return
+
+        media_ids = [r[0] for r in conn.execute('SELECT media_id FROM media_variants WHERE filename = ?',
+                                                (filename,))]
+        report['missing_variants'] += len(media_ids)
+        if dry_run or not media_ids:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for media_id in media_ids:
+                conn.execute('DELETE FROM media_variants WHERE media_id = ?', (media_id,))
+                conn.execute("UPDATE media SET thumbnail_status = 'pending' WHERE id = ?", (media_id,))
+                self.enqueue_thumbnail(conn, media_id)
+                report['requeued'] += 1
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
@@ -0,0 +1,105 @@
+# user_stats.py - Incrementally maintained per-user task and media counters
+#
+# The user_stats row for a user is kept current by triggers on tasks and
+# media (see migration 5), so every write updates it in its own transaction.
+# The helpers here read it, and rebuild it from scratch when it drifts.
+# data_version (migration 6) is bumped on every task or media write and
+# drives the ETags of the polling endpoints. total_media and media_bytes
+# (migration 18) are the storage counters that upload quotas are checked
+# against, so a check is one primary-key read.
+
+STAT_FIELDS = ('total_tasks', 'completed_tasks', 'pending_tasks', 'total_media', 'tasks_with_media', 'media_bytes')
+
+# Counters recomputed from the source tables, one row per user
+RECOMPUTE_SQL = '''
+    SELECT u.id AS user_id,
+           (SELECT COUNT(*) FROM tasks WHERE user_id = u.id) AS total_tasks,
+           (SELECT COUNT(*) FROM tasks WHERE user_id = u.id AND completed = 1) AS completed_tasks,
+           (SELECT COUNT(*) FROM tasks WHERE user_id = u.id AND completed = 0) AS pending_tasks,
+           (SELECT COUNT(*) FROM media WHERE user_id = u.id) AS total_media,
+           (SELECT COUNT(DISTINCT task_id) FROM media
+             WHERE user_id = u.id AND task_id IS NOT NULL) AS tasks_with_media,
+           (SELECT COALESCE(SUM(file_size), 0) FROM media WHERE user_id = u.id) AS media_bytes
+    FROM (SELECT id FROM users
+          UNION SELECT user_id FROM tasks
+          UNION SELECT user_id FROM media) u
+'''
+
+OVERDUE_SQL = '''SELECT COUNT(*) as overdue FROM tasks
+                 WHERE user_id = ? AND completed = 0 AND due_date IS NOT NULL AND due_date < date('now')'''
+
+
+def get_user_stats(conn, user_id):
+    """Read a user's counters plus the live overdue count"""
+    row = conn.execute(f"SELECT {', '.join(STAT_FIELDS)} FROM user_stats WHERE user_id = ?",
+                       (user_id,)).fetchone()
+    stats = dict(zip(STAT_FIELDS, row)) if row else dict.fromkeys(STAT_FIELDS, 0)
+    stats['overdue_tasks'] = conn.execute(OVERDUE_SQL, (user_id,)).fetchone()[0]
+    return stats
+
+
+def get_data_version(conn, user_id):
+    """Return the counter that every task and media write for this user bumps"""
+    row = conn.execute('SELECT data_version FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def rebuild_user_stats(conn):
+    """Recompute every user's counters from scratch (caller commits)"""
+    # Migrations that run before a counter's column exists rebuild the others
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(user_stats)').fetchall()}
+    fields = [field for field in STAT_FIELDS if field in columns]
+    for row in conn.execute(RECOMPUTE_SQL).fetchall():
+        values = dict(zip(('user_id',) + STAT_FIELDS, row))
+        conn.execute(f'''INSERT INTO user_stats (user_id, {', '.join(fields)})
+                         VALUES (?, {', '.join('?' for _ in fields)})
+                         ON CONFLICT (user_id) DO UPDATE SET
+                         {', '.join(f'{field} = excluded.{field}' for field in fields)}''',
+                     (values['user_id'],) + tuple(values[field] for field in fields))
+
+
+def check_user_stats(conn, repair=False):
+    """Compare stored counters with freshly computed ones.
+
+    Returns a list of drift entries ({user_id, field, stored, actual}).
+    With repair=True the counters are rebuilt and committed.
+    """
+    stored = {row[0]: tuple(row[1:]) for row in
+              conn.execute(f"SELECT user_id, {', '.join(STAT_FIELDS)} FROM user_stats").fetchall()}
+    drift = []
+    for row in conn.execute(RECOMPUTE_SQL).fetchall():
+        user_id, actual = row[0], tuple(row[1:])
+        current = stored.get(user_id, (0,) * len(STAT_FIELDS))
+        for field, stored_value, actual_value in zip(STAT_FIELDS, current, actual):
+            if stored_value != actual_value:
+                drift.append({
+                    'user_id': user_id,
+                    'field': field,
+                    'stored': stored_value,
+                    'actual': actual_value,
+                })
+
+    if repair and drift:
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild_user_stats(conn)
+        # Repaired counters must not be served from a client's cached copy
+        conn.executemany('UPDATE user_stats SET data_version = data_version + 1 WHERE user_id = ?',
+                         [(user_id,) for user_id in {entry['user_id'] for entry in drift}])
+        conn.commit()
+    return drift
+
+
+def get_storage_usage(conn, user_id):
+    """(files, bytes) a user has stored, from the counters"""
+    row = conn.execute('SELECT total_media, media_bytes FROM user_stats WHERE user_id = ?', (user_id,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def storage_usage_by_task(conn, user_id):
+    """Files and bytes per task (None for unattached media), largest first"""
+    rows = conn.execute('''SELECT m.task_id, t.title, COUNT(*) AS files, SUM(m.file_size) AS bytes
+                           FROM media m LEFT JOIN tasks t ON t.id = m.task_id
+                           WHERE m.user_id = ?
+                           GROUP BY m.task_id
+                           ORDER BY bytes DESC''', (user_id,)).fetchall()
+    return [{'task_id': row[0], 'title': row[1], 'files': row[2], 'bytes': row[3]} for row in rows]